@@ -0,0 +1,318 @@
+"""
+Columnar analytics mirror for heavy reports
+
+Orders, financials and users are copied into an embedded DuckDB file next
+to the database (data.db -> data.db.duckdb). Once created with
+`python app_cli.py analytics` it is refreshed after each import, and
+rankings, the sales cube and reconciliation scan its columns instead of
+SQLite's rows. The mirror records the import generation it was copied from; when it is
+missing, stale or DuckDB is not installed, callers fall back to SQLite.
+
+DuckDB is optional: pip install duckdb. With its sqlite extension
+installed (INSTALL sqlite) the tables are copied by DuckDB itself;
+otherwise they are streamed through Python in chunks.
+"""
+import os
+import tempfile
+import time
+from importlib.util import find_spec
+from models import User, Order, Financial, connect_read_only
+from reconciliation import TOLERANCE
+
+MIRROR_SUFFIX = '.duckdb'
+COPY_CHUNK = 100000  # rows per chunk when copying without the sqlite extension
+MIRRORED_TABLES = (User, Order, Financial)
+
+# Cube dimension -> column of orders joined to users (see cube.DIMENSIONS)
+CUBE_COLUMNS = {
+    'customer': 'o.subscription_code',
+    'province': 'u.province',
+    'city': 'u.city',
+    'marketer': 'o.marketer_code',
+    'warehouse': 'o.warehouse_code',
+}
+
+# Per-customer totals, the same as reconciliation.SHARD_SQL over all codes
+CUSTOMER_TOTALS_SQL = """
+    WITH o AS (
+        SELECT subscription_code, SUM(total_value) AS total, COUNT(*) AS n
+        FROM orders WHERE subscription_code IS NOT NULL GROUP BY subscription_code
+    ), f AS (
+        SELECT subscription_code, SUM(amount) AS total, COUNT(*) AS n
+        FROM financials WHERE subscription_code IS NOT NULL GROUP BY subscription_code
+    )
+    SELECT subscription_code,
+           coalesce(o.total, 0) AS order_total, coalesce(o.n, 0) AS order_lines,
+           coalesce(f.total, 0) AS financial_total, coalesce(f.n, 0) AS financial_rows,
+           coalesce(o.total, 0) - coalesce(f.total, 0) AS difference
+    FROM o FULL OUTER JOIN f USING (subscription_code)
+"""
+
+
+def available():
+    """True when the duckdb package is installed (it is not imported)"""
+    return find_spec('duckdb') is not None
+
+
+def _duckdb_type(column):
+    """DuckDB type of a model column"""
+    name = type(column.type).__name__
+    if name in ('Integer', 'BigInteger'):
+        return 'BIGINT'
+    if name == 'Float':
+        return 'DOUBLE'
+    return 'VARCHAR'
+
+
+class AnalyticsMirror:
+    """The DuckDB copy of one database file"""
+
+    def __init__(self, db_path='data.db', immutable=False):
+        self.db_path = os.path.abspath(db_path)
+        self.path = self.db_path + MIRROR_SUFFIX
+        self.immutable = immutable
+
+    def source_generation(self):
+        """Import generation of the SQLite database"""
+        conn = connect_read_only(self.db_path, self.immutable)
+        try:
+            row = conn.execute("SELECT value FROM app_meta WHERE key = 'import_generation'").fetchone()
+            return row[0] if row else 0
+        except Exception:
+            return 0
+        finally:
+            conn.close()
+
+    def generation(self):
+        """Import generation the mirror was copied from, or None when there is no usable mirror"""
+        if not available() or not os.path.exists(self.path):
+            return None
+        try:
+            con = self.connect()
+            try:
+                return con.execute("SELECT generation FROM mirror_meta").fetchone()[0]
+            finally:
+                con.close()
+        except Exception:
+            return None
+
+    def is_current(self, generation=None):
+        """True when the mirror holds the data of `generation` (the current import generation by default)"""
+        copied = self.generation()
+        return copied is not None and copied == (self.source_generation() if generation is None else generation)
+
+    def connect(self):
+        """Read-only DuckDB connection to the mirror"""
+        import duckdb
+
+        return duckdb.connect(self.path, read_only=True)
+
+    def refresh(self, log_callback=None, generation=None):
+        """Copy the tables into a new mirror file and swap it in; returns the seconds taken
+
+        The copy is read in one SQLite transaction, so the three tables
+        match each other and the generation recorded with them. An import
+        passes the generation it is about to publish.
+        """
+        import duckdb
+
+        started = time.perf_counter()
+        # A new name per refresh, so concurrent refreshes never write the same file
+        fd, building = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.building',
+                                        dir=os.path.dirname(self.path))
+        os.close(fd)
+        os.remove(building)  # DuckDB creates the file itself
+
+        con = duckdb.connect(building)
+        try:
+            try:
+                con.execute("LOAD sqlite")
+                copied = self._copy_attached(con)
+                method = 'sqlite extension'
+            except duckdb.Error:
+                # Extension not installed (it is downloaded by INSTALL sqlite)
+                copied = self._copy_chunked(con)
+                method = 'chunked copy'
+            if generation is None:
+                generation = copied
+            con.execute("CREATE TABLE mirror_meta (generation BIGINT)")
+            con.execute("INSERT INTO mirror_meta VALUES (?)", [generation])
+            con.execute("CHECKPOINT")
+        except Exception:
+            con.close()
+            for path in (building, building + '.wal'):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        con.close()
+
+        # Readers that already opened the old file keep reading it
+        os.replace(building, self.path)
+        seconds = time.perf_counter() - started
+        if log_callback:
+            log_callback(f"🦆 Analytics mirror refreshed in {seconds:.1f}s ({method})")
+        return seconds
+
+    def _copy_attached(self, con):
+        """Copy the tables with DuckDB's sqlite scanner and return the generation copied"""
+        con.execute("ATTACH ? AS source (TYPE sqlite, READ_ONLY)", [self.db_path])
+        try:
+            con.execute("BEGIN")
+            generation = con.execute(
+                "SELECT value FROM source.app_meta WHERE key = 'import_generation'"
+            ).fetchone()
+            for model in MIRRORED_TABLES:
+                name = model.__tablename__
+                con.execute(f"CREATE TABLE {name} AS SELECT * FROM source.{name}")
+            con.execute("COMMIT")
+        finally:
+            con.execute("DETACH source")
+        return generation[0] if generation else 0
+
+    def _copy_chunked(self, con):
+        """Stream the tables from SQLite in chunks and return the generation copied"""
+        import pandas as pd
+
+        source = connect_read_only(self.db_path, self.immutable)
+        try:
+            source.execute("BEGIN")
+            generation = source.execute(
+                "SELECT value FROM app_meta WHERE key = 'import_generation'"
+            ).fetchone()
+            for model in MIRRORED_TABLES:
+                name = model.__tablename__
+                columns = list(model.__table__.columns)
+                con.execute(f"CREATE TABLE {name} ({', '.join(f'{c.name} {_duckdb_type(c)}' for c in columns)})")
+
+                # SQLite columns may hold mixed types; text columns are read as text
+                select_list = ', '.join(
+                    f"CAST({c.name} AS TEXT)" if _duckdb_type(c) == 'VARCHAR' else c.name for c in columns
+                )
+                cursor = source.execute(f"SELECT {select_list} FROM {name}")
+                names = [c.name for c in columns]
+                while True:
+                    rows = cursor.fetchmany(COPY_CHUNK)
+                    if not rows:
+                        break
+                    # Untyped columns: DuckDB casts them to the table's types on insert
+                    chunk = pd.DataFrame(rows, columns=names, dtype=object)
+                    con.register('chunk', chunk)
+                    con.execute(f"INSERT INTO {name} SELECT * FROM chunk")
+                    con.unregister('chunk')
+            source.execute("COMMIT")
+        finally:
+            source.close()
+        return generation[0] if generation else 0
+
+    # Reports
+
+    def top_users(self, limit=10):
+        """Return (code, name, surname, total) rows of the top customers, like queries.top_users"""
+        con = self.connect()
+        try:
+            return con.execute(
+                "SELECT u.subscription_code, any_value(u.name), any_value(u.surname), SUM(o.total_value) AS total "
+                "FROM users u JOIN orders o ON o.subscription_code = u.subscription_code "
+                "GROUP BY u.subscription_code ORDER BY total DESC LIMIT ?", [limit]
+            ).fetchall()
+        finally:
+            con.close()
+
+    def sales_cube(self, dimensions=None):
+        """Aggregate the cube dimensions in one GROUPING SETS query; returns sales_cube rows as dicts"""
+        from cube import UNKNOWN
+
+        dimensions = list(dimensions or CUBE_COLUMNS)
+        # A member is the grouped column as text; NULL in every other column of its grouping set
+        member = ' '.join(f"WHEN GROUPING({CUBE_COLUMNS[name]}) = 0 THEN CAST({CUBE_COLUMNS[name]} AS VARCHAR)"
+                          for name in dimensions)
+        dimension = ' '.join(f"WHEN GROUPING({CUBE_COLUMNS[name]}) = 0 THEN '{name}'" for name in dimensions)
+        sets = ', '.join(f"({CUBE_COLUMNS[name]})" for name in dimensions)
+
+        con = self.connect()
+        try:
+            rows = con.execute(
+                f"SELECT CASE {dimension} END, coalesce(CASE {member} END, ?), "
+                f"COUNT(*), coalesce(SUM(o.total_value), 0) "
+                f"FROM orders o LEFT JOIN users u ON u.subscription_code = o.subscription_code "
+                f"GROUP BY GROUPING SETS ({sets})", [UNKNOWN]
+            ).fetchall()
+        finally:
+            con.close()
+        return [{'dimension': name, 'member': value, 'order_lines': int(lines), 'total_value': float(total)}
+                for name, value, lines, total in rows]
+
+    def cube_top(self, dimension, limit=10):
+        """Return [(member, order_lines, total_value)] of the largest members of a cube dimension"""
+        from cube import UNKNOWN
+
+        column = CUBE_COLUMNS[dimension]
+        con = self.connect()
+        try:
+            return con.execute(
+                f"SELECT coalesce(CAST({column} AS VARCHAR), ?), COUNT(*), coalesce(SUM(o.total_value), 0) AS total "
+                f"FROM orders o LEFT JOIN users u ON u.subscription_code = o.subscription_code "
+                f"GROUP BY {column} ORDER BY total DESC LIMIT ?", [UNKNOWN, limit]
+            ).fetchall()
+        finally:
+            con.close()
+
+    def reconcile(self):
+        """Reconcile every customer in one pass; returns a report like ReconciliationRunner.run"""
+        con = self.connect()
+        try:
+            con.execute(f"CREATE TEMP VIEW customer_totals AS {CUSTOMER_TOTALS_SQL}")
+            customers, matched, orders_total, financials_total, order_lines, financial_rows = con.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE abs(difference) < ?), "
+                "coalesce(SUM(order_total), 0), coalesce(SUM(financial_total), 0), "
+                "coalesce(SUM(order_lines), 0), coalesce(SUM(financial_rows), 0) FROM customer_totals",
+                [TOLERANCE]
+            ).fetchone()
+            mismatches = con.execute(
+                "SELECT subscription_code, order_total, financial_total, difference FROM customer_totals "
+                "WHERE abs(difference) >= ? ORDER BY abs(difference) DESC", [TOLERANCE]
+            ).fetchall()
+        finally:
+            con.close()
+
+        return {
+            'engine': 'duckdb',
+            'shards': 1,
+            'workers': 1,
+            'customers': customers,
+            'matched': matched,
+            'orders_total': float(orders_total),
+            'financials_total': float(financials_total),
+            'order_lines': int(order_lines),
+            'financial_rows': int(financial_rows),
+            'mismatches': mismatches,
+            'difference': float(orders_total) - float(financials_total),
+        }
+
+
+def current_mirror(db_path, immutable=False, generation=None):
+    """The analytics mirror of a database when it is up to date, else None (use SQLite)"""
+    mirror = AnalyticsMirror(db_path, immutable)
+    return mirror if mirror.is_current(generation) else None
+
+
+def refresh_mirror(db_path, log_callback=None, create=False, generation=None):
+    """Bring the mirror of a database up to date if it has one (or create=True) and DuckDB is installed
+
+    `generation` is the import generation the mirror is copied for (the
+    current one by default). Failures are logged, not raised: reports then
+    fall back to SQLite.
+    """
+    if not available():
+        return False
+    mirror = AnalyticsMirror(db_path)
+    if not create and not os.path.exists(mirror.path):
+        return False
+    try:
+        if not mirror.is_current(generation):
+            mirror.refresh(log_callback, generation)
+        return True
+    except Exception as e:
+        if log_callback:
+            log_callback(f"⚠️ Analytics mirror not refreshed, reports use SQLite: {e}")
+        return False
@@ -7,32 +7,38 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
 import threading
 import os
-from models import Database, User, Order, Financial
+import sys
+from models import Database, User, Financial
 from data_processor import DataProcessor
+import queries
+from exporter import Exporter, DATASETS
+from cube import SalesCube, DIMENSION_LABELS
+from progress import CancelToken, format_progress
 
 
 class CrossCheckApp:
     """Main application window"""
 
-    def __init__(self, root):
+    def __init__(self, root, read_only=False):
         self.root = root
         self.root.title("Cross Check - مدیریت اطلاعات")
         self.root.geometry("1200x700")
 
         # Database and processor
         self.db_path = 'data.db'
-        self.db = Database(self.db_path)
-        self.processor = DataProcessor(self.db_path)
+        self.db = Database(self.db_path, read_only=read_only)
+        self.processor = DataProcessor(db=self.db)
+        self.cube = SalesCube(self.db)
 
-        # Create database tables if not exist
-        self.db.create_tables()
+        # Create or upgrade tables only if the stored schema version is outdated
+        self.db.ensure_schema()
 
         # Initialize UI
         self.create_menu()
         self.create_tabs()
         self.create_status_bar()
 
-        # Load initial data
+        # Tabs load when first shown; see refresh_visible_tab
         self.refresh_all_views()
 
     def create_menu(self):
@@ -44,6 +50,7 @@ class CrossCheckApp:
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Import Data", command=self.show_import_tab)
+        file_menu.add_command(label="Export Data...", command=self.show_export_dialog)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
 
@@ -69,6 +76,17 @@ class CrossCheckApp:
         self.create_financials_tab()
         self.create_statistics_tab()
 
+        # Data tabs are filled lazily: tab widget name -> loader, and the
+        # import generation each tab last rendered
+        self.tab_loaders = {
+            str(self.users_frame): self.load_users,
+            str(self.orders_frame): self.load_orders,
+            str(self.financials_frame): self.load_financials,
+            str(self.stats_frame): self.load_statistics,
+        }
+        self.rendered_generation = {}
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event: self.refresh_visible_tab())
+
     def create_status_bar(self):
         """Create status bar at bottom"""
         self.status_frame = tk.Frame(self.root, relief=tk.SUNKEN, bd=1)
@@ -117,13 +135,32 @@ class CrossCheckApp:
         tk.Entry(file_frame, textvariable=self.excel3_path, width=50).grid(row=2, column=1, padx=5)
         tk.Button(file_frame, text="Browse", command=lambda: self.browse_file(self.excel3_path)).grid(row=2, column=2)
 
+        # Append mode keeps existing rows and skips duplicate order lines
+        self.append_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.import_frame, text="Keep existing data (append new rows only)",
+                       variable=self.append_mode).pack()
+
         # Import button
         self.import_button = tk.Button(self.import_frame, text="🚀 Start Import",
                                       command=self.start_import,
                                       bg="#4CAF50", fg="white",
                                       font=("Arial", 12, "bold"),
                                       padx=20, pady=10)
-        self.import_button.pack(pady=20)
+        self.import_button.pack(pady=(20, 5))
+        if self.db.read_only:
+            self.import_button.config(state=tk.DISABLED, text="🔒 Read-only database")
+
+        # Progress of the running import; Cancel stops it at the next batch
+        progress_frame = tk.Frame(self.import_frame)
+        progress_frame.pack(padx=20, fill="x")
+        self.import_progress = ttk.Progressbar(progress_frame, mode='determinate', maximum=100)
+        self.import_progress.pack(side=tk.LEFT, fill="x", expand=True)
+        self.cancel_button = tk.Button(progress_frame, text="⏹ Cancel", command=self.cancel_import,
+                                       state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=(10, 0))
+        self.progress_label = tk.Label(self.import_frame, text="", anchor="w")
+        self.progress_label.pack(padx=20, fill="x")
+        self.cancel_token = None
 
         # Log area
         log_frame = tk.LabelFrame(self.import_frame, text="Import Log", padx=10, pady=10)
@@ -161,32 +198,75 @@ class CrossCheckApp:
         # Disable button
         self.import_button.config(state=tk.DISABLED, text="⏳ Importing...")
         self.import_log.delete(1.0, tk.END)
+        self.cancel_token = CancelToken()
+        self.cancel_button.config(state=tk.NORMAL)
 
         # Run in thread
         thread = threading.Thread(target=self.do_import, daemon=True)
         thread.start()
 
+    def cancel_import(self):
+        """Ask the running import to stop at the next batch"""
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_label.config(text="⏹ Cancelling after the current batch...")
+
+    def report_progress(self, event):
+        """Progress callback of the import thread; the widgets are updated on the UI thread"""
+        self.root.after(0, lambda: self.show_progress(event))
+
+    def show_progress(self, event):
+        """Show an import progress event in the progress bar and label"""
+        if event['total']:
+            if str(self.import_progress.cget('mode')) != 'determinate':
+                self.import_progress.stop()
+                self.import_progress.config(mode='determinate')
+            self.import_progress['value'] = min(100, 100 * event['rows'] / event['total'])
+        elif not event['done'] and str(self.import_progress.cget('mode')) != 'indeterminate':
+            self.import_progress.config(mode='indeterminate')
+            self.import_progress.start(20)
+        if not (self.cancel_token and self.cancel_token.cancelled):
+            self.progress_label.config(text=format_progress(event))
+
     def do_import(self):
         """Perform data import"""
         try:
-            self.processor = DataProcessor(self.db_path)
+            self.processor = DataProcessor(db=self.db)
             stats = self.processor.import_all_data(
                 self.excel1_path.get(),
                 self.excel2_path.get(),
                 self.excel3_path.get(),
-                log_callback=self.log_message
+                log_callback=self.log_message,
+                replace=not self.append_mode.get(),
+                shadow=not self.append_mode.get(),
+                progress_callback=self.report_progress,
+                cancel_token=self.cancel_token
             )
 
             # Refresh all views
             self.root.after(0, self.refresh_all_views)
 
+            if stats['cancelled']:
+                kept = "The current data was kept." if not self.append_mode.get() else \
+                    "Batches written before the cancel were kept."
+                self.root.after(0, lambda: messagebox.showinfo("Cancelled", f"Import cancelled.\n\n{kept}"))
+                return
+
             # Show completion message
             self.root.after(0, lambda: messagebox.showinfo(
                 "Success",
                 f"Import completed!\n\n"
                 f"Users: {stats['users_imported']}\n"
                 f"Orders: {stats['orders_imported']}\n"
+                f"Duplicate orders skipped: {stats['orders_duplicates']}\n"
                 f"Financials: {stats['financials_imported']}\n"
+                f"Duplicate financial records skipped: {stats['financials_duplicates']}\n"
+                f"Rejected by validation: {stats['rows_rejected']}\n"
+                f"Validation warnings: {sum(stats['validation'].values())}\n"
+                f"Rows changed: {sum(stats['changes'].values())}\n"
+                f"Orders without a customer: {stats['orphans']['orders']['rows']}\n"
+                f"Financials without a customer: {stats['orphans']['financials']['rows']}\n"
                 f"Errors: {len(stats['errors'])}"
             ))
 
@@ -195,10 +275,74 @@ class CrossCheckApp:
             self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
 
         finally:
-            self.root.after(0, lambda: self.import_button.config(
-                state=tk.NORMAL,
-                text="🚀 Start Import"
-            ))
+            self.root.after(0, self.finish_import)
+
+    def finish_import(self):
+        """Re-enable the import button and reset the progress widgets"""
+        self.import_button.config(state=tk.NORMAL, text="🚀 Start Import")
+        self.cancel_button.config(state=tk.DISABLED)
+        self.import_progress.stop()
+        self.import_progress.config(mode='determinate', value=0)
+        self.progress_label.config(text="")
+        self.cancel_token = None
+
+    # ==================== EXPORT ====================
+
+    def show_export_dialog(self):
+        """Ask what to export, then pick a file and export in the background"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Export Data")
+        dialog.transient(self.root)
+
+        labels = list(DATASETS.values())
+        dataset_var = tk.StringVar(value=labels[0])
+        option_var = tk.StringVar(value=self.users_search.get().strip())
+
+        tk.Label(dialog, text="Dataset:").grid(row=0, column=0, sticky="w", padx=10, pady=5)
+        ttk.Combobox(dialog, textvariable=dataset_var, values=labels,
+                     state="readonly", width=35).grid(row=0, column=1, padx=10, pady=5)
+        tk.Label(dialog, text="Top N / Search term:").grid(row=1, column=0, sticky="w", padx=10, pady=5)
+        tk.Entry(dialog, textvariable=option_var, width=38).grid(row=1, column=1, padx=10, pady=5)
+
+        def start_export():
+            dataset = list(DATASETS)[labels.index(dataset_var.get())]
+            option = option_var.get().strip()
+            if dataset == 'user_search' and not option:
+                messagebox.showerror("Error", "Please enter a search term!", parent=dialog)
+                return
+
+            path = filedialog.asksaveasfilename(
+                parent=dialog,
+                title="Export To",
+                defaultextension=".xlsx",
+                initialfile=f"{dataset}.xlsx",
+                filetypes=[("Excel workbook", "*.xlsx"), ("CSV file", "*.csv")]
+            )
+            if not path:
+                return
+            dialog.destroy()
+
+            limit = int(option) if dataset == 'top_users' and option.isdigit() else None
+            term = option if dataset == 'user_search' else None
+            thread = threading.Thread(target=self.do_export, args=(dataset, path, limit, term), daemon=True)
+            thread.start()
+
+        tk.Button(dialog, text="📤 Export...", command=start_export).grid(row=2, column=0, columnspan=2, pady=10)
+
+    def do_export(self, dataset, path, limit=None, term=None):
+        """Run an export and report progress in the status bar"""
+        def progress_callback(done, total):
+            self.root.after(0, lambda: self.update_status(f"Exporting... {done:,} / {total:,} rows"))
+
+        try:
+            count = Exporter(self.db).export(dataset, path, progress_callback=progress_callback,
+                                             limit=limit, term=term)
+            self.root.after(0, lambda: self.update_status(f"Exported {count:,} rows to {path}"))
+            self.root.after(0, lambda: messagebox.showinfo("Export", f"Exported {count:,} rows to:\n{path}"))
+
+        except Exception as e:
+            error = str(e)
+            self.root.after(0, lambda: messagebox.showerror("Error", error))
 
     # ==================== USERS TAB ====================
 
@@ -261,6 +405,9 @@ class CrossCheckApp:
         v_scroll.pack(side=tk.RIGHT, fill="y")
         h_scroll.pack(side=tk.BOTTOM, fill="x")
 
+        # Double-click opens the customer view
+        self.users_tree.bind("<Double-1>", self.show_customer)
+
         # Count label
         self.users_count_label = tk.Label(self.users_frame, text="Total: 0 users")
         self.users_count_label.pack(pady=5)
@@ -310,12 +457,7 @@ class CrossCheckApp:
 
         session = self.db.get_session()
         try:
-            users = session.query(User).filter(
-                (User.name.like(f"%{search_term}%")) |
-                (User.surname.like(f"%{search_term}%")) |
-                (User.mobile.like(f"%{search_term}%")) |
-                (User.national_id.like(f"%{search_term}%"))
-            ).all()
+            users = queries.search_users(session, search_term).all()
 
             for user in users:
                 self.users_tree.insert("", "end", values=(
@@ -335,6 +477,101 @@ class CrossCheckApp:
         finally:
             session.close()
 
+    # ==================== CUSTOMER VIEW ====================
+
+    def show_customer(self, event=None):
+        """Open the selected customer's orders, financials and reconciliation totals"""
+        selection = self.users_tree.selection()
+        if not selection:
+            return
+        code = int(self.users_tree.item(selection[0], "values")[0])
+
+        session = self.db.get_session()
+        try:
+            detail = queries.customer_detail(session, code)
+        finally:
+            session.close()
+        if detail is None:
+            messagebox.showerror("Error", f"Customer {code} no longer exists.")
+            return
+
+        user = detail['user']
+        window = tk.Toplevel(self.root)
+        window.title(f"Customer {code} - {user.name or ''} {user.surname or ''}")
+        window.geometry("900x600")
+        window.transient(self.root)
+
+        # Identity and totals
+        info = tk.LabelFrame(window, text="Customer", padx=10, pady=5)
+        info.pack(fill="x", padx=10, pady=5)
+        fields = [
+            ("Code", user.subscription_code), ("Name", f"{user.name or ''} {user.surname or ''}"),
+            ("National ID", user.national_id), ("Mobile", user.mobile),
+            ("City", f"{user.province or ''} / {user.city or ''}"), ("Postal Code", user.postal_code),
+            ("Order lines", f"{detail['order_lines']:,}"), ("Orders total", f"{detail['orders_total']:,.0f}"),
+            ("Financial rows", f"{detail['financial_rows']:,}"),
+            ("Financials total", f"{detail['financials_total']:,.0f}"),
+            ("Difference", f"{detail['difference']:,.0f} {'✅' if detail['matched'] else '⚠️'}"),
+            ("Address", (user.address or '')[:60]),
+        ]
+        for i, (label, value) in enumerate(fields):
+            tk.Label(info, text=f"{label}:", font=("Arial", 9, "bold")).grid(row=i // 3, column=(i % 3) * 2,
+                                                                             sticky="w", padx=5)
+            tk.Label(info, text=value or "").grid(row=i // 3, column=(i % 3) * 2 + 1, sticky="w", padx=5)
+
+        # Financial records (already loaded with the customer)
+        fin_frame = tk.LabelFrame(window, text="Financials", padx=5, pady=5)
+        fin_frame.pack(fill="x", padx=10, pady=5)
+        fin_tree = ttk.Treeview(fin_frame, columns=("id", "loan_code", "amount", "description"),
+                                show="headings", height=4)
+        for column, text, width in (("id", "ID", 60), ("loan_code", "Loan Code", 100),
+                                    ("amount", "Amount", 150), ("description", "Description", 450)):
+            fin_tree.heading(column, text=text)
+            fin_tree.column(column, width=width)
+        for fin in detail['financials']:
+            fin_tree.insert("", "end", values=(fin.id, fin.loan_code or "", f"{fin.amount or 0:,.0f}",
+                                               fin.description or ""))
+        fin_tree.pack(fill="x")
+
+        # Order lines, one page at a time
+        order_frame = tk.LabelFrame(window, text="Orders", padx=5, pady=5)
+        order_frame.pack(fill="both", expand=True, padx=10, pady=5)
+        order_tree = ttk.Treeview(order_frame, show="headings", columns=(
+            "invoice_id", "invoice_date", "product_code", "product_name", "quantity", "price", "total"))
+        for column, text, width in (("invoice_id", "Invoice ID", 100), ("invoice_date", "Date", 90),
+                                    ("product_code", "Product Code", 110), ("product_name", "Product", 230),
+                                    ("quantity", "Qty", 60), ("price", "Price", 110), ("total", "Total", 120)):
+            order_tree.heading(column, text=text)
+            order_tree.column(column, width=width)
+        order_tree.pack(fill="both", expand=True)
+
+        pager = tk.Frame(order_frame)
+        pager.pack(fill="x", pady=3)
+        page = tk.IntVar(value=0)
+        page_label = tk.Label(pager)
+
+        def load_page(number):
+            number = max(0, min(number, detail['pages'] - 1))
+            page.set(number)
+            session = self.db.get_session()
+            try:
+                orders = queries.customer_orders(session, code, number)
+            finally:
+                session.close()
+            order_tree.delete(*order_tree.get_children())
+            for order in orders:
+                order_tree.insert("", "end", values=(
+                    order.invoice_id or "", order.invoice_date or "", order.product_code or "",
+                    order.product_name or "", order.quantity or 0,
+                    f"{order.price or 0:,.0f}", f"{order.total_value or 0:,.0f}"
+                ))
+            page_label.config(text=f"Page {number + 1} of {detail['pages']}")
+
+        tk.Button(pager, text="◀ Previous", command=lambda: load_page(page.get() - 1)).pack(side=tk.LEFT, padx=5)
+        page_label.pack(side=tk.LEFT, padx=10)
+        tk.Button(pager, text="Next ▶", command=lambda: load_page(page.get() + 1)).pack(side=tk.LEFT, padx=5)
+        load_page(0)
+
     # ==================== ORDERS TAB ====================
 
     def create_orders_tab(self):
@@ -342,11 +579,33 @@ class CrossCheckApp:
         self.orders_frame = tk.Frame(self.notebook)
         self.notebook.add(self.orders_frame, text="📦 Orders")
 
-        # Toolbar
-        toolbar = tk.Frame(self.orders_frame)
-        toolbar.pack(fill="x", padx=5, pady=5)
-
-        tk.Button(toolbar, text="🔄 Refresh", command=self.load_orders).pack(side=tk.LEFT, padx=5)
+        # Filter panel; filtering, sorting and paging all happen in SQL
+        filter_frame = tk.LabelFrame(self.orders_frame, text="Filters", padx=5, pady=5)
+        filter_frame.pack(fill="x", padx=5, pady=5)
+
+        self.order_filter_vars = {}
+        fields = [
+            ('product', "Product:"), ('warehouse', "Warehouse:"), ('customer', "Customer:"),
+            ('min_total', "Min amount:"), ('max_total', "Max amount:"),
+            ('date_from', "Sent from:"), ('date_to', "Sent to:"),
+        ]
+        for i, (name, label) in enumerate(fields):
+            var = tk.StringVar()
+            self.order_filter_vars[name] = var
+            tk.Label(filter_frame, text=label).grid(row=i // 4, column=(i % 4) * 2, sticky="w", padx=5)
+            entry = tk.Entry(filter_frame, textvariable=var, width=16)
+            entry.grid(row=i // 4, column=(i % 4) * 2 + 1, padx=5, pady=2)
+            entry.bind("<Return>", lambda event: self.apply_order_filters())
+
+        buttons = tk.Frame(filter_frame)
+        buttons.grid(row=1, column=6, columnspan=2)
+        tk.Button(buttons, text="🔍 Apply", command=self.apply_order_filters).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="✖ Clear", command=self.clear_order_filters).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="🔄 Refresh", command=self.load_orders).pack(side=tk.LEFT, padx=5)
+
+        self.orders_criteria = {}
+        self.orders_sort = ('id', False)
+        self.orders_page = 0
 
         # Treeview
         tree_frame = tk.Frame(self.orders_frame)
@@ -357,7 +616,7 @@ class CrossCheckApp:
 
         self.orders_tree = ttk.Treeview(
             tree_frame,
-            columns=("id", "invoice_id", "subscription_code", "product_code", "quantity", "price", "total", "sending_date"),
+            columns=tuple(queries.ORDER_LIST_COLUMNS),
             show="headings",
             yscrollcommand=v_scroll.set,
             xscrollcommand=h_scroll.set
@@ -366,15 +625,19 @@ class CrossCheckApp:
         v_scroll.config(command=self.orders_tree.yview)
         h_scroll.config(command=self.orders_tree.xview)
 
-        # Headers
-        self.orders_tree.heading("id", text="ID")
-        self.orders_tree.heading("invoice_id", text="Invoice ID")
-        self.orders_tree.heading("subscription_code", text="Subscription Code")
-        self.orders_tree.heading("product_code", text="Product Code")
-        self.orders_tree.heading("quantity", text="Quantity")
-        self.orders_tree.heading("price", text="Price")
-        self.orders_tree.heading("total", text="Total Value")
-        self.orders_tree.heading("sending_date", text="Sending Date")
+        # Headers sort on click
+        self.orders_headings = {
+            "id": "ID",
+            "invoice_id": "Invoice ID",
+            "subscription_code": "Subscription Code",
+            "product_code": "Product Code",
+            "quantity": "Quantity",
+            "price": "Price",
+            "total": "Total Value",
+            "sending_date": "Sending Date",
+        }
+        for column, text in self.orders_headings.items():
+            self.orders_tree.heading(column, text=text, command=lambda c=column: self.sort_orders(c))
 
         # Widths
         self.orders_tree.column("id", width=50)
@@ -390,34 +653,92 @@ class CrossCheckApp:
         v_scroll.pack(side=tk.RIGHT, fill="y")
         h_scroll.pack(side=tk.BOTTOM, fill="x")
 
-        self.orders_count_label = tk.Label(self.orders_frame, text="Total: 0 orders")
-        self.orders_count_label.pack(pady=5)
+        # Pager
+        pager = tk.Frame(self.orders_frame)
+        pager.pack(pady=5)
+        tk.Button(pager, text="◀ Previous", command=lambda: self.show_orders_page(self.orders_page - 1)).pack(
+            side=tk.LEFT, padx=5)
+        self.orders_count_label = tk.Label(pager, text="Total: 0 orders")
+        self.orders_count_label.pack(side=tk.LEFT, padx=10)
+        tk.Button(pager, text="Next ▶", command=lambda: self.show_orders_page(self.orders_page + 1)).pack(
+            side=tk.LEFT, padx=5)
+
+    def apply_order_filters(self):
+        """Read the filter panel and show the first page of matching orders"""
+        values = {name: var.get().strip() for name, var in self.order_filter_vars.items()}
+        try:
+            criteria = {
+                'product': values['product'] or None,
+                'warehouse': values['warehouse'] or None,
+                'customer': int(values['customer']) if values['customer'] else None,
+                'min_total': float(values['min_total']) if values['min_total'] else None,
+                'max_total': float(values['max_total']) if values['max_total'] else None,
+                'date_from': values['date_from'] or None,
+                'date_to': values['date_to'] or None,
+            }
+        except ValueError:
+            messagebox.showerror("Error", "Customer must be a subscription code and amounts must be numbers.")
+            return
+
+        self.orders_criteria = {name: value for name, value in criteria.items() if value is not None}
+        self.orders_page = 0
+        self.load_orders()
+
+    def clear_order_filters(self):
+        """Reset the filter panel and show all orders"""
+        for var in self.order_filter_vars.values():
+            var.set("")
+        self.apply_order_filters()
+
+    def sort_orders(self, column):
+        """Sort by a column; clicking the sorted column again reverses the order"""
+        current, descending = self.orders_sort
+        self.orders_sort = (column, not descending if column == current else False)
+        self.orders_page = 0
+        self.load_orders()
+
+    def show_orders_page(self, page):
+        """Move to another page of the current result"""
+        self.orders_page = page
+        self.load_orders()
 
     def load_orders(self):
-        """Load orders into treeview"""
+        """Load one page of the filtered, sorted orders into the treeview"""
         self.update_status("Loading orders...")
 
-        for item in self.orders_tree.get_children():
-            self.orders_tree.delete(item)
+        # Counts are cached until the next import
+        total = self.processor.count_orders(**self.orders_criteria)
+        pages = max(1, -(-total // queries.ORDER_PAGE_SIZE))
+        self.orders_page = max(0, min(self.orders_page, pages - 1))
+        sort, descending = self.orders_sort
+
+        for column, text in self.orders_headings.items():
+            arrow = (" ▼" if descending else " ▲") if column == sort else ""
+            self.orders_tree.heading(column, text=text + arrow)
+
+        self.orders_tree.delete(*self.orders_tree.get_children())
 
         session = self.db.get_session()
         try:
-            orders = session.query(Order).all()
+            rows = queries.orders_page(session, queries.order_filters(**self.orders_criteria),
+                                       sort, descending, self.orders_page)
 
-            for order in orders:
+            for order_id, invoice_id, code, product_code, quantity, price, total_value, sending_date in rows:
                 self.orders_tree.insert("", "end", values=(
-                    order.id,
-                    order.invoice_id or "",
-                    order.subscription_code or "",
-                    order.product_code or "",
-                    order.quantity or 0,
-                    f"{order.price:,.0f}" if order.price else "0",
-                    f"{order.total_value:,.0f}" if order.total_value else "0",
-                    order.sending_date or ""
+                    order_id,
+                    invoice_id or "",
+                    code or "",
+                    product_code or "",
+                    quantity or 0,
+                    f"{price:,.0f}" if price else "0",
+                    f"{total_value:,.0f}" if total_value else "0",
+                    sending_date or ""
                 ))
 
-            self.orders_count_label.config(text=f"Total: {len(orders)} orders")
-            self.update_status(f"Loaded {len(orders)} orders")
+            label = "Found" if self.orders_criteria else "Total"
+            self.orders_count_label.config(
+                text=f"{label}: {total:,} orders — page {self.orders_page + 1} of {pages:,}")
+            self.update_status(f"Loaded {len(rows)} of {total:,} orders")
 
         finally:
             session.close()
@@ -531,64 +852,70 @@ class CrossCheckApp:
         self.update_status("Loading statistics...")
         self.stats_text.delete(1.0, tk.END)
 
-        session = self.db.get_session()
-        try:
-            # Count records
-            users_count = session.query(User).count()
-            orders_count = session.query(Order).count()
-            financials_count = session.query(Financial).count()
-
-            # Get top users by order value
-            from sqlalchemy import func
-            top_users = session.query(
-                User.subscription_code,
-                User.name,
-                User.surname,
-                func.sum(Order.total_value).label('total')
-            ).join(Order).group_by(
-                User.subscription_code
-            ).order_by(
-                func.sum(Order.total_value).desc()
-            ).limit(10).all()
-
-            # Display stats
-            stats = f"""
+        # Served from cache until the next import changes the data
+        counts = self.processor.get_statistics()
+        orphans = self.processor.get_integrity()
+        top_customers = self.processor.get_top_users(10)
+
+        # Display stats
+        stats = f"""
 {'='*80}
                           DATABASE STATISTICS
 {'='*80}
 
 RECORD COUNTS:
-  • Total Users:              {users_count:>10}
-  • Total Orders:             {orders_count:>10}
-  • Total Financial Records:  {financials_count:>10}
+  • Total Users:              {counts['users_count']:>10}
+  • Total Orders:             {counts['orders_count']:>10}
+  • Total Financial Records:  {counts['financials_count']:>10}
+
+INTEGRITY (subscription code missing from users):
+  • Orders without a customer:     {orphans['orders']['rows']:>10} ({orphans['orders']['customers']} codes)
+  • Financials without a customer: {orphans['financials']['rows']:>10} ({orphans['financials']['customers']} codes)
 
 {'='*80}
 
 TOP 10 USERS BY ORDER VALUE:
 
 """
-            self.stats_text.insert(tk.END, stats)
+        self.stats_text.insert(tk.END, stats)
 
-            for i, (code, name, surname, total) in enumerate(top_users, 1):
-                line = f"  {i:>2}. Code: {code:<10} | {name} {surname:<20} | {total:>15,.0f} Rials\n"
-                self.stats_text.insert(tk.END, line)
+        for i, (code, name, surname, total) in enumerate(top_customers, 1):
+            line = f"  {i:>2}. Code: {code:<10} | {name} {surname:<20} | {total:>15,.0f} Rials\n"
+            self.stats_text.insert(tk.END, line)
 
-            self.stats_text.insert(tk.END, "\n" + "="*80)
+        self.stats_text.insert(tk.END, "\n" + "="*80 + "\n")
 
-            self.update_status("Statistics loaded")
+        # Rankings from the stored sales cube (rebuilt once per import)
+        for dimension in ('province', 'city', 'marketer', 'warehouse'):
+            self.stats_text.insert(tk.END, f"\nTOP 5 BY {DIMENSION_LABELS[dimension].upper()}:\n\n")
+            for i, (_, label, lines, total) in enumerate(self.cube.top(dimension, 5), 1):
+                line = f"  {i:>2}. {label[:30]:<30} | {lines:>8} lines | {total:>15,.0f} Rials\n"
+                self.stats_text.insert(tk.END, line)
 
-        finally:
-            session.close()
+        self.stats_text.insert(tk.END, "\n" + "="*80)
+
+        self.update_status("Statistics loaded")
 
     # ==================== UTILITY METHODS ====================
 
+    def refresh_visible_tab(self):
+        """Load the selected tab if it has not rendered the current import generation yet"""
+        tab = self.notebook.select()
+        loader = self.tab_loaders.get(tab)
+        if loader is None:
+            return
+        # Read before loading, so an import finishing meanwhile triggers another load
+        generation = self.db.get_generation()
+        if self.rendered_generation.get(tab) == generation:
+            return
+        loader()
+        self.rendered_generation[tab] = generation
+
     def refresh_all_views(self):
-        """Refresh all data views"""
-        self.load_users()
-        self.load_orders()
-        self.load_financials()
-        self.load_statistics()
-        self.update_status("All views refreshed")
+        """Mark every tab out of date and reload the visible one; the others reload when shown"""
+        self.rendered_generation.clear()
+        self.refresh_visible_tab()
+        self.update_status("Views up to date")
 
     def show_import_tab(self):
         """Switch to import tab"""
@@ -611,8 +938,12 @@ TOP 10 USERS BY ORDER VALUE:
 
 def main():
     """Main entry point"""
+    read_only = '--read-only' in sys.argv[1:]
+    if read_only and not os.path.isfile('data.db'):
+        # Read-only mode never creates the file
+        sys.exit("❌ Database not found: data.db")
     root = tk.Tk()
-    CrossCheckApp(root)  # Initialize app
+    CrossCheckApp(root, read_only=read_only)  # Initialize app
     root.mainloop()
 
 
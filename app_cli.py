@@ -3,20 +3,41 @@
 Cross Check - Command Line Interface
 Run this version in terminal/headless environments
 """
+import argparse
+import json
+import os
 import sys
 from models import Database, User, Order, Financial
 from data_processor import DataProcessor
-from sqlalchemy import func
+from reconciliation import ReconciliationRunner
+import queries
+from exporter import Exporter, DATASETS
+from cube import SalesCube, DIMENSION_LABELS
+from duplicates import DuplicateFinder
+import changelog
+import purge
+import analytics
+from progress import CancelToken, cancel_on_interrupt, format_progress
+from integrity import IntegrityAudit, ORPHAN_TABLES
+from validation import ERROR
 
 
 class CrossCheckCLI:
     """Command-line interface for Cross Check"""
 
-    def __init__(self, db_path='data.db'):
+    def __init__(self, db_path='data.db', read_only=False, immutable=False):
         self.db_path = db_path
-        self.db = Database(db_path)
-        self.processor = DataProcessor(db_path)
-        self.db.create_tables()
+        self.immutable = immutable
+        self.db = Database(db_path, read_only=read_only, immutable=immutable)
+        self.processor = DataProcessor(db=self.db)
+        self.db.ensure_schema()
+
+    def check_writable(self):
+        """Tell the user when an action needs write access; returns False in read-only mode"""
+        if self.db.read_only:
+            print("\n❌ The database is open read-only (reporting mode); imports and deletions are disabled.")
+            return False
+        return True
 
     def print_header(self, title):
         """Print formatted header"""
@@ -34,41 +55,64 @@ class CrossCheckCLI:
         print("  4. View Financials")
         print("  5. Show Statistics")
         print("  6. Search Users")
-        print("  7. Exit")
+        print("  7. Reconciliation Report")
+        print("  8. Export Data (CSV/XLSX)")
+        print("  9. Sales Cube Report")
+        print("  10. Find Duplicate Customers")
+        print("  11. Customer Details")
+        print("  12. Purge Customers")
+        print("  13. Exit")
         print("\n" + "-" * 80)
 
     def import_data(self):
         """Import data from Excel files"""
         self.print_header("IMPORT DATA")
+        if not self.check_writable():
+            return
 
         print("\n📁 Excel files to import:")
         print("  • excel1.xls (Users)")
         print("  • excel2.xls (Orders)")
         print("  • excel3 .xls (Financials)")
 
-        confirm = input("\n⚠️  This will recreate the database. Continue? (y/n): ").lower()
-        if confirm != 'y':
+        mode = input("\n⚠️  (r)ecreate the database, (a)ppend new rows only, or (c)ancel? ").lower()
+        if mode not in ('r', 'a'):
             print("❌ Import cancelled.")
             return
 
-        print("\n🚀 Starting import...\n")
-
-        def log_callback(msg):
-            print(f"  {msg}")
-
-        stats = self.processor.import_all_data(
-            'excel1.xls',
-            'excel2.xls',
-            'excel3 .xls',
-            log_callback=log_callback
-        )
-
-        print("\n✅ Import completed!")
+        print("\n🚀 Starting import... (Ctrl+C cancels)\n")
+
+        with cancel_on_interrupt(CancelToken()) as token:
+            stats = self.processor.import_all_data(
+                'excel1.xls',
+                'excel2.xls',
+                'excel3 .xls',
+                log_callback=self.print_log_line,
+                replace=(mode == 'r'),
+                shadow=(mode == 'r'),
+                progress_callback=self.print_progress,
+                cancel_token=token
+            )
+
+        print("\n⏹️ Import cancelled." if stats['cancelled'] else "\n✅ Import completed!")
         print(f"\n📊 Summary:")
         print(f"  • Users imported: {stats['users_imported']}")
         print(f"  • Orders imported: {stats['orders_imported']}")
+        print(f"  • Duplicate orders skipped: {stats['orders_duplicates']}")
         print(f"  • Financials imported: {stats['financials_imported']}")
+        print(f"  • Duplicate financial records skipped: {stats['financials_duplicates']}")
+        print(f"  • Rows rejected by validation: {stats['rows_rejected']}")
+        self.print_orphan_counts(stats['orphans'])
         print(f"  • Errors: {len(stats['errors'])}")
+        if stats['run_id']:
+            changes = stats['changes']
+            print(f"  • Import run #{stats['run_id']}: {changes['inserted']} inserted, "
+                  f"{changes['updated']} updated, {changes['deleted']} deleted")
+
+        if stats['validation']:
+            print("\n🔎 Validation checks failed:")
+            for rule, count in sorted(stats['validation'].items()):
+                print(f"    {rule:<35} {count:>8,}")
 
         if stats['errors']:
             show_errors = input("\nShow errors? (y/n): ").lower()
@@ -76,6 +120,64 @@ class CrossCheckCLI:
                 for error in stats['errors'][:10]:  # Show first 10
                     print(f"  ⚠️  {error}")
 
+    def print_log_line(self, msg):
+        """Print an import log message over the progress line"""
+        print(f"\r  {msg:<78}")
+
+    def print_progress(self, event):
+        """Redraw the progress line of a running import; the final event of a stage ends the line"""
+        print(f"\r  ⏳ {format_progress(event):<76}", end='\n' if event['done'] else '', flush=True)
+
+    def print_orphan_counts(self, orphans):
+        """Print the orders and financial records whose customer is missing"""
+        if not orphans:
+            return
+        print(f"  • Orders without a customer: {orphans['orders']['rows']:,} "
+              f"({orphans['orders']['customers']:,} codes)")
+        print(f"  • Financials without a customer: {orphans['financials']['rows']:,} "
+              f"({orphans['financials']['customers']:,} codes)")
+
+    def batch_import(self, users=(), orders=(), financials=(), workers=None, replace=False, reject_orphans=False):
+        """Import many workbooks per dataset and print per-file results (Ctrl+C cancels)
+
+        reject_orphans drops order lines and financial records of unknown
+        customers before they are written.
+        """
+        self.print_header("BATCH IMPORT")
+        if not self.check_writable():
+            return {'errors': ['read-only database']}
+
+        processor = self.processor
+        if reject_orphans:
+            processor = DataProcessor(db=self.db, severities={'unknown_customer': ERROR})
+        with cancel_on_interrupt(CancelToken()) as token:
+            stats = processor.import_batch(users, orders, financials, log_callback=self.print_log_line,
+                                                replace=replace, workers=workers,
+                                                progress_callback=self.print_progress, cancel_token=token)
+        if not stats.get('files'):
+            return stats
+
+        print(f"\n📊 Per-file results:\n")
+        print(f"    {'File':<35} {'Dataset':<11} {'Read':>8} {'Imported':>9} {'Dupes':>7} {'Rejected':>9}")
+        print("    " + "-" * 84)
+        for info in stats['files']:
+            print(f"    {os.path.basename(info['file'])[:34]:<35} {info['dataset']:<11} {info['rows_read']:>8,} "
+                  f"{info['imported']:>9,} {info['duplicates']:>7,} {info['rejected']:>9,}")
+
+        print(f"\n  • Users imported: {stats['users_imported']}")
+        print(f"  • Orders imported: {stats['orders_imported']}")
+        print(f"  • Duplicate orders skipped: {stats['orders_duplicates']}")
+        print(f"  • Financials imported: {stats['financials_imported']}")
+        print(f"  • Duplicate financial records skipped: {stats['financials_duplicates']}")
+        print(f"  • Rows rejected by validation: {stats['rows_rejected']}")
+        self.print_orphan_counts(stats['orphans'])
+        print(f"  • Errors: {len(stats['errors'])}")
+        if stats['cancelled']:
+            print("  ⏹️ Cancelled: batches written before the cancel are kept")
+        for error in stats['errors'][:10]:
+            print(f"  ⚠️  {error}")
+        return stats
+
     def view_users(self, limit=20):
         """View users"""
         self.print_header("USERS")
@@ -169,51 +271,37 @@ class CrossCheckCLI:
         """Show database statistics"""
         self.print_header("STATISTICS")
 
-        session = self.db.get_session()
-        try:
-            users_count = session.query(User).count()
-            orders_count = session.query(Order).count()
-            financials_count = session.query(Financial).count()
+        # Served from cache until the next import changes the data
+        stats = self.processor.get_statistics()
 
-            if users_count == 0:
-                print("\n❌ No data found. Please import data first.")
-                return
+        if stats['users_count'] == 0:
+            print("\n❌ No data found. Please import data first.")
+            return
 
-            # Total amounts
-            total_orders_value = session.query(func.sum(Order.total_value)).scalar() or 0
-            total_financial_amount = session.query(func.sum(Financial.amount)).scalar() or 0
-
-            print("\n📊 Database Statistics:\n")
-            print(f"  Record Counts:")
-            print(f"    • Users:              {users_count:>10,}")
-            print(f"    • Orders:             {orders_count:>10,}")
-            print(f"    • Financial Records:  {financials_count:>10,}")
-            print(f"\n  Financial Totals:")
-            print(f"    • Total Order Value:  {total_orders_value:>15,.0f} Rials")
-            print(f"    • Total Financials:   {total_financial_amount:>15,.0f} Rials")
-
-            # Top users by order value
-            print("\n  📈 Top 10 Users by Order Value:\n")
-            top_users = session.query(
-                User.subscription_code,
-                User.name,
-                User.surname,
-                func.sum(Order.total_value).label('total')
-            ).join(Order).group_by(
-                User.subscription_code
-            ).order_by(
-                func.sum(Order.total_value).desc()
-            ).limit(10).all()
-
-            print(f"    {'Rank':<6} {'Code':<12} {'Name':<30} {'Total Value':<20}")
-            print("    " + "-" * 70)
+        print("\n📊 Database Statistics:\n")
+        print(f"  Record Counts:")
+        print(f"    • Users:              {stats['users_count']:>10,}")
+        print(f"    • Orders:             {stats['orders_count']:>10,}")
+        print(f"    • Financial Records:  {stats['financials_count']:>10,}")
+        print(f"\n  Financial Totals:")
+        print(f"    • Total Order Value:  {stats['total_orders_value']:>15,.0f} Rials")
+        print(f"    • Total Financials:   {stats['total_financial_amount']:>15,.0f} Rials")
 
-            for i, (code, name, surname, total) in enumerate(top_users, 1):
-                full_name = f"{name} {surname}"
-                print(f"    {i:<6} {code:<12} {full_name[:29]:<30} {total:>19,.0f}")
+        orphans = self.processor.get_integrity()
+        print(f"\n  Integrity:")
+        print(f"    • Orders without a customer:     {orphans['orders']['rows']:>10,}")
+        print(f"    • Financials without a customer: {orphans['financials']['rows']:>10,}")
 
-        finally:
-            session.close()
+        # Top users by order value
+        print("\n  📈 Top 10 Users by Order Value:\n")
+        top_customers = self.processor.get_top_users(10)
+
+        print(f"    {'Rank':<6} {'Code':<12} {'Name':<30} {'Total Value':<20}")
+        print("    " + "-" * 70)
+
+        for i, (code, name, surname, total) in enumerate(top_customers, 1):
+            full_name = f"{name} {surname}"
+            print(f"    {i:<6} {code:<12} {full_name[:29]:<30} {total:>19,.0f}")
 
     def search_users(self):
         """Search users"""
@@ -226,12 +314,7 @@ class CrossCheckCLI:
 
         session = self.db.get_session()
         try:
-            users = session.query(User).filter(
-                (User.name.like(f"%{query}%")) |
-                (User.surname.like(f"%{query}%")) |
-                (User.mobile.like(f"%{query}%")) |
-                (User.national_id.like(f"%{query}%"))
-            ).limit(50).all()
+            users = queries.search_users(session, query).limit(50).all()
 
             if not users:
                 print(f"\n❌ No users found matching '{query}'")
@@ -251,6 +334,282 @@ class CrossCheckCLI:
         finally:
             session.close()
 
+    def show_reconciliation(self):
+        """Reconcile order totals against financial records per customer"""
+        self.print_header("RECONCILIATION REPORT")
+
+        workers = input("\n⚙️  Worker processes (Enter for all cores): ").strip()
+        runner = ReconciliationRunner(self.db_path, workers=int(workers) if workers.isdigit() else None,
+                                      immutable=self.immutable)
+
+        def log_callback(msg):
+            print(f"  {msg}")
+
+        report = runner.run(log_callback=log_callback)
+
+        if report['customers'] == 0:
+            print("\n❌ No data found. Please import data first.")
+            return
+
+        print("\n📊 Reconciliation Summary:\n")
+        print(f"    • Customers:          {report['customers']:>10,}")
+        print(f"    • Matched:            {report['matched']:>10,}")
+        print(f"    • Mismatched:         {len(report['mismatches']):>10,}")
+        print(f"    • Total Order Value:  {report['orders_total']:>15,.0f} Rials")
+        print(f"    • Total Financials:   {report['financials_total']:>15,.0f} Rials")
+        print(f"    • Difference:         {report['difference']:>15,.0f} Rials")
+        if report.get('engine') == 'duckdb':
+            print("    • Computed in the DuckDB analytics mirror")
+
+        if report['mismatches']:
+            print("\n  ⚠️  Largest Differences:\n")
+            print(f"    {'Code':<12} {'Orders':>18} {'Financials':>18} {'Difference':>18}")
+            print("    " + "-" * 70)
+            for code, order_total, financial_total, difference in report['mismatches'][:20]:
+                print(f"    {code:<12} {order_total:>18,.0f} {financial_total:>18,.0f} {difference:>18,.0f}")
+
+    def export_data(self):
+        """Export a table or report to CSV or XLSX"""
+        self.print_header("EXPORT DATA")
+
+        datasets = list(DATASETS.items())
+        print("\n📤 What to export:")
+        for i, (_, label) in enumerate(datasets, 1):
+            print(f"  {i}. {label}")
+
+        choice = input(f"\nSelect dataset (1-{len(datasets)}): ").strip()
+        if not choice.isdigit() or not 1 <= int(choice) <= len(datasets):
+            print("❌ Export cancelled.")
+            return
+        dataset = datasets[int(choice) - 1][0]
+
+        limit = term = None
+        if dataset == 'top_users':
+            answer = input("How many customers? (default 10): ").strip()
+            limit = int(answer) if answer.isdigit() else 10
+        elif dataset == 'user_search':
+            term = input("🔍 Enter search term: ").strip()
+            if not term:
+                print("❌ Export cancelled.")
+                return
+
+        fmt = 'xlsx' if input("Format - (c)sv or (x)lsx? ").strip().lower().startswith('x') else 'csv'
+        path = input(f"Output file (default {dataset}.{fmt}): ").strip() or f"{dataset}.{fmt}"
+
+        def progress_callback(done, total):
+            print(f"\r  Exported {done:,} of {total:,} rows", end='', flush=True)
+
+        count = Exporter(self.db).export(dataset, path, fmt=fmt, progress_callback=progress_callback,
+                                         limit=limit, term=term)
+        print(f"\n\n✅ Exported {count:,} rows to {path}")
+
+    def show_sales_cube(self):
+        """Show order value rankings by customer, province, city, marketer or warehouse"""
+        self.print_header("SALES CUBE REPORT")
+
+        dimensions = list(DIMENSION_LABELS.items())
+        print("\n📊 Group sales by:")
+        for i, (_, label) in enumerate(dimensions, 1):
+            print(f"  {i}. {label}")
+
+        choice = input(f"\nSelect dimension (1-{len(dimensions)}): ").strip()
+        if not choice.isdigit() or not 1 <= int(choice) <= len(dimensions):
+            print("❌ Report cancelled.")
+            return
+        dimension, label = dimensions[int(choice) - 1]
+
+        rows = SalesCube(self.db).top(dimension, 20)
+        if not rows:
+            print("\n❌ No orders found. Please import data first.")
+            return
+
+        print(f"\n  📈 Top {len(rows)} by {label}:\n")
+        print(f"    {'Rank':<6} {label:<30} {'Lines':>8} {'Total Value':>20}")
+        print("    " + "-" * 70)
+        for i, (_, name, lines, total) in enumerate(rows, 1):
+            print(f"    {i:<6} {name[:29]:<30} {lines:>8,} {total:>20,.0f}")
+
+    def find_duplicates(self):
+        """List customers recorded under several subscription codes"""
+        self.print_header("DUPLICATE CUSTOMERS")
+
+        finder = DuplicateFinder(self.db)
+
+        def log_callback(msg):
+            print(f"  {msg}")
+
+        report = finder.run(log_callback=log_callback)
+        clusters = report['clusters']
+
+        if report['customers'] == 0:
+            print("\n❌ No users found. Please import data first.")
+            return
+        if not clusters:
+            print("\n✅ No duplicate customers found.")
+            return
+
+        print(f"\n  👥 Top {min(len(clusters), 20)} of {len(clusters):,} clusters:\n")
+        print(f"    {'Score':<7} {'Codes':<40} {'Matching fields'}")
+        print("    " + "-" * 76)
+        for cluster in clusters[:20]:
+            codes = ', '.join(str(code) for code in cluster['codes'])
+            print(f"    {cluster['score']:<7.2f} {codes[:39]:<40} {', '.join(cluster['matches'])}")
+
+        path = input("\n💾 Save all clusters to CSV (Enter to skip): ").strip()
+        if path:
+            finder.export_csv(clusters, path)
+            print(f"✅ Saved {len(clusters):,} clusters to {path}")
+
+    def show_customer(self, code=None, page=0, interactive=True):
+        """Show one customer's details, financials, reconciliation totals and a page of order lines"""
+        self.print_header("CUSTOMER DETAILS")
+        if code is None:
+            entered = input("\nSubscription code: ").strip()
+            if not entered.isdigit():
+                print("❌ Please enter a numeric subscription code")
+                return
+            code = int(entered)
+
+        session = self.db.get_session()
+        try:
+            detail = queries.customer_detail(session, code)
+            if detail is None:
+                print(f"\n❌ No customer with code {code}")
+                return
+
+            user = detail['user']
+            print(f"\n  👤 {user.name or ''} {user.surname or ''} (code {user.subscription_code})")
+            print(f"     National ID: {user.national_id or '-'}   Mobile: {user.mobile or '-'}   "
+                  f"City: {user.city or '-'}")
+            print(f"\n  Orders:      {detail['order_lines']:>8,} lines {detail['orders_total']:>20,.0f}")
+            print(f"  Financials:  {detail['financial_rows']:>8,} rows  {detail['financials_total']:>20,.0f}")
+            print(f"  Difference:  {detail['difference']:>35,.0f} {'✅' if detail['matched'] else '⚠️'}")
+
+            if detail['financials']:
+                print(f"\n    {'Loan Code':<12} {'Amount':>18}  {'Description':<40}")
+                print("    " + "-" * 72)
+                for fin in detail['financials']:
+                    print(f"    {(fin.loan_code or ''):<12} {fin.amount or 0:>18,.0f}  {(fin.description or '')[:40]:<40}")
+
+            while True:
+                page = max(0, min(page, detail['pages'] - 1))
+                orders = queries.customer_orders(session, code, page)
+                print(f"\n  📦 Order lines, page {page + 1} of {detail['pages']}:\n")
+                print(f"    {'Invoice':<12} {'Date':<11} {'Product':<15} {'Qty':>6} {'Total':>18}")
+                print("    " + "-" * 66)
+                for order in orders:
+                    print(f"    {(order.invoice_id or '')[:11]:<12} {(order.invoice_date or '')[:10]:<11} "
+                          f"{(order.product_code or '')[:14]:<15} {order.quantity or 0:>6} "
+                          f"{order.total_value or 0:>18,.0f}")
+
+                if not interactive or detail['pages'] == 1:
+                    return
+                step = input("\n  [n]ext, [p]revious or Enter to return: ").strip().lower()
+                if step == 'n':
+                    page += 1
+                elif step == 'p':
+                    page -= 1
+                else:
+                    return
+        finally:
+            session.close()
+
+    def purge_customers(self, codes=None, code_range=None, confirm=True):
+        """Delete customers (a code range or a list of codes) with their orders and financial records"""
+        self.print_header("PURGE CUSTOMERS")
+        if not self.check_writable():
+            return None
+
+        if codes is None and code_range is None:
+            print("\nEnter a range (e.g. 1000000-1099999) or comma-separated subscription codes.")
+            entered = input("Customers to purge: ").strip()
+            parts = entered.split('-')
+            if len(parts) == 2 and all(part.strip().isdigit() for part in parts):
+                code_range = (int(parts[0]), int(parts[1]))
+            else:
+                values = [value.strip() for value in entered.split(',') if value.strip()]
+                if not values or not all(value.isdigit() for value in values):
+                    print("❌ Please enter a code range or numeric subscription codes")
+                    return None
+                codes = [int(value) for value in values]
+
+        target = f"codes {code_range[0]} to {code_range[1]}" if code_range else f"{len(set(codes))} customer(s)"
+        if confirm and input(f"\n⚠️  Delete {target} with all their orders and financials? (yes/no): ").lower() != 'yes':
+            print("Cancelled.")
+            return None
+
+        def log_callback(msg):
+            print(f"  {msg}")
+
+        counts = purge.purge_customers(self.db, codes=codes, code_range=code_range, log_callback=log_callback)
+        print(f"\n✅ Purge completed:")
+        print(f"  • Customers deleted: {counts['users']:,}")
+        print(f"  • Order lines deleted: {counts['orders']:,}")
+        print(f"  • Financial records deleted: {counts['financials']:,}")
+        if counts.get('run_id'):
+            print(f"  • Recorded as import run #{counts['run_id']}")
+        return counts
+
+    def show_changes(self, since=0, table=None, as_json=False):
+        """Print the rows changed by the import runs after `since`"""
+        changes = changelog.changes_since(self.db, since, table)
+        if as_json:
+            print(json.dumps({'since': since, 'last_run': changelog.last_run_id(self.db), 'changes': changes},
+                             ensure_ascii=False, indent=2))
+            return changes
+
+        self.print_header(f"CHANGES SINCE RUN #{since}")
+        print(f"    {'Run':<6} {'Kind':<8} {'Status':<10} {'Started':<20} {'Ins':>8} {'Upd':>8} {'Del':>8}")
+        print("    " + "-" * 72)
+        for run in changelog.recent_runs(self.db):
+            print(f"    {run.id:<6} {run.kind:<8} {run.status:<10} {run.started_at:<20} "
+                  f"{run.inserted or 0:>8,} {run.updated or 0:>8,} {run.deleted or 0:>8,}")
+
+        print(f"\n    {'Table':<12} {'Inserted':>10} {'Updated':>10} {'Deleted':>10}")
+        print("    " + "-" * 45)
+        for name, keys in changes.items():
+            print(f"    {name:<12} {len(keys['inserted']):>10,} {len(keys['updated']):>10,} {len(keys['deleted']):>10,}")
+        return changes
+
+    def show_integrity(self, limit=20):
+        """Print the orphan audit with the codes that have the most orphaned rows"""
+        self.print_header("INTEGRITY AUDIT")
+        audit = IntegrityAudit(self.db)
+        summary = audit.summary()
+        labels = {'orders': 'order lines', 'financials': 'financial records'}
+
+        for table in ORPHAN_TABLES:
+            counts = summary[table]
+            print(f"\n  {labels[table].capitalize()} whose subscription code is not a user: "
+                  f"{counts['rows']:,} rows, {counts['customers']:,} codes, {counts['value'] or 0:,.0f} Rials")
+            rows = audit.orphans(table, limit)
+            if rows:
+                print(f"\n    {'Code':<12} {'Rows':>10} {'Value':>20}")
+                print("    " + "-" * 44)
+                for code, count, value in rows:
+                    print(f"    {code:<12} {count:>10,} {value:>20,.0f}")
+        return summary
+
+    def refresh_analytics(self, remove=False):
+        """Create or refresh the DuckDB analytics mirror, or remove it"""
+        mirror = analytics.AnalyticsMirror(self.db_path, self.immutable)
+        if remove:
+            if os.path.exists(mirror.path):
+                os.remove(mirror.path)
+                print(f"🗑️ Removed {mirror.path}; reports use SQLite")
+            return True
+        if not analytics.available():
+            print("❌ The analytics mirror needs DuckDB: pip install duckdb")
+            return False
+
+        def log_callback(msg):
+            print(f"  {msg}")
+
+        if mirror.is_current():
+            print(f"✅ {mirror.path} is up to date (generation {mirror.generation()})")
+            return True
+        return analytics.refresh_mirror(self.db_path, log_callback, create=True)
+
     def run(self):
         """Main application loop"""
         print("\n" + "╔" + "═" * 78 + "╗")
@@ -260,7 +619,7 @@ class CrossCheckCLI:
         while True:
             try:
                 self.print_menu()
-                choice = input("Select option (1-7): ").strip()
+                choice = input("Select option (1-13): ").strip()
 
                 if choice == '1':
                     self.import_data()
@@ -275,10 +634,22 @@ class CrossCheckCLI:
                 elif choice == '6':
                     self.search_users()
                 elif choice == '7':
+                    self.show_reconciliation()
+                elif choice == '8':
+                    self.export_data()
+                elif choice == '9':
+                    self.show_sales_cube()
+                elif choice == '10':
+                    self.find_duplicates()
+                elif choice == '11':
+                    self.show_customer()
+                elif choice == '12':
+                    self.purge_customers()
+                elif choice == '13':
                     print("\n👋 Goodbye!\n")
                     sys.exit(0)
                 else:
-                    print("❌ Invalid option. Please select 1-7.")
+                    print("❌ Invalid option. Please select 1-13.")
 
                 input("\n⏎ Press Enter to continue...")
 
@@ -294,7 +665,70 @@ class CrossCheckCLI:
 
 def main():
     """Main entry point"""
-    app = CrossCheckCLI()
+    parser = argparse.ArgumentParser(description="Cross Check command line interface")
+    parser.add_argument('--db', default='data.db', help="database file (default: data.db)")
+    parser.add_argument('--read-only', action='store_true',
+                        help="reporting mode: open the file read-only, never taking write locks")
+    parser.add_argument('--immutable', action='store_true',
+                        help="read-only mode for archived snapshots that nothing writes any more")
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser('batch-import', help="import many workbooks per dataset in one run")
+    batch.add_argument('--users', nargs='+', default=[], metavar='FILE', help="users workbooks or glob patterns")
+    batch.add_argument('--orders', nargs='+', default=[], metavar='FILE', help="orders workbooks or glob patterns")
+    batch.add_argument('--financials', nargs='+', default=[], metavar='FILE',
+                       help="financials workbooks or glob patterns")
+    batch.add_argument('--workers', type=int, default=None, help="parser processes (default: all cores)")
+    batch.add_argument('--replace', action='store_true', help="drop existing data first")
+    batch.add_argument('--reject-orphans', action='store_true',
+                       help="skip order lines and financial records of customers missing from users")
+
+    customer = commands.add_parser('customer', help="one customer's orders, financials and totals")
+    customer.add_argument('code', type=int, help="subscription code")
+    customer.add_argument('--page', type=int, default=1, help="page of order lines (default: 1)")
+
+    purge_parser = commands.add_parser('purge', help="delete customers with their orders and financials")
+    target = purge_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--range', nargs=2, type=int, metavar=('LO', 'HI'), help="inclusive subscription code range")
+    target.add_argument('--codes', nargs='+', type=int, metavar='CODE', help="subscription codes")
+    purge_parser.add_argument('--yes', action='store_true', help="do not ask for confirmation")
+
+    changes = commands.add_parser('changes', help="rows inserted, updated or deleted by recent imports")
+    changes.add_argument('--since', type=int, default=0, metavar='RUN', help="last import run already processed")
+    changes.add_argument('--table', choices=list(changelog.TRACKED_TABLES), help="only this table")
+    changes.add_argument('--json', action='store_true', help="print the changed keys as JSON")
+
+    integrity = commands.add_parser('integrity', help="orders and financial records without a customer")
+    integrity.add_argument('--limit', type=int, default=20, help="codes listed per table (default: 20)")
+
+    analytics_parser = commands.add_parser('analytics', help="create or refresh the DuckDB analytics mirror")
+    analytics_parser.add_argument('--remove', action='store_true', help="delete the mirror; reports use SQLite")
+
+    args = parser.parse_args()
+    if (args.read_only or args.immutable) and not os.path.isfile(args.db):
+        # Read-only modes never create the file
+        sys.exit(f"❌ Database not found: {args.db}")
+    app = CrossCheckCLI(args.db, read_only=args.read_only, immutable=args.immutable)
+
+    if args.command == 'batch-import':
+        stats = app.batch_import(args.users, args.orders, args.financials,
+                                 workers=args.workers, replace=args.replace, reject_orphans=args.reject_orphans)
+        sys.exit(1 if stats['errors'] or stats.get('cancelled') else 0)
+    if args.command == 'customer':
+        app.show_customer(args.code, args.page - 1, interactive=False)
+        return
+    if args.command == 'purge':
+        counts = app.purge_customers(args.codes, tuple(args.range) if args.range else None, confirm=not args.yes)
+        sys.exit(0 if counts is not None else 1)
+    if args.command == 'changes':
+        app.show_changes(args.since, args.table, as_json=args.json)
+        return
+    if args.command == 'integrity':
+        summary = app.show_integrity(args.limit)
+        sys.exit(1 if any(counts['rows'] for counts in summary.values()) else 0)
+    if args.command == 'analytics':
+        sys.exit(0 if app.refresh_analytics(remove=args.remove) else 1)
+
     app.run()
 
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the CLI and GUI entry points
+
+Measures module import time with `python -X importtime` and the time to a
+ready CLI, and fails when a budget is exceeded or when import-only
+dependencies (pandas, NumPy, xlrd, openpyxl) are loaded at startup.
+
+Usage: python bench_startup.py [cli_budget_ms]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ('pandas', 'numpy', 'xlrd', 'openpyxl')
+IMPORT_BUDGET_MS = 750
+CLI_BUDGET_MS = 1000
+RUNS = 3
+
+
+def import_profile(module):
+    """Return (cumulative import time in ms, set of modules loaded) for `import module`"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    cumulative_us = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        loaded.add(name)
+        if name == module:
+            cumulative_us = int(parts[1])
+    return cumulative_us / 1000, loaded
+
+
+def cli_ready_time():
+    """Wall-clock ms for a fresh process to import the CLI and open a database"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        code = (
+            "import time; start = time.perf_counter(); "
+            "from app_cli import CrossCheckCLI; "
+            f"CrossCheckCLI({db_path!r}); "
+            "print((time.perf_counter() - start) * 1000)"
+        )
+        timings = []
+        for _ in range(RUNS + 1):  # the first run creates the schema
+            result = subprocess.run(
+                [sys.executable, '-c', code],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            timings.append(float(result.stdout.strip().splitlines()[-1]))
+        return min(timings[1:])
+
+
+def main():
+    """Run the benchmark and exit non-zero on a regression"""
+    cli_budget = float(sys.argv[1]) if len(sys.argv) > 1 else CLI_BUDGET_MS
+    failures = []
+
+    print("Startup benchmark")
+    print("=" * 60)
+
+    for module in ('app_cli', 'app'):
+        try:
+            elapsed, loaded = import_profile(module)
+        except RuntimeError as e:
+            print(f"  {module:<10} skipped ({e})")
+            continue
+
+        heavy = sorted(name for name in loaded if name in HEAVY_MODULES)
+        print(f"  import {module:<10} {elapsed:>8.1f} ms")
+        if heavy:
+            failures.append(f"{module} loads {', '.join(heavy)} at import time")
+        if elapsed > IMPORT_BUDGET_MS:
+            failures.append(f"import {module} took {elapsed:.0f} ms (budget {IMPORT_BUDGET_MS} ms)")
+
+    ready = cli_ready_time()
+    print(f"  CLI ready         {ready:>8.1f} ms")
+    if ready > cli_budget:
+        failures.append(f"CLI start took {ready:.0f} ms (budget {cli_budget:.0f} ms)")
+
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Startup within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Import run log and change-data capture
+
+Every import gets a numbered run. When it finishes, each data row's key
+and a hash of its contents are compared with the digests stored by the
+previous run; rows that appeared, changed or disappeared are written to
+change_log, so downstream jobs read the deltas instead of whole tables.
+
+Row keys are natural keys, which survive full re-imports that renumber
+the autoincrement ids: users by subscription code, order lines by
+invoice|product|line and financial rows by customer|loan code. Rows that
+share a key get '#1', '#2', ... in id order. Appends hash only the rows
+they added; edits made outside the importer are picked up by the next
+full import.
+"""
+from datetime import datetime
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import User, Order, Financial, ImportRun, ChangeLog, RowDigest
+
+# Table -> (model, SQL expression of the natural key, column grouping the keys)
+# Every row sharing a natural key has the same group value, so changes can
+# be captured for a few groups (invoices, customers) without a full scan.
+TRACKED_TABLES = {
+    'users': (User, "CAST(subscription_code AS TEXT)", 'subscription_code'),
+    'orders': (Order, "coalesce(invoice_id, '') || '|' || coalesce(product_code, '') || '|' "
+                      "|| coalesce(line_number, '')", 'invoice_id'),
+    'financials': (Financial, "coalesce(subscription_code, '') || '|' || coalesce(loan_code, '')",
+                   'subscription_code'),
+}
+
+OPERATIONS = {'I': 'inserted', 'U': 'updated', 'D': 'deleted'}
+WRITE_CHUNK = 5000  # change_log / row_digests rows per statement
+KEY_CHUNK = 500     # group values per IN (...) lookup
+
+
+def _now():
+    """Current local time as an ISO timestamp"""
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def start_run(db, kind, files):
+    """Record the start of an import and return its run id"""
+    with db.engine.begin() as conn:
+        result = conn.execute(insert(ImportRun).values(
+            kind=kind,
+            source=', '.join(str(path) for path in files)[:1000],
+            status='running',
+            started_at=_now(),
+            inserted=0, updated=0, deleted=0,
+            orders_before=conn.execute(select(func.max(Order.id))).scalar() or 0,
+            financials_before=conn.execute(select(func.max(Financial.id))).scalar() or 0
+        ))
+        return result.inserted_primary_key[0]
+
+
+def _frame(conn, sql, columns, params=()):
+    """Run a query on the raw connection and return its rows as a DataFrame"""
+    import pandas as pd
+
+    return pd.DataFrame(conn.exec_driver_sql(sql, params).fetchall(), columns=columns)
+
+
+def _digest_frame(conn, table, where='', params=()):
+    """Return (id, row_key, group_key, digest) of the rows of a table matching a WHERE clause"""
+    import pandas as pd
+
+    model, key_sql, group = TRACKED_TABLES[table]
+    has_id = 'id' in model.__table__.columns
+    columns = [column.name for column in model.__table__.columns if column.name != 'id']
+    # Values joined as SQLite renders them, so the text depends only on what is stored
+    row_sql = " || char(31) || ".join(f"ifnull({name}, '')" for name in columns)
+
+    frame = _frame(
+        conn,
+        f"SELECT {'id' if has_id else 'NULL'}, {key_sql}, CAST({group} AS TEXT), {row_sql} "
+        f"FROM {table} {where} ORDER BY {'id' if has_id else key_sql}",
+        ['id', 'row_key', 'group_key', 'row'], params
+    )
+    # Repeated keys are numbered in id order within their group, so a scan of
+    # whole groups names each row the way a full scan does
+    repeat = frame.groupby('row_key').cumcount()
+    frame['row_key'] = frame['row_key'].astype(str).where(repeat == 0, frame['row_key'] + '#' + repeat.astype(str))
+    frame['digest'] = pd.util.hash_pandas_object(frame['row'], index=False).to_numpy().view('int64')
+    return frame.drop(columns='row')
+
+
+def table_digests(conn, table, after_id=0, groups=None):
+    """Return a DataFrame of (row_key, group_key, digest) for rows of a tracked table
+
+    after_id limits it to rows added above that id; groups limits it to
+    rows whose group column (see TRACKED_TABLES) takes one of the values.
+    """
+    import pandas as pd
+
+    group = TRACKED_TABLES[table][2]
+    if groups is not None:
+        values = [value for value in groups if value is not None]
+        frames = [
+            _digest_frame(conn, table, f"WHERE {group} IN ({', '.join('?' * len(chunk))})", tuple(chunk))
+            for chunk in _chunks(values, KEY_CHUNK)
+        ]
+        if len(values) < len(groups):
+            frames.append(_digest_frame(conn, table, f"WHERE {group} IS NULL"))
+        frame = pd.concat(frames, ignore_index=True) if frames else _digest_frame(conn, table, "WHERE 0")
+    elif after_id:
+        # Only the groups of the new rows need numbering; the index finds them
+        frame = _digest_frame(
+            conn, table,
+            f"WHERE {group} IS NULL OR {group} IN (SELECT {group} FROM {table} WHERE id > ?)", (after_id,)
+        )
+        frame = frame[frame['id'] > after_id]
+    else:
+        frame = _digest_frame(conn, table)
+    return frame[['row_key', 'group_key', 'digest']].reset_index(drop=True)
+
+
+def _stored_digests(conn, table, groups=None):
+    """Digests recorded for a table by the previous runs, optionally for some groups only"""
+    import pandas as pd
+
+    sql = "SELECT row_key, digest FROM row_digests WHERE table_name = ?"
+    columns = ['row_key', 'digest']
+    if groups is None:
+        return _frame(conn, sql, columns, (table,))
+
+    values = [str(value) for value in groups if value is not None]
+    frames = [
+        _frame(conn, f"{sql} AND group_key IN ({', '.join('?' * len(chunk))})", columns, (table, *chunk))
+        for chunk in _chunks(values, KEY_CHUNK)
+    ]
+    if len(values) < len(groups):
+        frames.append(_frame(conn, f"{sql} AND group_key IS NULL", columns, (table,)))
+    return pd.concat(frames, ignore_index=True) if frames else _frame(conn, f"{sql} AND 0", columns, (table,))
+
+
+def _diff(old, new):
+    """Return {operation: Series of row keys} between two digest frames"""
+    merged = old.merge(new, on='row_key', how='outer', suffixes=('_old', '_new'), indicator=True)
+    both = merged['_merge'] == 'both'
+    return {
+        'I': merged.loc[merged['_merge'] == 'right_only', 'row_key'],
+        'U': merged.loc[both & (merged['digest_old'] != merged['digest_new']), 'row_key'],
+        'D': merged.loc[merged['_merge'] == 'left_only', 'row_key'],
+    }
+
+
+def _appended(conn, table, before):
+    """True when the stored digests cover exactly the rows that existed before the run
+
+    Appends only add rows above the old maximum id, so only those need
+    hashing; any other difference (a first run, rows deleted by hand)
+    falls back to comparing the whole table.
+    """
+    if before is None:
+        return False
+    stored = conn.execute(
+        select(func.count()).select_from(RowDigest).where(RowDigest.table_name == table)
+    ).scalar()
+    existing = conn.exec_driver_sql(f"SELECT count(*) FROM {table} WHERE id <= ?", (before,)).scalar()
+    return stored == existing
+
+
+def _chunks(rows, size=WRITE_CHUNK):
+    """Split a list into statement-sized pieces"""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def finish_run(db, run_id, full=False, failed=False, scope=None, cancelled=False):
+    """Capture the changes of a run, store them and return {'inserted', 'updated', 'deleted'}
+
+    full=True compares every row (runs that rebuilt the tables). scope
+    ({table: group values}) compares only those groups, for runs that
+    know what they touched; tables missing from it are unchanged, and a
+    table mapped to None is compared like a run without a scope.
+    Otherwise orders and financials are treated as appended to and only
+    their new rows are hashed. Runs against the database that holds the
+    new data (the shadow file before it is swapped in), so the change log
+    is published with the data. A cancelled run keeps the changes its
+    committed batches made and gets the status 'cancelled'.
+    """
+    import pandas as pd
+
+    totals = dict.fromkeys(OPERATIONS.values(), 0)
+    with db.engine.begin() as conn:
+        run = conn.execute(select(ImportRun).where(ImportRun.id == run_id)).one()
+        watermarks = {'orders': run.orders_before, 'financials': run.financials_before}
+
+        for table in TRACKED_TABLES:
+            before = watermarks.get(table)
+            if scope is not None and table not in scope:
+                continue
+            if scope is not None and scope[table] is not None:
+                groups = list(scope[table])
+                new = table_digests(conn, table, groups=groups)
+                changes = _diff(_stored_digests(conn, table, groups), new)
+            elif not full and _appended(conn, table, before):
+                new = table_digests(conn, table, after_id=before)
+                empty = new['row_key'].iloc[:0]
+                changes = {'I': new['row_key'], 'U': empty, 'D': empty}
+            else:
+                new = table_digests(conn, table)
+                changes = _diff(_stored_digests(conn, table), new)
+
+            for operation, keys in changes.items():
+                totals[OPERATIONS[operation]] += len(keys)
+                rows = [{'run_id': run_id, 'table_name': table, 'row_key': key, 'operation': operation}
+                        for key in keys]
+                for chunk in _chunks(rows):
+                    conn.execute(insert(ChangeLog), chunk)
+
+            # Keep the stored digests in step with the table
+            for chunk in _chunks(changes['D'].tolist()):
+                conn.execute(delete(RowDigest).where(
+                    RowDigest.table_name == table, RowDigest.row_key.in_(chunk)
+                ))
+            changed = new[new['row_key'].isin(pd.concat([changes['I'], changes['U']]))]
+            rows = [{'table_name': table, 'row_key': key, 'group_key': group, 'digest': int(digest)}
+                    for key, group, digest in zip(changed['row_key'], changed['group_key'], changed['digest'])]
+            stmt = sqlite_insert(RowDigest)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[RowDigest.table_name, RowDigest.row_key],
+                set_={'digest': stmt.excluded.digest, 'group_key': stmt.excluded.group_key}
+            )
+            for chunk in _chunks(rows):
+                conn.execute(stmt, chunk)
+
+        conn.execute(ImportRun.__table__.update().where(ImportRun.id == run_id).values(
+            status='cancelled' if cancelled else 'failed' if failed else 'completed', finished_at=_now(), **totals
+        ))
+    return totals
+
+
+def fail_run(db, run_id, status='failed'):
+    """Mark a run whose data never reached the database ('failed' or 'cancelled')"""
+    with db.engine.begin() as conn:
+        conn.execute(ImportRun.__table__.update().where(ImportRun.id == run_id).values(
+            status=status, finished_at=_now()
+        ))
+
+
+def changes_since(db, run_id=0, table=None):
+    """Net changes made by the runs after run_id: {table: {'inserted': [...], 'updated': [...], 'deleted': [...]}}
+
+    A row inserted and then updated counts as inserted, a row inserted and
+    then deleted is left out, and a row deleted and inserted again counts
+    as updated. Pass the id of the last run a consumer has processed.
+    """
+    stmt = (
+        select(ChangeLog.table_name, ChangeLog.row_key, ChangeLog.operation)
+        .where(ChangeLog.run_id > run_id)
+        .order_by(ChangeLog.run_id, ChangeLog.id)
+    )
+    if table is not None:
+        stmt = stmt.where(ChangeLog.table_name == table)
+
+    first_last = {}
+    with db.engine.connect() as conn:
+        for name, key, operation in conn.execute(stmt):
+            first = first_last.get((name, key), (operation, operation))[0]
+            first_last[(name, key)] = (first, operation)
+
+    result = {name: {label: [] for label in OPERATIONS.values()}
+              for name in ([table] if table else TRACKED_TABLES)}
+    for (name, key), (first, last) in first_last.items():
+        if first == 'I':
+            net = None if last == 'D' else 'I'
+        elif first == 'D':
+            net = 'D' if last == 'D' else 'U'
+        else:
+            net = last
+        if net:
+            result[name][OPERATIONS[net]].append(key)
+    return result
+
+
+def last_run_id(db):
+    """Id of the most recent completed run (0 when there is none)"""
+    with db.engine.connect() as conn:
+        return conn.execute(
+            select(ImportRun.id).where(ImportRun.status == 'completed')
+            .order_by(ImportRun.id.desc()).limit(1)
+        ).scalar() or 0
+
+
+def recent_runs(db, limit=10):
+    """The latest import runs, newest first"""
+    session = db.get_session()
+    try:
+        return session.query(ImportRun).order_by(ImportRun.id.desc()).limit(limit).all()
+    finally:
+        session.close()
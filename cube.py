@@ -0,0 +1,166 @@
+"""
+Sales cube: order value grouped by customer, province, city, marketer and warehouse
+"""
+import os
+from sqlalchemy import select, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import User, Order, Meta, SalesCubeCell
+import analytics
+
+CHUNK_SIZE = 100000  # joined order rows aggregated at a time
+UNKNOWN = '(unknown)'
+
+# Cubes aggregated for read-only readers, which cannot store them: path -> (generation, rankings)
+_rankings = {}
+
+# Dimension name -> column of orders joined to users
+DIMENSIONS = {
+    'customer': Order.subscription_code,
+    'province': User.province,
+    'city': User.city,
+    'marketer': Order.marketer_code,
+    'warehouse': Order.warehouse_code,
+}
+
+DIMENSION_LABELS = {
+    'customer': 'Customer',
+    'province': 'Province',
+    'city': 'City',
+    'marketer': 'Marketer',
+    'warehouse': 'Warehouse',
+}
+
+
+class SalesCube:
+    """Builds and queries the stored sales cube"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def is_current(self):
+        """True when the stored cube was built from the current import generation"""
+        return self.db.get_meta('sales_cube_generation', None) == self.db.get_generation()
+
+    def aggregate(self, generation=None):
+        """Aggregate every dimension in one pass over orders joined to users
+
+        Like GROUPING SETS: each chunk of the scan is factorized per dimension
+        and summed with bincount, then the partial sums are merged. Returns
+        sales_cube rows as dicts. An up-to-date analytics mirror answers
+        with one GROUPING SETS query instead.
+        """
+        import numpy as np
+        import pandas as pd
+
+        mirror = analytics.current_mirror(self.db.db_path, generation=generation)
+        if mirror is not None:
+            return mirror.sales_cube(DIMENSIONS)
+
+        stmt = select(
+            Order.total_value,
+            *[column.label(name) for name, column in DIMENSIONS.items()]
+        ).select_from(Order).outerjoin(User, User.subscription_code == Order.subscription_code)
+
+        totals = {}
+        with self.db.engine.connect() as conn:
+            for chunk in pd.read_sql(stmt, conn, chunksize=CHUNK_SIZE):
+                values = chunk['total_value'].fillna(0).to_numpy(dtype=float)
+
+                for name in DIMENSIONS:
+                    column = chunk[name]
+                    if pd.api.types.is_float_dtype(column):
+                        column = column.astype('Int64')  # codes read back as floats when NULLs are present
+                    members = column.astype(str).where(column.notna(), UNKNOWN)
+
+                    codes, uniques = pd.factorize(members)
+                    part = pd.DataFrame({
+                        'order_lines': np.bincount(codes, minlength=len(uniques)),
+                        'total_value': np.bincount(codes, weights=values, minlength=len(uniques))
+                    }, index=uniques)
+                    totals[name] = part if name not in totals else totals[name].add(part, fill_value=0)
+
+        rows = []
+        for name, frame in totals.items():
+            rows.extend(
+                {'dimension': name, 'member': member, 'order_lines': int(lines), 'total_value': float(total)}
+                for member, lines, total in zip(frame.index, frame['order_lines'], frame['total_value'])
+            )
+        return rows
+
+    def build(self, generation=None):
+        """Aggregate the cube and store it for `generation` (the current import generation by default)"""
+        if generation is None:
+            generation = self.db.get_generation()
+        rows = self.aggregate(generation)
+
+        with self.db.engine.begin() as conn:
+            conn.execute(delete(SalesCubeCell))
+            if rows:
+                conn.execute(insert(SalesCubeCell), rows)
+            conn.execute(
+                sqlite_insert(Meta).values(key='sales_cube_generation', value=generation)
+                .on_conflict_do_update(index_elements=[Meta.key], set_={'value': generation})
+            )
+
+        return len(rows)
+
+    def rankings(self):
+        """Return {dimension: [(member, order_lines, total_value)]}, largest first, without storing them
+
+        For read-only readers: the cube is aggregated once per import
+        generation and kept in memory for every dimension.
+        """
+        generation = self.db.get_generation()
+        key = os.path.abspath(self.db.db_path)
+        entry = _rankings.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+
+        rankings = {name: [] for name in DIMENSIONS}
+        for cell in sorted(self.aggregate(), key=lambda cell: cell['total_value'], reverse=True):
+            rankings[cell['dimension']].append((cell['member'], cell['order_lines'], cell['total_value']))
+        _rankings[key] = (generation, rankings)
+        return rankings
+
+    def top(self, dimension, limit=10):
+        """Return [(member, label, order_lines, total_value)] for the largest members of a dimension"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        # The analytics mirror ranks straight from the columns, without the stored cube
+        mirror = analytics.current_mirror(self.db.db_path)
+        stale = mirror is None and not self.is_current()
+        if stale and not self.db.read_only:
+            # Imports build the cube; this covers writers that do not (purges, the ingestion daemon)
+            self.build()
+
+        session = self.db.get_session()
+        try:
+            if mirror is not None:
+                rows = mirror.cube_top(dimension, limit)
+            elif stale and self.db.read_only:
+                rows = self.rankings()[dimension][:limit]
+            else:
+                rows = session.query(
+                    SalesCubeCell.member,
+                    SalesCubeCell.order_lines,
+                    SalesCubeCell.total_value
+                ).filter(
+                    SalesCubeCell.dimension == dimension
+                ).order_by(
+                    SalesCubeCell.total_value.desc()
+                ).limit(limit).all()
+
+            # Show customer names instead of bare codes
+            labels = {}
+            if dimension == 'customer':
+                codes = [int(member) for member, _, _ in rows if member.isdigit()]
+                labels = {
+                    str(code): f"{name or ''} {surname or ''}".strip()
+                    for code, name, surname in session.query(
+                        User.subscription_code, User.name, User.surname
+                    ).filter(User.subscription_code.in_(codes))
+                }
+
+            return [(member, labels.get(member, member), lines, total) for member, lines, total in rows]
+        finally:
+            session.close()
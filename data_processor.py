@@ -1,271 +1,1065 @@
 """
 Data processing module for reading Excel files and importing to database
+
+pandas, NumPy and xlrd are imported on first use so that browsing the
+data does not pay for loading them.
 """
-import pandas as pd
-from models import Database, User, Order, Financial
+import glob
+import os
+import queue
+import tempfile
+import threading
+from collections import deque
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Database, User, Order, Financial, dispose_engine
+import queries
+from normalize import normalized_identifiers
+from validation import Validator
+import changelog
+import analytics
+from integrity import IntegrityAudit
+from cube import SalesCube
+from readers import TEXT_KINDS, read_chunks, sheet_headers
+from progress import ImportCancelled, ProgressReporter
+
+KEY_LOOKUP_CHUNK = 500  # invoice ids or codes per IN (...) lookup of stored natural keys
+BATCH_SIZE = 5000       # rows per converted batch and per write transaction
+QUEUE_SIZE = 4          # batches buffered between the converter and the writer
+
+# Spreadsheet layout of each dataset: (model attribute, column header, kind)
+USER_COLUMNS = [
+    ('subscription_code', 'کد اشتراک', 'int'),
+    ('name', 'نام', 'str'),
+    ('surname', 'نام خانوادگی', 'str'),
+    ('father_name', 'نام پدر', 'str'),
+    ('certificate_number', 'شماره شناسنامه', 'str'),
+    ('national_id', 'کد ملی/شناسه ملی', 'str'),
+    ('second_name', 'نام دوم (چاپی)', 'str'),
+    ('phone1', 'تلفن 1', 'str'),
+    ('phone2', 'تلفن 2', 'str'),
+    ('phone3', 'تلفن 3', 'str'),
+    ('mobile', 'موبایل', 'str'),
+    ('fax', 'نمابر', 'str'),
+    ('economic_code', 'کد اقتصادی', 'str'),
+    ('address', 'آدرس', 'str'),
+    ('postal_code', 'کد پستی', 'str'),
+    ('email', 'ایمیل', 'str'),
+    ('province', 'استان', 'category'),
+    ('city', 'شهرستان', 'category'),
+]
+
+ORDER_COLUMNS = [
+    ('invoice_id', 'شناسه فاکتور', 'str'),
+    ('invoice_date', 'تاریخ فاکتور', 'str'),
+    ('subscription_code', 'کد اشتراک', 'int'),
+    ('person_name', 'نام شخص', 'str'),
+    ('description', 'توضیحات', 'str'),
+    ('settlement_type', 'نوع تسویه', 'category'),
+    ('settlement_date', 'تاریخ تسویه', 'str'),
+    ('expiry_date', 'تاریخ انقضا', 'str'),
+    ('person_subject_code', 'کدبابت شخص', 'category'),
+    ('operation_subject_code', 'کد بابت عملیات', 'category'),
+    ('invoice_nature_code', 'کد ماهیت فاکتور', 'category'),
+    ('marketer_code', 'کد بازاریاب', 'category'),
+    ('amount_discount', 'تخفیف مبلغی', 'float'),
+    ('total_tax_percent', 'درصد مالیات کل', 'float'),
+    ('total_toll_percent', 'درصد عوارض کل', 'float'),
+    ('warehouse_code', 'کد انبار', 'category'),
+    ('warehouse_name', 'نام انبار', 'category'),
+    ('product_code', 'کد کالا', 'category'),
+    ('product_name', 'نام کالا', 'category'),
+    # The sheet has two "توضیحات" headers; pandas renames the line-item one
+    ('item_description', 'توضیحات.1', 'str'),
+    ('special_coef1', 'ضریب ویژه 1', 'float'),
+    ('special_coef2', 'ضریب ویژه 2', 'float'),
+    ('special_coef3', 'ضریب ویژه 3', 'float'),
+    ('quantity', 'تعداد (واحد اصلی)', 'int'),
+    ('secondary_quantity', 'مقدار (واحد فرعی)', 'float'),
+    ('price', 'فی', 'float'),
+    ('price_foreign', 'فی (ارزی)', 'float'),
+    ('discount_percent', 'درصد/مبلغ تخفیف', 'float'),
+    ('tax_percent', 'درصد مالیات', 'float'),
+    ('toll_percent', 'درصد عوارض', 'float'),
+    ('sending_nature_code', 'کد ماهیت ارسال', 'category'),
+    ('sending_date', 'تاریخ ارسال', 'str'),
+]
+
+# Headers in the financials sheet carry a trailing space
+FINANCIAL_COLUMNS = [
+    ('subscription_code', 'کد اشتراک ', 'int'),
+    ('amount', 'مبلغ ', 'float'),
+    ('loan_code', 'کد وام ', 'category'),
+    ('description', 'توضیحات ', 'str'),
+]
+
+DATASET_COLUMNS = {
+    'users': USER_COLUMNS,
+    'orders': ORDER_COLUMNS,
+    'financials': FINANCIAL_COLUMNS,
+}
+
+# Label of one row in error messages
+ROW_LABELS = {
+    'users': 'user',
+    'orders': 'order',
+    'financials': 'financial',
+}
+
+# Model each dataset is written to
+MODELS = {
+    'users': User,
+    'orders': Order,
+    'financials': Financial,
+}
+
+# Dataset -> (natural key columns, column its stored keys are looked up by); rows whose key is stored are skipped
+NATURAL_KEYS = {
+    'orders': (('invoice_id', 'product_code', 'line_number'), 'invoice_id'),
+    'financials': (('subscription_code', 'loan_code', 'amount', 'description', 'entry_number'), 'subscription_code'),
+}
+
+# Sheet holding a dataset in workbooks with several sheets (first sheet otherwise)
+SHEET_NAMES = {
+    'financials': 'Sheet1',
+}
+
+# Share of a spec's headers a sheet must contain to be recognised as that dataset
+MIN_HEADER_MATCH = 0.6
+
+_DONE = object()
+
+# (database path, cache key) -> (import generation, value)
+_result_cache = {}
+
+
+def _empty_stats():
+    """Fresh counters for an import run"""
+    return {
+        'users_imported': 0,
+        'orders_imported': 0,
+        'financials_imported': 0,
+        'orders_duplicates': 0,
+        'financials_duplicates': 0,
+        'rows_rejected': 0,
+        'validation': {},
+        'run_id': None,
+        'changes': {},
+        'cancelled': False,
+        'orphans': {},
+        'errors': []
+    }
+
+
+def _write_users(session, rows):
+    """Upsert a batch of users by subscription code"""
+    stmt = sqlite_insert(User)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.subscription_code],
+        set_={column.name: stmt.excluded[column.name]
+              for column in User.__table__.columns if not column.primary_key}
+    )
+    session.execute(stmt, rows)
+
+
+def _write_orders(session, rows):
+    """Insert a batch of order lines"""
+    session.execute(insert(Order), rows)
+
+
+def _write_financials(session, rows):
+    """Insert a batch of financial records"""
+    session.execute(insert(Financial), rows)
+
+
+WRITERS = {
+    'users': _write_users,
+    'orders': _write_orders,
+    'financials': _write_financials,
+}
+
+
+def _stripped_category(values):
+    """A categorical column with its categories stripped, converting each distinct value once"""
+    import numpy as np
+    import pandas as pd
+
+    values = values.astype('category')
+    stripped = values.cat.categories.astype(str).str.strip()
+    categories = stripped.unique()
+    # Old code -> new code; the trailing -1 keeps missing values (code -1) missing
+    mapping = np.append(categories.get_indexer(stripped), -1)
+    codes = mapping[values.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index)
+
+
+def _blank_if_missing(values):
+    """Missing values as '', keeping a categorical column categorical"""
+    if values.dtype == 'category' and '' not in values.cat.categories:
+        values = values.cat.add_categories('')
+    return values.fillna('')
+
+
+def _convert_frame(df, columns, label, errors):
+    """Convert a slice of a sheet into model columns, column by column
+
+    Rows with unparseable numbers are dropped and reported in `errors`.
+    """
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.DataFrame(index=df.index)
+
+    for attribute, header, kind in columns:
+        if header not in df.columns:
+            frame[attribute] = None
+            continue
+
+        values = df[header]
+        if kind == 'category':
+            frame[attribute] = _stripped_category(values)
+        elif kind in TEXT_KINDS:
+            text = values.astype(str).str.strip()
+            frame[attribute] = text.where(values.notna(), None)
+        else:
+            numbers = pd.to_numeric(values, errors='coerce')
+            invalid = numbers.isna() & values.notna()
+            for index in invalid[invalid].index:
+                errors.append(f"Error importing {label} at row {index + 2}: invalid {header.strip()} '{values[index]}'")
+            if invalid.any():
+                frame = frame[~invalid]
+                numbers = numbers[~invalid]
+            if kind == 'int':
+                numbers = np.trunc(numbers).astype('Int64')
+            frame[attribute] = numbers
+
+    return frame
+
+
+def _prepare_users(frame):
+    """Drop users without a subscription code and add the normalized identifiers"""
+    frame = frame[frame['subscription_code'].fillna(0) != 0]
+    return frame.assign(**normalized_identifiers(frame))
+
+
+def _number_within(groups, counters):
+    """Number rows 1, 2, ... within their group, continuing from the counts in counters (which are updated)"""
+    offset = groups.map(counters).fillna(0).astype(int)
+    numbers = offset + groups.groupby(groups, sort=False).cumcount() + 1
+    for group, count in groups.value_counts().items():
+        counters[group] = counters.get(group, 0) + count
+    return numbers
+
+
+def _prepare_orders(frame, line_counters):
+    """Number lines within their invoice, compute line totals and drop lines without a customer
+
+    line_counters maps invoice id -> lines seen so far and is updated, so
+    numbering continues across the batches of one file.
+    """
+    # Missing key parts are stored as '', so a re-imported line matches its stored natural key
+    frame['invoice_id'] = _blank_if_missing(frame['invoice_id'])
+    frame['product_code'] = _blank_if_missing(frame['product_code'])
+    frame['line_number'] = _number_within(frame['invoice_id'], line_counters)
+
+    frame['quantity'] = frame['quantity'].fillna(0)
+    frame['price'] = frame['price'].fillna(0.0)
+    frame['total_value'] = frame['quantity'].astype(float) * frame['price']
+    return frame[frame['subscription_code'].fillna(0) != 0]
+
+
+def _prepare_financials(frame, entry_counters):
+    """Default missing values, number repeated records and drop records without a customer
+
+    Identical records (customer, loan code, amount and description) of one
+    file get entry numbers 1, 2, ...; entry_counters holds the copies seen
+    so far and is updated, so numbering continues across batches.
+    """
+    frame['amount'] = frame['amount'].fillna(0.0)
+    frame['loan_code'] = _blank_if_missing(frame['loan_code'])
+    frame['description'] = _blank_if_missing(frame['description'])
+    record = (frame['subscription_code'].astype(str) + '|' + frame['loan_code'].astype(str) + '|'
+              + frame['amount'].astype(str) + '|' + frame['description'])
+    frame['entry_number'] = _number_within(record, entry_counters)
+    return frame[frame['subscription_code'].fillna(0) != 0]
+
+
+def _new_row_mask(frame, dataset, seen_keys):
+    """Boolean mask of rows whose natural key is not in seen_keys; new keys are added to it"""
+    import numpy as np
+
+    keys = zip(*(frame[column] for column in NATURAL_KEYS[dataset][0]))
+    is_new = np.ones(len(frame), dtype=bool)
+    for position, key in enumerate(keys):
+        if key in seen_keys:
+            is_new[position] = False
+        else:
+            seen_keys.add(key)
+    return is_new
+
+
+def _parse_file(dataset, file_path):
+    """Read and convert a whole workbook; runs in a worker process of import_batch
+
+    Returns (frame, rows read, errors).
+    """
+    import pandas as pd
+
+    columns = DATASET_COLUMNS[dataset]
+    errors = []
+    rows_read = 0
+    counters = {}
+    frames = []
+    for chunk in read_chunks(file_path, columns, BATCH_SIZE, SHEET_NAMES.get(dataset)):
+        rows_read += len(chunk)
+        frame = _convert_frame(chunk, columns, ROW_LABELS[dataset], errors)
+        if dataset == 'users':
+            frame = _prepare_users(frame)
+        elif dataset == 'orders':
+            frame = _prepare_orders(frame, counters)
+        else:
+            frame = _prepare_financials(frame, counters)
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=[attribute for attribute, _, _ in columns]), 0, errors
+    return pd.concat(frames), rows_read, errors
+
+
+def _ignore_interrupt():
+    """Worker process initializer: Ctrl+C is handled (as a cancel) by the importing process"""
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _expand_paths(patterns):
+    """File names and glob patterns -> matching paths, sorted per pattern and without repeats"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def detect_dataset(headers):
+    """Return the dataset whose column spec best matches a sheet's headers, or None"""
+    headers = {str(header).strip() for header in headers}
+    best, best_share = None, MIN_HEADER_MATCH
+    for dataset, columns in DATASET_COLUMNS.items():
+        expected = {header.strip() for _, header, _ in columns}
+        share = len(expected & headers) / len(expected)
+        if share > best_share or (share == best_share and best is None):
+            best, best_share = dataset, share
+    return best
+
+
+def _records(frame):
+    """Turn a converted batch into plain dicts with None for missing values"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+class ImportPipeline:
+    """Overlaps parsing and conversion with database writes
+
+    The calling thread produces (dataset, write_batch, rows) items into a
+    bounded queue; a writer thread drains it and commits every batch in its
+    own transaction. A full queue blocks the producer, and a write error
+    stops the producer and is raised from run(). A cancelled token stops
+    the producer before its next batch; batches still queued are dropped
+    and ImportCancelled is raised from run().
+    """
+
+    def __init__(self, db, queue_size=QUEUE_SIZE, cancel_token=None):
+        self.db = db
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.cancel_token = cancel_token
+        self.rows_written = {}
+        self.error = None
+        self.cancelled = False
+
+    def _writer(self):
+        """Drain the queue into the database"""
+        session = self.db.get_session()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                if self.error is not None or self.cancelled:
+                    continue  # keep draining so the producer never blocks
+
+                dataset, write_batch, rows = item
+                try:
+                    write_batch(session, rows)
+                    session.commit()
+                    self.rows_written[dataset] = self.rows_written.get(dataset, 0) + len(rows)
+                except Exception as e:
+                    session.rollback()
+                    self.error = e
+        finally:
+            session.close()
+
+    def run(self, items):
+        """Feed items to the writer thread and wait until everything is written"""
+        writer = threading.Thread(target=self._writer, name='import-writer', daemon=True)
+        writer.start()
+        try:
+            for item in items:
+                self.cancelled = self.cancel_token is not None and self.cancel_token.cancelled
+                if self.error is not None or self.cancelled:
+                    break
+                self.queue.put(item)
+            # Readers stop early when cancelled, which ends items() normally
+            self.cancelled = self.cancel_token is not None and self.cancel_token.cancelled
+        finally:
+            self.queue.put(_DONE)
+            writer.join()
+
+        if self.error is not None:
+            raise self.error
+        if self.cancelled:
+            raise ImportCancelled("Import cancelled")
+        return self.rows_written
 
 
 class DataProcessor:
     """Handles data import from Excel files to database"""
 
-    def __init__(self, db_path='data.db'):
-        self.db = Database(db_path)
-        self.stats = {
-            'users_imported': 0,
-            'orders_imported': 0,
-            'financials_imported': 0,
-            'errors': []
-        }
+    def __init__(self, db_path='data.db', db=None, severities=None):
+        self.db = db or Database(db_path)
+        self.severities = severities or {}  # validation rule -> 'error' or 'warning' overrides
+        self.stats = _empty_stats()
+        self._track()
 
-    def import_users_from_excel(self, file_path, log_callback=None):
-        """Import users from excel1.xls"""
-        if log_callback:
-            log_callback(f"Reading users from: {file_path}")
+    def _track(self, progress_callback=None, cancel_token=None):
+        """Set where the next import reports progress and which token can cancel it"""
+        self._progress = ProgressReporter(progress_callback)
+        self._cancel_token = cancel_token
 
-        try:
-            # Read Excel file
-            df = pd.read_excel(file_path, engine='xlrd')
+    def _cancelled(self):
+        """True when the running import was asked to stop"""
+        return self._cancel_token is not None and self._cancel_token.cancelled
 
-            if log_callback:
-                log_callback(f"Found {len(df)} rows in users file")
+    def _convert_frame(self, df, columns, label):
+        """Convert a slice of a sheet into model columns, recording bad cells in the stats"""
+        return _convert_frame(df, columns, label, self.stats['errors'])
 
-            session = self.db.get_session()
-            imported_count = 0
+    def _validate(self, dataset, frame):
+        """Run the validation rules of a dataset over a batch and drop the rejected rows"""
+        checked = self._validator.apply(dataset, frame)
+        self.stats['rows_rejected'] += len(frame) - len(checked)
+        return checked
 
-            for index, row in df.iterrows():
-                try:
-                    # Create user object
-                    user = User(
-                        subscription_code=int(row.get('کد اشتراک', 0)) if pd.notna(row.get('کد اشتراک')) else None,
-                        name=str(row.get('نام', '')).strip() if pd.notna(row.get('نام')) else None,
-                        surname=str(row.get('نام خانوادگی', '')).strip() if pd.notna(row.get('نام خانوادگی')) else None,
-                        father_name=str(row.get('نام پدر', '')).strip() if pd.notna(row.get('نام پدر')) else None,
-                        certificate_number=str(row.get('شماره شناسنامه', '')).strip() if pd.notna(row.get('شماره شناسنامه')) else None,
-                        national_id=str(row.get('کد ملی/شناسه ملی', '')).strip() if pd.notna(row.get('کد ملی/شناسه ملی')) else None,
-                        second_name=str(row.get('نام دوم (چاپی)', '')).strip() if pd.notna(row.get('نام دوم (چاپی)')) else None,
-                        phone1=str(row.get('تلفن 1', '')).strip() if pd.notna(row.get('تلفن 1')) else None,
-                        phone2=str(row.get('تلفن 2', '')).strip() if pd.notna(row.get('تلفن 2')) else None,
-                        phone3=str(row.get('تلفن 3', '')).strip() if pd.notna(row.get('تلفن 3')) else None,
-                        mobile=str(row.get('موبایل', '')).strip() if pd.notna(row.get('موبایل')) else None,
-                        fax=str(row.get('نمابر', '')).strip() if pd.notna(row.get('نمابر')) else None,
-                        economic_code=str(row.get('کد اقتصادی', '')).strip() if pd.notna(row.get('کد اقتصادی')) else None,
-                        address=str(row.get('آدرس', '')).strip() if pd.notna(row.get('آدرس')) else None,
-                        postal_code=str(row.get('کد پستی', '')).strip() if pd.notna(row.get('کد پستی')) else None,
-                        email=str(row.get('ایمیل', '')).strip() if pd.notna(row.get('ایمیل')) else None,
-                        province=str(row.get('استان', '')).strip() if pd.notna(row.get('استان')) else None,
-                        city=str(row.get('شهرستان', '')).strip() if pd.notna(row.get('شهرستان')) else None
-                    )
-
-                    if user.subscription_code:
-                        session.merge(user)  # Use merge to handle duplicates
-                        imported_count += 1
+    def _user_batches(self, chunks):
+        """Yield converted user rows, one batch per chunk read"""
+        for chunk in chunks:
+            frame = _prepare_users(self._convert_frame(chunk, USER_COLUMNS, 'user'))
+            yield _records(self._validate('users', frame))
 
-                except Exception as e:
-                    error_msg = f"Error importing user at row {index + 2}: {str(e)}"
-                    self.stats['errors'].append(error_msg)
-                    if log_callback:
-                        log_callback(f"⚠️ {error_msg}")
+    def _order_batches(self, chunks, db=None):
+        """Yield converted order lines, one batch per chunk read, skipping natural-key duplicates"""
+        yield from self._keyed_batches('orders', chunks, _prepare_orders, db)
+
+    def _financial_batches(self, chunks, db=None):
+        """Yield converted financial records, one batch per chunk read, skipping natural-key duplicates"""
+        yield from self._keyed_batches('financials', chunks, _prepare_financials, db)
 
-            session.commit()
+    def _keyed_batches(self, dataset, chunks, prepare, db=None):
+        """Convert, validate and deduplicate the chunks of a dataset with a natural key"""
+        self.stats[f'{dataset}_duplicates'] = 0
+        seen_keys = set()
+        looked_up = set()
+        counters = {}
+
+        session = (db or self.db).get_session()
+        try:
+            for chunk in chunks:
+                frame = self._convert_frame(chunk, DATASET_COLUMNS[dataset], ROW_LABELS[dataset])
+                frame = self._validate(dataset, prepare(frame, counters))
+                is_new = self._new_rows(session, dataset, frame, seen_keys, looked_up)
+                self.stats[f'{dataset}_duplicates'] += int((~is_new).sum())
+                yield _records(frame[is_new])
+        finally:
             session.close()
 
-            self.stats['users_imported'] = imported_count
-            if log_callback:
-                log_callback(f"✅ Successfully imported {imported_count} users")
+    def _new_rows(self, session, dataset, frame, seen_keys, looked_up):
+        """Mask of rows whose natural key is neither stored nor seen earlier in the run
+
+        The stored keys of invoices (orders) or customers (financials) met
+        for the first time are looked up and added to seen_keys.
+        """
+        group = NATURAL_KEYS[dataset][1]
+        values = {value.item() if hasattr(value, 'item') else value for value in frame[group].dropna()} - looked_up
+        seen_keys.update(self._existing_keys(session, dataset, list(values)))
+        looked_up.update(values)
+        return _new_row_mask(frame, dataset, seen_keys)
 
-            return imported_count
+    def _chunks(self, dataset, file_path, log_callback=None):
+        """Stream a file's rows for a dataset in BATCH_SIZE chunks, reporting progress and logging how many were found"""
+        rows = 0
+        self._progress.start(dataset)
+        for chunk in read_chunks(file_path, DATASET_COLUMNS[dataset], BATCH_SIZE, SHEET_NAMES.get(dataset),
+                                 on_total=self._progress.expect):
+            if self._cancelled():
+                return  # the pipeline reports the cancellation
+            rows += len(chunk)
+            yield chunk
+            self._progress.advance(len(chunk))
+        self._progress.finish()
+        if log_callback:
+            log_callback(f"Found {rows} rows in {dataset} file")
+
+    def _read_users(self, file_path, log_callback=None):
+        """Read the users sheet and yield pipeline items"""
+        if log_callback:
+            log_callback(f"Reading users from: {file_path}")
+
+        try:
+            chunks = self._chunks('users', file_path, log_callback)
+            for rows in self._user_batches(chunks):
+                if rows:
+                    yield 'users', _write_users, rows
 
         except Exception as e:
             error_msg = f"Error reading users file: {str(e)}"
+            self._failed_datasets.add('users')
             self.stats['errors'].append(error_msg)
             if log_callback:
                 log_callback(f"❌ {error_msg}")
-            return 0
 
-    def import_orders_from_excel(self, file_path, log_callback=None):
-        """Import orders from excel2.xls"""
+    def _read_orders(self, file_path, log_callback=None, db=None):
+        """Read the orders sheet and yield pipeline items"""
         if log_callback:
             log_callback(f"Reading orders from: {file_path}")
 
         try:
-            df = pd.read_excel(file_path, engine='xlrd')
+            chunks = self._chunks('orders', file_path, log_callback)
+            for rows in self._order_batches(chunks, db):
+                if rows:
+                    yield 'orders', _write_orders, rows
 
+        except Exception as e:
+            error_msg = f"Error reading orders file: {str(e)}"
+            self._failed_datasets.add('orders')
+            self.stats['errors'].append(error_msg)
             if log_callback:
-                log_callback(f"Found {len(df)} rows in orders file")
-
-            session = self.db.get_session()
-            imported_count = 0
-
-            for index, row in df.iterrows():
-                try:
-                    # Calculate total value
-                    quantity = int(row.get('تعداد (واحد اصلی)', 0)) if pd.notna(row.get('تعداد (واحد اصلی)')) else 0
-                    price = float(row.get('فی', 0)) if pd.notna(row.get('فی')) else 0.0
-                    total_value = quantity * price
-
-                    order = Order(
-                        invoice_id=str(row.get('شناسه فاکتور', '')).strip() if pd.notna(row.get('شناسه فاکتور')) else None,
-                        invoice_date=str(row.get('تاریخ فاکتور', '')).strip() if pd.notna(row.get('تاریخ فاکتور')) else None,
-                        subscription_code=int(row.get('کد اشتراک', 0)) if pd.notna(row.get('کد اشتراک')) else None,
-                        person_name=str(row.get('نام شخص', '')).strip() if pd.notna(row.get('نام شخص')) else None,
-                        description=str(row.get('توضیحات', '')).strip() if pd.notna(row.get('توضیحات')) else None,
-                        settlement_type=str(row.get('نوع تسویه', '')).strip() if pd.notna(row.get('نوع تسویه')) else None,
-                        settlement_date=str(row.get('تاریخ تسویه', '')).strip() if pd.notna(row.get('تاریخ تسویه')) else None,
-                        expiry_date=str(row.get('تاریخ انقضا', '')).strip() if pd.notna(row.get('تاریخ انقضا')) else None,
-                        person_subject_code=str(row.get('کدبابت شخص', '')).strip() if pd.notna(row.get('کدبابت شخص')) else None,
-                        operation_subject_code=str(row.get('کد بابت عملیات', '')).strip() if pd.notna(row.get('کد بابت عملیات')) else None,
-                        invoice_nature_code=str(row.get('کد ماهیت فاکتور', '')).strip() if pd.notna(row.get('کد ماهیت فاکتور')) else None,
-                        marketer_code=str(row.get('کد بازاریاب', '')).strip() if pd.notna(row.get('کد بازاریاب')) else None,
-                        amount_discount=float(row.get('تخفیف مبلغی', 0)) if pd.notna(row.get('تخفیف مبلغی')) else None,
-                        total_tax_percent=float(row.get('درصد مالیات کل', 0)) if pd.notna(row.get('درصد مالیات کل')) else None,
-                        total_toll_percent=float(row.get('درصد عوارض کل', 0)) if pd.notna(row.get('درصد عوارض کل')) else None,
-                        warehouse_code=str(row.get('کد انبار', '')).strip() if pd.notna(row.get('کد انبار')) else None,
-                        warehouse_name=str(row.get('نام انبار', '')).strip() if pd.notna(row.get('نام انبار')) else None,
-                        product_code=str(row.get('کد کالا', '')).strip() if pd.notna(row.get('کد کالا')) else None,
-                        product_name=str(row.get('نام کالا', '')).strip() if pd.notna(row.get('نام کالا')) else None,
-                        item_description=str(row.get('توضیحات', '')).strip() if pd.notna(row.get('توضیحات')) else None,
-                        special_coef1=float(row.get('ضریب ویژه 1', 0)) if pd.notna(row.get('ضریب ویژه 1')) else None,
-                        special_coef2=float(row.get('ضریب ویژه 2', 0)) if pd.notna(row.get('ضریب ویژه 2')) else None,
-                        special_coef3=float(row.get('ضریب ویژه 3', 0)) if pd.notna(row.get('ضریب ویژه 3')) else None,
-                        quantity=quantity,
-                        secondary_quantity=float(row.get('مقدار (واحد فرعی)', 0)) if pd.notna(row.get('مقدار (واحد فرعی)')) else None,
-                        price=price,
-                        price_foreign=float(row.get('فی (ارزی)', 0)) if pd.notna(row.get('فی (ارزی)')) else None,
-                        discount_percent=float(row.get('درصد/مبلغ تخفیف', 0)) if pd.notna(row.get('درصد/مبلغ تخفیف')) else None,
-                        tax_percent=float(row.get('درصد مالیات', 0)) if pd.notna(row.get('درصد مالیات')) else None,
-                        toll_percent=float(row.get('درصد عوارض', 0)) if pd.notna(row.get('درصد عوارض')) else None,
-                        sending_nature_code=str(row.get('کد ماهیت ارسال', '')).strip() if pd.notna(row.get('کد ماهیت ارسال')) else None,
-                        sending_date=str(row.get('تاریخ ارسال', '')).strip() if pd.notna(row.get('تاریخ ارسال')) else None,
-                        total_value=total_value
-                    )
-
-                    if order.subscription_code:
-                        session.add(order)
-                        imported_count += 1
+                log_callback(f"❌ {error_msg}")
 
-                except Exception as e:
-                    error_msg = f"Error importing order at row {index + 2}: {str(e)}"
-                    self.stats['errors'].append(error_msg)
-                    if log_callback:
-                        log_callback(f"⚠️ {error_msg}")
+    def _read_financials(self, file_path, log_callback=None, db=None):
+        """Read the financials sheet and yield pipeline items"""
+        if log_callback:
+            log_callback(f"Reading financials from: {file_path}")
 
-            session.commit()
-            session.close()
+        try:
+            chunks = self._chunks('financials', file_path, log_callback)
+            for rows in self._financial_batches(chunks, db):
+                if rows:
+                    yield 'financials', _write_financials, rows
 
-            self.stats['orders_imported'] = imported_count
+        except Exception as e:
+            error_msg = f"Error reading financials file: {str(e)}"
+            self._failed_datasets.add('financials')
+            self.stats['errors'].append(error_msg)
             if log_callback:
-                log_callback(f"✅ Successfully imported {imported_count} orders")
+                log_callback(f"❌ {error_msg}")
 
-            return imported_count
+    def _import(self, files, log_callback=None, db=None):
+        """Import {dataset: file_path} through one pipeline and return the rows written per dataset"""
+        target = db or self.db
+        readers = {
+            'users': lambda path: self._read_users(path, log_callback),
+            'orders': lambda path: self._read_orders(path, log_callback, target),
+            'financials': lambda path: self._read_financials(path, log_callback, target)
+        }
+        self._failed_datasets = set()
+        self._validator = Validator(target, self.stats['validation'], self.severities)
+
+        def items():
+            for dataset, file_path in files.items():
+                yield from readers[dataset](file_path)
 
+        pipeline = ImportPipeline(target, cancel_token=self._cancel_token)
+        try:
+            pipeline.run(items())
+        except ImportCancelled:
+            self.stats['cancelled'] = True
+            if log_callback:
+                log_callback("⏹️ Import cancelled" + ("; batches written so far are kept" if target is self.db else ""))
         except Exception as e:
-            error_msg = f"Error reading orders file: {str(e)}"
+            error_msg = f"Error writing to database: {str(e)}"
+            self._failed_datasets.update(files)
             self.stats['errors'].append(error_msg)
             if log_callback:
                 log_callback(f"❌ {error_msg}")
-            return 0
+
+        # Only committed batches count as imported
+        labels = {'users': 'users', 'orders': 'orders', 'financials': 'financial records'}
+        imported = {}
+        for dataset in files:
+            imported[dataset] = pipeline.rows_written.get(dataset, 0)
+            self.stats[f'{dataset}_imported'] = imported[dataset]
+            if log_callback and dataset not in self._failed_datasets:
+                log_callback(f"✅ Successfully imported {imported[dataset]} {labels[dataset]}")
+                if self.stats.get(f'{dataset}_duplicates'):
+                    log_callback(f"♻️ Skipped {self.stats[f'{dataset}_duplicates']} duplicate {labels[dataset]}")
+
+        if log_callback:
+            for dataset, rule, severity, description, count in self._validator.summary():
+                action = "rejected" if severity == 'error' else "kept"
+                log_callback(f"🔎 {count} {labels[dataset]} {action}: {description} ({rule})")
+
+        return imported
+
+    def import_users_from_excel(self, file_path, log_callback=None):
+        """Import users from excel1.xls"""
+        rows = self._import({'users': file_path}, log_callback)['users']
+        self.db.bump_generation()
+        return rows
+
+    def import_orders_from_excel(self, file_path, log_callback=None):
+        """Import orders from excel2.xls"""
+        rows = self._import({'orders': file_path}, log_callback)['orders']
+        self.db.bump_generation()
+        return rows
 
     def import_financials_from_excel(self, file_path, log_callback=None):
         """Import financial records from excel3.xls"""
+        rows = self._import({'financials': file_path}, log_callback)['financials']
+        self.db.bump_generation()
+        return rows
+
+    def import_file(self, file_path, dataset=None, log_callback=None):
+        """Append one workbook to the database, detecting its dataset from the headers when not given
+
+        Returns (dataset, rows imported); dataset is None when the headers match no dataset.
+        """
+        self.stats = _empty_stats()
+        self._track()
+        dataset = dataset or detect_dataset(sheet_headers(file_path))
+        if dataset is None:
+            return None, 0
+        run_id = changelog.start_run(self.db, 'file', [file_path])
+        rows = self._import({dataset: file_path}, log_callback)[dataset]
+        self._finish_run(run_id, [dataset], log_callback)
+        self.db.bump_generation()
+        return dataset, rows
+
+    def _publish(self, log_callback=None, db=None):
+        """Store what is derived from the imported data, then bump the import generation
+
+        Readers only see the new generation once the integrity audit, the
+        analytics mirror and the sales cube are stored for it. A shadow
+        database has no mirror; the live one refreshes it after the swap.
+        """
+        db = db or self.db
+        generation = db.get_generation() + 1
+        self._audit_integrity(log_callback, db, generation)
+        if db is self.db:
+            analytics.refresh_mirror(db.db_path, log_callback, generation=generation)
+        self._build_cube(log_callback, db, generation)
+        db.bump_generation()
+
+    def _audit_integrity(self, log_callback=None, db=None, generation=None):
+        """Audit the database for orphaned orders and financial records into stats['orphans']"""
+        self.stats['orphans'] = IntegrityAudit(db or self.db).run(generation)
         if log_callback:
-            log_callback(f"Reading financials from: {file_path}")
+            orders, financials = self.stats['orphans']['orders'], self.stats['orphans']['financials']
+            if orders['rows'] or financials['rows']:
+                log_callback(f"🔗 Without a customer: {orders['rows']} order lines ({orders['customers']} codes), "
+                             f"{financials['rows']} financial records ({financials['customers']} codes)")
 
-        try:
-            df = pd.read_excel(file_path, sheet_name='Sheet1', engine='xlrd')
+    def _build_cube(self, log_callback=None, db=None, generation=None):
+        """Rebuild the stored sales cube, so reports never aggregate it on first display"""
+        cells = SalesCube(db or self.db).build(generation)
+        if log_callback:
+            log_callback(f"🧊 Sales cube rebuilt: {cells} cells")
 
-            if log_callback:
-                log_callback(f"Found {len(df)} rows in financials file")
+    def _finish_run(self, run_id, datasets, log_callback=None, db=None, full=False):
+        """Capture the changes the run made to the tables of `datasets` into stats['changes']
 
-            session = self.db.get_session()
-            imported_count = 0
+        Appends only compare the tables they wrote to; a full run rebuilt
+        every table and compares them all.
+        """
+        self.stats['run_id'] = run_id
+        scope = None if full else dict.fromkeys(datasets)
+        self.stats['changes'] = changelog.finish_run(db or self.db, run_id, full=full, scope=scope,
+                                                     failed=bool(self._failed_datasets),
+                                                     cancelled=self.stats['cancelled'])
+        if log_callback:
+            changes = self.stats['changes']
+            log_callback(f"🧾 Import run #{run_id}: {changes['inserted']} rows inserted, "
+                         f"{changes['updated']} updated, {changes['deleted']} deleted")
 
-            for index, row in df.iterrows():
-                try:
-                    financial = Financial(
-                        subscription_code=int(row.get('کد اشتراک ', 0)) if pd.notna(row.get('کد اشتراک ')) else None,
-                        amount=float(row.get('مبلغ ', 0)) if pd.notna(row.get('مبلغ ')) else 0.0,
-                        loan_code=str(row.get('کد وام ', '')).strip() if pd.notna(row.get('کد وام ')) else None,
-                        description=str(row.get('توضیحات ', '')).strip() if pd.notna(row.get('توضیحات ')) else None
-                    )
+    def import_batch(self, users=(), orders=(), financials=(), log_callback=None, replace=False, workers=None,
+                     progress_callback=None, cancel_token=None):
+        """Import many workbooks per dataset (file names or glob patterns) in one run
 
-                    if financial.subscription_code:
-                        session.add(financial)
-                        imported_count += 1
+        Files are parsed and converted in parallel worker processes (all
+        cores by default) and written through one pipeline in file order.
+        Order lines and financial records are deduplicated by natural key
+        (NATURAL_KEYS) across all files and the database. stats['files']
+        lists the counts of every file.
+        Progress is reported per file; a cancelled cancel_token stops the
+        run before its next batch and keeps the batches already written.
+        """
+        self.stats = _empty_stats()
+        self.stats['files'] = []
+        self._track(progress_callback, cancel_token)
+        self._failed_datasets = set()
+        self._validator = Validator(self.db, self.stats['validation'], self.severities)
 
-                except Exception as e:
-                    error_msg = f"Error importing financial at row {index + 2}: {str(e)}"
-                    self.stats['errors'].append(error_msg)
-                    if log_callback:
-                        log_callback(f"⚠️ {error_msg}")
+        plan = [
+            (dataset, path)
+            for dataset, patterns in (('users', users), ('orders', orders), ('financials', financials))
+            for path in _expand_paths(patterns)
+        ]
+        if not plan:
+            if log_callback:
+                log_callback("❌ No files matched")
+            return self.stats
 
-            session.commit()
-            session.close()
+        if replace:
+            self.db.recreate_database()
+        else:
+            self.db.create_tables()
 
-            self.stats['financials_imported'] = imported_count
+        def log(msg):
             if log_callback:
-                log_callback(f"✅ Successfully imported {imported_count} financial records")
+                log_callback(msg)
+
+        log(f"📦 Importing {len(plan)} files with {workers or os.cpu_count()} worker processes")
+        run_id = changelog.start_run(self.db, 'batch', [path for _, path in plan])
+
+        session = self.db.get_session()
+        seen_keys = {'orders': set(), 'financials': set()}   # natural keys stored or queued
+        looked_up = {'orders': set(), 'financials': set()}   # invoice ids / codes whose stored keys are in seen_keys
 
-            return imported_count
+        def items():
+            for (dataset, path), result in self._parse_parallel(plan, workers):
+                name = os.path.basename(path)
+                info = {'file': path, 'dataset': dataset, 'rows_read': 0, 'imported': 0,
+                        'duplicates': 0, 'rejected': 0, 'errors': 0}
+                self.stats['files'].append(info)
 
+                if isinstance(result, Exception):
+                    info['errors'] = 1
+                    self._failed_datasets.add(dataset)
+                    self.stats['errors'].append(f"Error reading {name}: {result}")
+                    log(f"❌ {name}: {result}")
+                    continue
+
+                frame, info['rows_read'], errors = result
+                info['errors'] = len(errors)
+                self.stats['errors'].extend(f"{name}: {error}" for error in errors)
+                log(f"📄 {name}: {info['rows_read']} {dataset} rows parsed")
+
+                self._progress.start(name, len(frame))
+                for start in range(0, len(frame), BATCH_SIZE):
+                    if self._cancelled():
+                        return
+                    batch = frame.iloc[start:start + BATCH_SIZE]
+                    checked = self._validate(dataset, batch)
+                    info['rejected'] += len(batch) - len(checked)
+
+                    if dataset in NATURAL_KEYS:
+                        is_new = self._new_rows(session, dataset, checked, seen_keys[dataset], looked_up[dataset])
+                        info['duplicates'] += int((~is_new).sum())
+                        checked = checked[is_new]
+
+                    rows = _records(checked)
+                    if rows:
+                        yield (dataset, path), WRITERS[dataset], rows
+                    self._progress.advance(len(batch))
+                self._progress.finish()
+
+        pipeline = ImportPipeline(self.db, cancel_token=cancel_token)
+        try:
+            pipeline.run(items())
+        except ImportCancelled:
+            self.stats['cancelled'] = True
+            log("⏹️ Import cancelled; batches written so far are kept")
         except Exception as e:
-            error_msg = f"Error reading financials file: {str(e)}"
+            error_msg = f"Error writing to database: {str(e)}"
+            self._failed_datasets.update(dataset for dataset, _ in plan)
             self.stats['errors'].append(error_msg)
-            if log_callback:
-                log_callback(f"❌ {error_msg}")
-            return 0
+            log(f"❌ {error_msg}")
+        finally:
+            session.close()
+
+        self._finish_run(run_id, {dataset for dataset, _ in plan}, log_callback, full=replace)
+        self._publish(log_callback)
+
+        for info in self.stats['files']:
+            info['imported'] = pipeline.rows_written.get((info['dataset'], info['file']), 0)
+            self.stats[f"{info['dataset']}_imported"] += info['imported']
+            if info['dataset'] in NATURAL_KEYS:
+                self.stats[f"{info['dataset']}_duplicates"] += info['duplicates']
+            log(f"{'⚠️' if info['errors'] else '✅'} {os.path.basename(info['file'])}: {info['imported']} imported, "
+                f"{info['duplicates']} duplicates, {info['rejected']} rejected, {info['errors']} errors")
+
+        return self.stats
+
+    def _parse_parallel(self, plan, workers=None):
+        """Yield ((dataset, path), (frame, rows, errors) or exception) in plan order
+
+        Files are parsed by a process pool; at most `workers` parsed files
+        wait for the writer, which bounds memory on large backfills.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_ignore_interrupt) as pool:
+            pending = deque()
+            try:
+                for job in plan:
+                    pending.append((job, pool.submit(_parse_file, *job)))
+                    while len(pending) > workers:
+                        yield self._parse_result(*pending.popleft())
+                while pending:
+                    yield self._parse_result(*pending.popleft())
+            finally:
+                # A cancelled run stops consuming: drop the files not yet started
+                for _, future in pending:
+                    future.cancel()
+
+    def _parse_result(self, job, future):
+        """Result of a parse job, or the exception it raised"""
+        try:
+            return job, future.result()
+        except Exception as e:
+            return job, e
+
+    @property
+    def failed_datasets(self):
+        """Datasets of the last import that could not be read or written"""
+        return set(getattr(self, '_failed_datasets', ()))
+
+    def _existing_keys(self, session, dataset, values):
+        """Return the natural keys (see NATURAL_KEYS) already stored for the given invoices or customers"""
+        model = MODELS[dataset]
+        columns, group = NATURAL_KEYS[dataset]
+        keys = set()
+        for start in range(0, len(values), KEY_LOOKUP_CHUNK):
+            chunk = values[start:start + KEY_LOOKUP_CHUNK]
+            keys.update(
+                session.query(*[getattr(model, column) for column in columns])
+                .filter(getattr(model, group).in_(chunk))
+                .all()
+            )
+        return keys
 
-    def import_all_data(self, excel1_path, excel2_path, excel3_path, log_callback=None):
-        """Import all data from three Excel files"""
+    def import_all_data(self, excel1_path, excel2_path, excel3_path, log_callback=None, replace=True,
+                        shadow=False, progress_callback=None, cancel_token=None):
+        """Import all data from three Excel files
+
+        With replace=False existing data is kept and only new rows are added.
+        With shadow=True the data is loaded into a new database file that
+        replaces the live one only after it validates, so readers never see
+        empty or half-loaded tables.
+
+        progress_callback receives progress.ProgressReporter events. When
+        cancel_token is cancelled the import stops before its next batch: a
+        shadow import is discarded and the live data left as it was; other
+        imports keep the batches written so far. stats['cancelled'] is set.
+        """
         if log_callback:
             log_callback("=" * 80)
             log_callback("Starting data import process...")
             log_callback("=" * 80)
 
-        # Recreate database
-        if log_callback:
-            log_callback("Creating database tables...")
-        self.db.recreate_database()
+        self.stats = _empty_stats()
+        self._track(progress_callback, cancel_token)
 
-        # Import users
-        self.import_users_from_excel(excel1_path, log_callback)
+        files = {
+            'users': excel1_path,
+            'orders': excel2_path,
+            'financials': excel3_path
+        }
 
-        # Import orders
-        self.import_orders_from_excel(excel2_path, log_callback)
+        kind = 'shadow' if shadow else ('full' if replace else 'append')
+        if shadow:
+            self.db.ensure_schema()
+            run_id = changelog.start_run(self.db, kind, files.values())
+            if self._import_shadow(files, log_callback, run_id):
+                analytics.refresh_mirror(self.db.db_path, log_callback)
+            else:
+                changelog.fail_run(self.db, run_id, 'cancelled' if self.stats['cancelled'] else 'failed')
+                self._audit_integrity(log_callback)
+        else:
+            if replace:
+                # Recreate database
+                if log_callback:
+                    log_callback("Creating database tables...")
+                self.db.recreate_database()
+            else:
+                self.db.create_tables()
+            run_id = changelog.start_run(self.db, kind, files.values())
 
-        # Import financials
-        self.import_financials_from_excel(excel3_path, log_callback)
+            # Parse all three files while the writer thread stores earlier batches
+            self._import(files, log_callback)
+            self._finish_run(run_id, files, log_callback, full=replace)
+            self._publish(log_callback)
 
         if log_callback:
             log_callback("=" * 80)
             log_callback("Import Summary:")
             log_callback(f"  Users imported: {self.stats['users_imported']}")
             log_callback(f"  Orders imported: {self.stats['orders_imported']}")
+            log_callback(f"  Duplicate orders skipped: {self.stats['orders_duplicates']}")
+            log_callback(f"  Rows rejected by validation: {self.stats['rows_rejected']}")
             log_callback(f"  Financials imported: {self.stats['financials_imported']}")
+            log_callback(f"  Duplicate financial records skipped: {self.stats['financials_duplicates']}")
+            log_callback(f"  Orders without a customer: {self.stats['orphans']['orders']['rows']}")
+            log_callback(f"  Financials without a customer: {self.stats['orphans']['financials']['rows']}")
             log_callback(f"  Errors: {len(self.stats['errors'])}")
+            if self.stats['cancelled']:
+                log_callback("  Cancelled before the end of the files")
             log_callback("=" * 80)
 
         return self.stats
 
-    def get_statistics(self):
-        """Get database statistics"""
-        from sqlalchemy import func
-        session = self.db.get_session()
+    def _import_shadow(self, files, log_callback=None, run_id=None):
+        """Import into a new database next to the live one, validate it and swap it in"""
+        live_path = os.path.abspath(self.db.db_path)
+        fd, shadow_path = tempfile.mkstemp(prefix=os.path.basename(live_path) + '.', suffix='.importing',
+                                           dir=os.path.dirname(live_path))
+        os.close(fd)
+
+        if log_callback:
+            log_callback(f"Building new database in: {shadow_path}")
 
         try:
-            users_count = session.query(User).count()
-            orders_count = session.query(Order).count()
-            financials_count = session.query(Financial).count()
+            shadow = Database(shadow_path, bulk_load=True)
+
+            # The online backup into a WAL database needs matching page sizes
+            with shadow.engine.connect() as conn:
+                conn.exec_driver_sql(f"PRAGMA page_size = {self.db.page_size()}")
+            shadow.create_tables()
 
-            # Total amounts
-            total_orders_value = session.query(func.sum(Order.total_value)).scalar() or 0
-            total_financial_amount = session.query(func.sum(Financial.amount)).scalar() or 0
+            self._import(files, log_callback, db=shadow)
 
+            if self.stats['cancelled']:
+                for dataset in files:
+                    self.stats[f'{dataset}_imported'] = 0
+                if log_callback:
+                    log_callback("⏹️ New database discarded, keeping current data")
+                return False
+
+            if log_callback:
+                log_callback("Validating new database...")
+            problem = None
+            if self._failed_datasets:
+                problem = f"import failed for: {', '.join(sorted(self._failed_datasets))}"
+            else:
+                check = shadow.integrity_check()
+                if check != 'ok':
+                    problem = f"integrity check failed: {check}"
+
+            if problem:
+                # Nothing reached the live database
+                for dataset in files:
+                    self.stats[f'{dataset}_imported'] = 0
+                error_msg = f"New database rejected, keeping current data ({problem})"
+                self.stats['errors'].append(error_msg)
+                if log_callback:
+                    log_callback(f"❌ {error_msg}")
+                return False
+
+            # Carry over bookkeeping and publish the data, with its change log, as a new generation
+            shadow.copy_bookkeeping_from(live_path)
+            if run_id is not None:
+                self._finish_run(run_id, files, log_callback, db=shadow, full=True)
+            self._publish(log_callback, db=shadow)
+
+            dispose_engine(shadow_path, bulk_load=True)
+            if log_callback:
+                log_callback("Swapping new database in...")
+            self.db.replace_with(shadow_path)
+            if log_callback:
+                log_callback("✅ New database is live")
+            return True
+
+        finally:
+            dispose_engine(shadow_path, bulk_load=True)
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                if os.path.exists(shadow_path + suffix):
+                    os.remove(shadow_path + suffix)
+
+    def _cached(self, key, compute):
+        """Return a cached result unless the import generation changed since it was computed"""
+        generation = self.db.get_generation()
+        cache_key = (os.path.abspath(self.db.db_path), key)
+        entry = _result_cache.get(cache_key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+
+        value = compute()
+        _result_cache[cache_key] = (generation, value)
+        return value
+
+    def get_statistics(self):
+        """Get database statistics (cached until the next import)"""
+        return self._cached('statistics', self._compute_statistics)
+
+    def _compute_statistics(self):
+        """Count and total every table in one statement"""
+        from sqlalchemy import select, func, true
+
+        users = select(func.count().label('count')).select_from(User).subquery()
+        orders = select(
+            func.count().label('count'),
+            func.coalesce(func.sum(Order.total_value), 0).label('total')
+        ).subquery()
+        financials = select(
+            func.count().label('count'),
+            func.coalesce(func.sum(Financial.amount), 0).label('total')
+        ).subquery()
+
+        stmt = select(
+            users.c.count, orders.c.count, orders.c.total, financials.c.count, financials.c.total
+        ).select_from(users.join(orders, true()).join(financials, true()))
+
+        session = self.db.get_session()
+        try:
+            row = session.execute(stmt).one()
             return {
-                'users_count': users_count,
-                'orders_count': orders_count,
-                'financials_count': financials_count,
-                'total_orders_value': total_orders_value,
-                'total_financial_amount': total_financial_amount
+                'users_count': row[0],
+                'orders_count': row[1],
+                'financials_count': row[3],
+                'total_orders_value': row[2],
+                'total_financial_amount': row[4]
             }
         finally:
             session.close()
+
+    def get_top_users(self, limit=10):
+        """Get (code, name, surname, total) of the top customers (cached until the next import)"""
+        def compute():
+            mirror = analytics.current_mirror(self.db.db_path)
+            if mirror is not None:
+                return [tuple(row) for row in mirror.top_users(limit)]
+            session = self.db.get_session()
+            try:
+                return [tuple(row) for row in queries.top_users(session, limit)]
+            finally:
+                session.close()
+
+        return self._cached(('top_users', limit), compute)
+
+    def get_integrity(self):
+        """Orphaned orders and financial records per table, see IntegrityAudit.summary (cached until the next import)"""
+        return self._cached('integrity', IntegrityAudit(self.db).summary)
+
+    def count_orders(self, **criteria):
+        """Number of order lines matching queries.order_filters criteria (cached until the next import)"""
+        def compute():
+            session = self.db.get_session()
+            try:
+                return queries.count_orders(session, queries.order_filters(**criteria))
+            finally:
+                session.close()
+
+        return self._cached(('orders_count', tuple(sorted(criteria.items()))), compute)
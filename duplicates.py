@@ -0,0 +1,185 @@
+"""
+Duplicate-customer detection
+
+Customers are grouped by blocking keys (normalized mobile, national ID and
+name + father's name) and only records sharing a block are compared, so the
+work grows with the block sizes instead of with every pair of customers.
+Names are compared by similarity, so misspellings still count towards a match.
+"""
+import csv
+from difflib import SequenceMatcher
+from sqlalchemy import select
+from models import User
+from normalize import normalize_phone, normalize_national_id, normalize_postal_code, normalize_name
+
+MAX_BLOCK_SIZE = 50   # larger blocks are shared placeholders (e.g. 0000000000), not people
+MIN_SCORE = 0.45      # pairs scoring below this are not reported; a national ID match alone reaches it
+NAME_SIMILARITY = 0.75  # names less similar than this (0..1) do not count towards the score
+
+# Field -> weight of an exact match between two normalized records; similar
+# names count with their similarity
+WEIGHTS = {
+    'national_id': 0.45,
+    'mobile': 0.25,
+    'name': 0.2,
+    'father_name': 0.05,
+    'postal_code': 0.05,
+}
+
+# Records are compared only when they agree on one of these keys
+BLOCKING_KEYS = (
+    ('mobile',),
+    ('national_id',),
+    ('name', 'father_name'),
+)
+
+
+class DuplicateFinder:
+    """Finds customers recorded under several subscription codes"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self):
+        """Return the normalized comparison fields of every customer, indexed by subscription code"""
+        import pandas as pd
+
+        stmt = select(
+            User.subscription_code, User.name, User.surname, User.father_name,
+            User.national_id, User.mobile, User.postal_code
+        )
+        with self.db.engine.connect() as conn:
+            users = pd.read_sql(stmt, conn)
+
+        full_name = users['name'].fillna('') + ' ' + users['surname'].fillna('')
+        return pd.DataFrame({
+            'mobile': normalize_phone(users['mobile']),
+            'national_id': normalize_national_id(users['national_id']),
+            'name': normalize_name(full_name),
+            'father_name': normalize_name(users['father_name']),
+            'postal_code': normalize_postal_code(users['postal_code']),
+        }).set_index(users['subscription_code'].rename('code'))
+
+    def candidate_pairs(self, records):
+        """Return (pairs, skipped_blocks): code pairs sharing a block, each pair once with code_a < code_b"""
+        import pandas as pd
+
+        pairs = []
+        skipped = 0
+        for key in BLOCKING_KEYS:
+            fields = list(key)
+            block = records[fields].dropna().reset_index()
+            sizes = block.groupby(fields)['code'].transform('size')
+            skipped += block.loc[sizes > MAX_BLOCK_SIZE, fields].drop_duplicates().shape[0]
+            block = block[(sizes > 1) & (sizes <= MAX_BLOCK_SIZE)]
+
+            merged = block.merge(block, on=fields, suffixes=('_a', '_b'))
+            pairs.append(merged.loc[merged['code_a'] < merged['code_b'], ['code_a', 'code_b']])
+
+        pairs = pd.concat(pairs, ignore_index=True).drop_duplicates(ignore_index=True)
+        return pairs, skipped
+
+    def score_pairs(self, records, pairs):
+        """Add a weighted match score and the matching fields to each candidate pair"""
+        import numpy as np
+
+        left = records.reindex(pairs['code_a']).reset_index(drop=True)
+        right = records.reindex(pairs['code_b']).reset_index(drop=True)
+
+        score = np.zeros(len(pairs))
+        matches = {}
+        for field, weight in WEIGHTS.items():
+            same = (left[field] == right[field]).fillna(False).to_numpy(dtype=bool)
+            matches[field] = same
+            score += weight * same
+
+        similarity = self.name_similarity(left['name'], right['name'])
+        similar = ~matches['name'] & (similarity >= NAME_SIMILARITY)
+        score += WEIGHTS['name'] * np.where(similar, similarity, 0.0)
+
+        pairs = pairs.reset_index(drop=True).assign(score=score.round(2))
+        pairs['matches'] = [
+            ', '.join([field for field in WEIGHTS if matches[field][i]] + (['similar name'] if similar[i] else []))
+            for i in range(len(pairs))
+        ]
+        return pairs
+
+    def name_similarity(self, left, right):
+        """Return the edit similarity (0..1) of each pair of normalized names; 0 when one is missing"""
+        import numpy as np
+
+        return np.array([
+            SequenceMatcher(None, a, b).ratio() if isinstance(a, str) and isinstance(b, str) else 0.0
+            for a, b in zip(left.astype(object).where(left.notna()), right.astype(object).where(right.notna()))
+        ])
+
+    def clusters(self, pairs):
+        """Merge scored pairs into clusters of codes that belong to the same customer"""
+        parent = {}
+
+        def find(code):
+            root = code
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while code != root:
+                parent[code], code = root, parent[code]
+            return root
+
+        for a, b in zip(pairs['code_a'], pairs['code_b']):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        groups = {}
+        for a, b, score, matches in zip(pairs['code_a'], pairs['code_b'], pairs['score'], pairs['matches']):
+            group = groups.setdefault(find(a), {'codes': set(), 'score': 0.0, 'matches': set()})
+            group['codes'].update((int(a), int(b)))
+            group['score'] = max(group['score'], float(score))
+            group['matches'].update(matches.split(', '))
+
+        result = [
+            {'codes': sorted(group['codes']), 'score': group['score'], 'matches': sorted(group['matches'])}
+            for group in groups.values()
+        ]
+        result.sort(key=lambda group: (-group['score'], -len(group['codes']), group['codes'][0]))
+        return result
+
+    def run(self, min_score=MIN_SCORE, log_callback=None):
+        """Find duplicate clusters and return a report dict
+
+        report['clusters'] is a list of {'codes', 'score', 'matches'} sorted by
+        score, where score is the best pair score inside the cluster.
+        """
+        def log(msg):
+            if log_callback:
+                log_callback(msg)
+
+        records = self.load()
+        log(f"👥 Normalized {len(records):,} customers")
+
+        pairs, skipped = self.candidate_pairs(records)
+        log(f"🔗 {len(pairs):,} candidate pairs from blocking"
+            + (f" ({skipped:,} oversized blocks skipped)" if skipped else ""))
+
+        scored = self.score_pairs(records, pairs)
+        scored = scored[scored['score'] >= min_score]
+        clusters = self.clusters(scored)
+        log(f"✅ {len(clusters):,} duplicate clusters found")
+
+        return {
+            'customers': len(records),
+            'candidate_pairs': len(pairs),
+            'skipped_blocks': skipped,
+            'matched_pairs': len(scored),
+            'clusters': clusters,
+        }
+
+    def export_csv(self, clusters, path):
+        """Write one row per customer code with its cluster number, score and matching fields"""
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['cluster', 'subscription_code', 'score', 'matches'])
+            for number, cluster in enumerate(clusters, 1):
+                for code in cluster['codes']:
+                    writer.writerow([number, code, cluster['score'], ', '.join(cluster['matches'])])
+        return len(clusters)
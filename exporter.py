@@ -0,0 +1,107 @@
+"""
+Streaming export of tables and query results to CSV and XLSX
+"""
+import csv
+import os
+from sqlalchemy import select, func
+from models import User, Order, Financial
+from queries import user_search_filter, top_users_statement
+
+YIELD_PER = 5000           # rows fetched from the cursor at a time
+XLSX_MAX_ROWS = 1048575    # data rows per worksheet (one row is the header)
+
+# Dataset name -> label shown in the GUI and CLI
+DATASETS = {
+    'users': 'Users',
+    'orders': 'Orders',
+    'financials': 'Financials',
+    'top_users': 'Top customers by order value',
+    'user_search': 'Users matching a search'
+}
+
+
+class Exporter:
+    """Streams query results to CSV or XLSX without loading them into memory"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def build_statement(self, dataset, limit=None, term=None):
+        """Return the SELECT statement behind a dataset"""
+        if dataset == 'users':
+            return select(User.__table__)
+        if dataset == 'orders':
+            return select(Order.__table__)
+        if dataset == 'financials':
+            return select(Financial.__table__)
+        if dataset == 'top_users':
+            return top_users_statement(limit or 10)
+        if dataset == 'user_search':
+            if not term:
+                raise ValueError("A search term is required for user_search")
+            return select(User.__table__).where(user_search_filter(term))
+        raise ValueError(f"Unknown dataset: {dataset}")
+
+    def export(self, dataset, path, fmt=None, progress_callback=None, limit=None, term=None):
+        """Write a dataset to `path` and return the number of rows written
+
+        The format is taken from the file extension unless `fmt` ('csv' or
+        'xlsx') is given. progress_callback(rows_written, total_rows) is
+        called after every fetched block of rows.
+        """
+        fmt = (fmt or os.path.splitext(path)[1].lstrip('.') or 'csv').lower()
+        if fmt not in ('csv', 'xlsx'):
+            raise ValueError(f"Unsupported export format: {fmt}")
+
+        stmt = self.build_statement(dataset, limit=limit, term=term)
+
+        with self.db.engine.connect() as conn:
+            total = conn.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+            result = conn.execution_options(yield_per=YIELD_PER).execute(stmt)
+            columns = list(result.keys())
+
+            if fmt == 'csv':
+                return self._write_csv(path, columns, result, total, progress_callback)
+            return self._write_xlsx(path, DATASETS[dataset], columns, result, total, progress_callback)
+
+    def _write_csv(self, path, columns, result, total, progress_callback=None):
+        """Stream rows into a CSV file (UTF-8 with BOM so Excel shows Persian text)"""
+        written = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in result.partitions():
+                writer.writerows(rows)
+                written += len(rows)
+                if progress_callback:
+                    progress_callback(written, total)
+        return written
+
+    def _write_xlsx(self, path, title, columns, result, total, progress_callback=None):
+        """Stream rows into a write-only workbook, starting a new sheet when one is full"""
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise ImportError("XLSX export needs openpyxl: pip install openpyxl")
+
+        workbook = Workbook(write_only=True)
+        sheet = None
+        sheet_rows = XLSX_MAX_ROWS
+        written = 0
+
+        for rows in result.partitions():
+            for row in rows:
+                if sheet_rows == XLSX_MAX_ROWS:
+                    sheet = workbook.create_sheet(f"{title[:25]} {len(workbook.worksheets) + 1}")
+                    sheet.append(columns)
+                    sheet_rows = 0
+                sheet.append(list(row))
+                sheet_rows += 1
+            written += len(rows)
+            if progress_callback:
+                progress_callback(written, total)
+
+        if sheet is None:
+            workbook.create_sheet(title[:31]).append(columns)
+        workbook.save(path)
+        return written
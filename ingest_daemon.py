@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Watch-folder ingestion daemon
+
+Polls a drop directory for workbooks, waits until each file has stopped
+changing, recognises its dataset from the headers and appends it to the
+database. Imported files are recorded by content hash so a file (or a copy
+of it) is never imported twice. Files whose headers match no dataset are
+recorded as failed; other failures (a locked database, a file still being
+copied) are retried with backoff and recorded after MAX_ATTEMPTS.
+
+Usage: python ingest_daemon.py DROP_DIR [--db data.db] [--workers 2] [--interval 2]
+"""
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from models import Database, ProcessedFile
+from data_processor import DataProcessor, detect_dataset
+from readers import sheet_headers
+
+POLL_INTERVAL = 2.0   # seconds between directory scans
+SETTLE_SECONDS = 2.0  # a file must be unchanged this long before it is read
+WORKERS = 2
+EXTENSIONS = ('.xls', '.xlsx', '.csv')
+HASH_BLOCK = 1024 * 1024
+RETRY_DELAY = 5.0     # seconds before the first retry of a failed file; doubled after each attempt
+MAX_RETRY_DELAY = 300.0
+MAX_ATTEMPTS = 5      # a file failing this often is recorded as failed and no longer retried
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestDaemon:
+    """Imports workbooks dropped into a directory
+
+    Files of different datasets are imported concurrently by a bounded
+    worker pool; files of the same dataset are imported one at a time so
+    order-line deduplication sees the lines of the previous file.
+    """
+
+    def __init__(self, drop_dir, db_path='data.db', workers=WORKERS, interval=POLL_INTERVAL,
+                 settle_seconds=SETTLE_SECONDS, retry_delay=RETRY_DELAY, log_callback=None):
+        self.drop_dir = drop_dir
+        self.db = Database(db_path)
+        self.db.ensure_schema()
+        self.interval = interval
+        self.settle_seconds = settle_seconds
+        self.retry_delay = retry_delay
+        self.log_callback = log_callback
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        self.stop_event = threading.Event()
+
+        self._observed = {}     # path -> (size, mtime) at the last scan
+        self._hashes = {}       # (path, size, mtime) -> content hash, for files in the drop directory
+        self._in_flight = set()  # content hashes queued or being imported
+        self._retries = {}      # content hash -> (failed attempts, time.monotonic() of the next one)
+        self._lock = threading.Lock()
+        self._dataset_locks = {}
+
+    def log(self, msg):
+        """Send a message to the log callback, if any"""
+        if self.log_callback:
+            self.log_callback(msg)
+
+    def settled_files(self):
+        """Return workbook paths whose size and mtime did not change since the previous scan"""
+        now = time.time()
+        current = {}
+        for entry in os.scandir(self.drop_dir):
+            if not entry.is_file() or entry.name.startswith(('.', '~$')):
+                continue
+            if not entry.name.lower().endswith(EXTENSIONS):
+                continue
+            stat = entry.stat()
+            current[entry.path] = (stat.st_size, stat.st_mtime)
+
+        settled = [
+            path for path, signature in current.items()
+            if self._observed.get(path) == signature and now - signature[1] >= self.settle_seconds
+        ]
+        self._observed = current
+        return settled
+
+    def is_processed(self, content_hash):
+        """True when a file with this content was already imported or permanently rejected"""
+        session = self.db.get_session()
+        try:
+            return session.get(ProcessedFile, content_hash) is not None
+        finally:
+            session.close()
+
+    def poll_once(self):
+        """Scan the drop directory once and queue new settled files; returns the futures queued"""
+        futures = []
+        settled = self.settled_files()
+        # Forget files that left the drop directory or changed since they were hashed
+        self._hashes = {key: value for key, value in self._hashes.items() if self._observed.get(key[0]) == key[1:]}
+        with self._lock:
+            present = set(self._hashes.values())
+            self._retries = {key: value for key, value in self._retries.items() if key in present}
+
+        for path in settled:
+            size, mtime = self._observed[path]
+            key = (path, size, mtime)
+            if key not in self._hashes:
+                self._hashes[key] = file_hash(path)
+            content_hash = self._hashes[key]
+
+            with self._lock:
+                if content_hash in self._in_flight:
+                    continue
+                retry = self._retries.get(content_hash)
+                if retry is not None and time.monotonic() < retry[1]:
+                    continue
+                if self.is_processed(content_hash):
+                    continue
+                self._in_flight.add(content_hash)
+            futures.append(self.executor.submit(self.ingest, path, content_hash))
+        return futures
+
+    def _dataset_lock(self, dataset):
+        """Lock serialising imports of one dataset"""
+        with self._lock:
+            return self._dataset_locks.setdefault(dataset, threading.Lock())
+
+    def ingest(self, path, content_hash):
+        """Import one file and record the outcome"""
+        name = os.path.basename(path)
+        processor = DataProcessor(db=self.db)
+        dataset, rows, error, permanent = None, 0, None, False
+
+        try:
+            dataset = detect_dataset(sheet_headers(path))
+            if dataset is None:
+                error, permanent = "headers match no known dataset", True
+            else:
+                with self._dataset_lock(dataset):
+                    self.log(f"📥 {name}: importing as {dataset}")
+                    _, rows = processor.import_file(path, dataset, log_callback=self.log_callback)
+                if dataset in processor.failed_datasets:
+                    error = processor.stats['errors'][-1] if processor.stats['errors'] else "import failed"
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            attempts = self._retries.pop(content_hash, (0, 0.0))[0] + 1
+            retry = bool(error) and not permanent and attempts < MAX_ATTEMPTS
+            if retry:
+                delay = min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+                self._retries[content_hash] = (attempts, time.monotonic() + delay)
+
+        if not retry:
+            self._record(content_hash, name, dataset, rows, error)
+        with self._lock:
+            self._in_flight.discard(content_hash)
+
+        if retry:
+            self.log(f"⚠️ {name}: {error}; retrying in {delay:g}s (attempt {attempts} of {MAX_ATTEMPTS})")
+        elif error:
+            self.log(f"❌ {name}: {error}")
+        else:
+            self.log(f"✅ {name}: {rows} {dataset} rows imported")
+        return dataset, rows, error
+
+    def _record(self, content_hash, name, dataset, rows, error):
+        """Store the final outcome of a file in processed_files"""
+        session = self.db.get_session()
+        try:
+            session.merge(ProcessedFile(
+                content_hash=content_hash,
+                file_name=name,
+                dataset=dataset,
+                rows_imported=rows,
+                status='failed' if error else 'imported',
+                error=error[:500] if error else None,
+                processed_at=datetime.now().isoformat(timespec='seconds')
+            ))
+            session.commit()
+        finally:
+            session.close()
+
+    def run(self):
+        """Poll until stop() is called or Ctrl+C is pressed"""
+        self.log(f"👀 Watching {os.path.abspath(self.drop_dir)} every {self.interval:g}s")
+        try:
+            while not self.stop_event.is_set():
+                self.poll_once()
+                self.stop_event.wait(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.log("⏳ Waiting for running imports to finish...")
+            self.executor.shutdown(wait=True)
+            self.log("👋 Ingestion stopped")
+
+    def stop(self):
+        """Ask run() to return after the current scan"""
+        self.stop_event.set()
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Import workbooks dropped into a directory")
+    parser.add_argument('drop_dir', help="directory to watch")
+    parser.add_argument('--db', default='data.db', help="database file (default: data.db)")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="files imported at once")
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between scans")
+    args = parser.parse_args()
+
+    os.makedirs(args.drop_dir, exist_ok=True)
+    IngestDaemon(args.drop_dir, args.db, workers=args.workers, interval=args.interval,
+                 log_callback=print).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Referential integrity audit: orders and financial records without a customer
+
+Imports do not enforce the users foreign keys, so order lines and loans
+of subscription codes missing from the users file are stored anyway and
+drop out of every join with users. The audit finds them with one
+anti-join per table (NOT EXISTS probing the users primary key), grouped
+by subscription code, and stores the result for the import generation it
+was computed from. Rejecting such rows before they are written is the
+'unknown_customer' validation rule set to 'error'.
+"""
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Meta
+
+# Child table -> column summed as the value of its orphaned rows
+ORPHAN_TABLES = {
+    'orders': 'total_value',
+    'financials': 'amount',
+}
+
+ORPHAN_SQL = """
+    SELECT '{table}' AS table_name, subscription_code,
+           COUNT(*) AS row_count, coalesce(SUM({value}), 0) AS total_value
+    FROM {table} AS child
+    WHERE subscription_code IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM users WHERE users.subscription_code = child.subscription_code)
+    GROUP BY subscription_code
+"""
+
+
+def _orphan_sql(table):
+    """Anti-join listing (table, code, rows, value) of one child table's orphaned codes"""
+    return ORPHAN_SQL.format(table=table, value=ORPHAN_TABLES[table])
+
+
+def _empty_summary():
+    """Orphan counts of a database without orphans"""
+    return {table: {'rows': 0, 'customers': 0, 'value': 0.0} for table in ORPHAN_TABLES}
+
+
+class IntegrityAudit:
+    """Finds, stores and reports orders and financial records whose customer does not exist"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def is_current(self):
+        """True when the stored audit was made for the current import generation"""
+        return self.db.get_meta('integrity_generation', None) == self.db.get_generation()
+
+    def run(self, generation=None):
+        """Audit every child table, store the orphaned codes and return summary()
+
+        The audit is stored for `generation`, the current import generation by default.
+        """
+        if generation is None:
+            generation = self.db.get_generation()
+        with self.db.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM integrity_orphans")
+            for table in ORPHAN_TABLES:
+                conn.exec_driver_sql(
+                    f"INSERT INTO integrity_orphans (table_name, subscription_code, row_count, total_value) "
+                    f"{_orphan_sql(table)}"
+                )
+            conn.execute(
+                sqlite_insert(Meta).values(key='integrity_generation', value=generation)
+                .on_conflict_do_update(index_elements=[Meta.key], set_={'value': generation})
+            )
+        return self._summarize("SELECT * FROM integrity_orphans")
+
+    def summary(self):
+        """Return {table: {'rows', 'customers', 'value'}} of orphaned rows
+
+        A stale audit is rerun; a read-only database, which cannot store
+        it, is audited on the fly.
+        """
+        if self.is_current():
+            return self._summarize("SELECT * FROM integrity_orphans")
+        if not self.db.read_only:
+            return self.run()
+        return self._summarize(" UNION ALL ".join(_orphan_sql(table) for table in ORPHAN_TABLES))
+
+    def _summarize(self, source):
+        """Total the integrity_orphans-shaped rows of a query per table"""
+        summary = _empty_summary()
+        with self.db.engine.connect() as conn:
+            for table, customers, rows, value in conn.exec_driver_sql(
+                    f"SELECT table_name, COUNT(*), SUM(row_count), SUM(total_value) FROM ({source}) "
+                    f"GROUP BY table_name"):
+                summary[table] = {'rows': rows, 'customers': customers, 'value': value}
+        return summary
+
+    def orphans(self, table, limit=20):
+        """Return [(subscription_code, rows, value)] of the orphaned codes with the most rows"""
+        if not self.is_current() and not self.db.read_only:
+            self.run()
+        source = "SELECT * FROM integrity_orphans" if self.is_current() else _orphan_sql(table)
+        with self.db.engine.connect() as conn:
+            return [tuple(row) for row in conn.exec_driver_sql(
+                f"SELECT subscription_code, row_count, total_value FROM ({source}) "
+                f"WHERE table_name = ? ORDER BY row_count DESC, subscription_code LIMIT ?", (table, limit)
+            )]
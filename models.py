@@ -1,12 +1,45 @@
 """
 Database models using SQLAlchemy ORM
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, BigInteger
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+from sqlalchemy import create_engine, event, inspect, select, update, bindparam, Column, Integer, String, Float, ForeignKey, BigInteger, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 Base = declarative_base()
 
+# Connection settings shared by every engine in the registry
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+BUSY_TIMEOUT = 30  # seconds a connection waits for a lock before failing
+
+# Bump whenever tables, columns or indexes change; stored in PRAGMA user_version
+SCHEMA_VERSION = 12
+
+# Settings for throwaway databases that are filled in one go and validated afterwards
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -200000",
+)
+
+# Settings for reporting connections that open the file read-only
+MMAP_SIZE = 256 * 1024 * 1024  # bytes of the file read through memory mapping
+READ_ONLY_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+)
+
+# One engine and scoped session factory per database file and open mode
+_engines = {}
+_engines_lock = threading.Lock()
+
 
 class User(Base):
     """User/Customer table"""
@@ -31,7 +64,16 @@ class User(Base):
     province = Column(String(100), comment='استان')
     city = Column(String(100), comment='شهرستان')
 
-    # Relationships
+    # Canonical ASCII-digit identifiers filled by the importer, for exact and prefix lookups
+    national_id_norm = Column(String(20), index=True)
+    mobile_norm = Column(String(20), index=True)
+    phone1_norm = Column(String(20), index=True)
+    phone2_norm = Column(String(20), index=True)
+    phone3_norm = Column(String(20), index=True)
+    postal_code_norm = Column(String(20), index=True)
+
+    # Relationships; deleting a user through a session deletes its children itself, since
+    # SQLite only enforces the ON DELETE CASCADE foreign keys on the purge connection
     orders = relationship('Order', back_populates='user', cascade='all, delete-orphan')
     financials = relationship('Financial', back_populates='user', cascade='all, delete-orphan')
 
@@ -42,11 +84,23 @@ class User(Base):
 class Order(Base):
     """Order/Invoice table"""
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Natural key of an invoice line; stops overlapping exports from duplicating rows
+        Index('ux_orders_natural_key', 'invoice_id', 'product_code', 'line_number', unique=True),
+        # Filters and sorts of the orders tab
+        Index('ix_orders_product_date', 'product_code', 'sending_date'),
+        Index('ix_orders_warehouse_date', 'warehouse_code', 'sending_date'),
+        Index('ix_orders_sending_date', 'sending_date'),
+        Index('ix_orders_total_value', 'total_value'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    invoice_id = Column(String(50), comment='شناسه فاکتور')
+    # Natural key columns are never NULL: SQLite's unique index would let any number of NULL keys through
+    invoice_id = Column(String(50), nullable=False, server_default='', comment='شناسه فاکتور')
+    line_number = Column(Integer, nullable=False, server_default='0', comment='ردیف در فاکتور')
     invoice_date = Column(String(20), comment='تاریخ فاکتور')
-    subscription_code = Column(BigInteger, ForeignKey('users.subscription_code'), comment='کد اشتراک')
+    subscription_code = Column(BigInteger, ForeignKey('users.subscription_code', ondelete='CASCADE'), index=True,
+                               comment='کد اشتراک')
     person_name = Column(String(200), nullable=True, comment='نام شخص')
     description = Column(String(500), nullable=True, comment='توضیحات')
     settlement_type = Column(String(50), nullable=True, comment='نوع تسویه')
@@ -61,7 +115,7 @@ class Order(Base):
     total_toll_percent = Column(Float, nullable=True, comment='درصد عوارض کل')
     warehouse_code = Column(String(50), comment='کد انبار')
     warehouse_name = Column(String(200), nullable=True, comment='نام انبار')
-    product_code = Column(String(50), comment='کد کالا')
+    product_code = Column(String(50), nullable=False, server_default='', comment='کد کالا')
     product_name = Column(String(300), nullable=True, comment='نام کالا')
     item_description = Column(String(500), nullable=True, comment='توضیحات کالا')
     special_coef1 = Column(Float, nullable=True, comment='ضریب ویژه 1')
@@ -88,12 +142,20 @@ class Order(Base):
 class Financial(Base):
     """Financial/Loan table"""
     __tablename__ = 'financials'
+    __table_args__ = (
+        # Natural key of a financial record; stops re-imported files from duplicating rows
+        Index('ux_financials_natural_key', 'subscription_code', 'loan_code', 'amount', 'description',
+              'entry_number', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    subscription_code = Column(BigInteger, ForeignKey('users.subscription_code'), comment='کد اشتراک')
-    amount = Column(Float, comment='مبلغ')
-    loan_code = Column(String(50), comment='کد وام')
-    description = Column(String(500), nullable=True, comment='توضیحات')
+    subscription_code = Column(BigInteger, ForeignKey('users.subscription_code', ondelete='CASCADE'), index=True,
+                               comment='کد اشتراک')
+    amount = Column(Float, nullable=False, server_default='0', comment='مبلغ')
+    loan_code = Column(String(50), nullable=False, server_default='', comment='کد وام')
+    description = Column(String(500), nullable=False, server_default='', comment='توضیحات')
+    # Copy number of identical records (same customer, loan, amount and description) within one file
+    entry_number = Column(Integer, nullable=False, server_default='0')
 
     # Relationships
     user = relationship('User', back_populates='financials')
@@ -102,27 +164,399 @@ class Financial(Base):
         return f"<Financial(id={self.id}, subscription={self.subscription_code}, amount={self.amount})>"
 
 
+class Meta(Base):
+    """Key/value bookkeeping that survives re-imports"""
+    __tablename__ = 'app_meta'
+
+    key = Column(String(50), primary_key=True)
+    value = Column(Integer, comment='مقدار')
+
+    def __repr__(self):
+        return f"<Meta(key={self.key}, value={self.value})>"
+
+
+class ProcessedFile(Base):
+    """Workbook picked up by the ingestion daemon, keyed by content so a copy is not imported twice"""
+    __tablename__ = 'processed_files'
+
+    content_hash = Column(String(64), primary_key=True, comment='SHA-256 of the file')
+    file_name = Column(String(500), comment='نام فایل')
+    dataset = Column(String(20), comment='users, orders or financials')
+    rows_imported = Column(Integer, comment='تعداد ردیف')
+    status = Column(String(20), comment='imported or failed')
+    error = Column(String(500), nullable=True, comment='خطا')
+    processed_at = Column(String(30), comment='ISO timestamp')
+
+    def __repr__(self):
+        return f"<ProcessedFile(name={self.file_name}, dataset={self.dataset}, status={self.status})>"
+
+
+class ImportRun(Base):
+    """One import into the database, numbered so consumers can ask for the changes since a run"""
+    __tablename__ = 'import_runs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), comment='full, append, shadow, batch or file')
+    source = Column(String(1000), comment='imported files')
+    status = Column(String(20), comment='running, completed, failed or cancelled')
+    started_at = Column(String(30), comment='ISO timestamp')
+    finished_at = Column(String(30), nullable=True, comment='ISO timestamp')
+    inserted = Column(Integer, default=0, comment='rows inserted')
+    updated = Column(Integer, default=0, comment='rows updated')
+    deleted = Column(Integer, default=0, comment='rows deleted')
+    # Highest ids before the run; rows above them are the ones an append added
+    orders_before = Column(Integer, nullable=True, comment='max orders.id before the run')
+    financials_before = Column(Integer, nullable=True, comment='max financials.id before the run')
+
+    def __repr__(self):
+        return f"<ImportRun(id={self.id}, kind={self.kind}, status={self.status})>"
+
+
+class ChangeLog(Base):
+    """Row inserted (I), updated (U) or deleted (D) by an import run"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        Index('ix_change_log_run', 'run_id', 'table_name'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer, comment='import_runs.id')
+    table_name = Column(String(20))
+    row_key = Column(String(300), comment='natural key of the row')
+    operation = Column(String(1), comment='I, U or D')
+
+    def __repr__(self):
+        return f"<ChangeLog(run={self.run_id}, {self.operation} {self.table_name} {self.row_key})>"
+
+
+class RowDigest(Base):
+    """Content hash of every data row as of the last import, compared by the next one"""
+    __tablename__ = 'row_digests'
+    __table_args__ = (
+        Index('ix_row_digests_group', 'table_name', 'group_key'),
+    )
+
+    table_name = Column(String(20), primary_key=True)
+    row_key = Column(String(300), primary_key=True)
+    group_key = Column(String(50), comment='invoice id of order lines, subscription code otherwise')
+    digest = Column(BigInteger)
+
+    def __repr__(self):
+        return f"<RowDigest({self.table_name} {self.row_key})>"
+
+
+class SalesCubeCell(Base):
+    """Pre-aggregated order value of one member of a sales dimension (province, city, ...)"""
+    __tablename__ = 'sales_cube'
+    __table_args__ = (
+        Index('ix_sales_cube_rank', 'dimension', 'total_value'),
+    )
+
+    dimension = Column(String(20), primary_key=True)
+    member = Column(String(200), primary_key=True)
+    order_lines = Column(Integer, comment='تعداد ردیف سفارش')
+    total_value = Column(Float, comment='ارزش کل')
+
+    def __repr__(self):
+        return f"<SalesCubeCell({self.dimension}={self.member}, total={self.total_value})>"
+
+
+class OrphanedCustomer(Base):
+    """Subscription code used by orders or financial records but missing from users, found by the integrity audit"""
+    __tablename__ = 'integrity_orphans'
+
+    table_name = Column(String(20), primary_key=True)
+    subscription_code = Column(BigInteger, primary_key=True)
+    row_count = Column(Integer, comment='تعداد ردیف')
+    total_value = Column(Float, comment='مبلغ کل')
+
+    def __repr__(self):
+        return f"<OrphanedCustomer({self.table_name}: {self.subscription_code}, rows={self.row_count})>"
+
+
+# Tables rebuilt by a full import; everything else is bookkeeping and is kept
+DATA_TABLES = [User.__table__, Order.__table__, Financial.__table__, SalesCubeCell.__table__,
+               OrphanedCustomer.__table__]
+BOOKKEEPING_TABLES = [Meta.__table__, ProcessedFile.__table__, ImportRun.__table__, ChangeLog.__table__,
+                      RowDigest.__table__]
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    """Apply locking pragmas to every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    # WAL lets readers keep working while an import commits
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+
+def _configure_bulk_load_connection(dbapi_connection, connection_record):
+    """Trade durability for speed on a database nobody else reads yet"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    for pragma in BULK_LOAD_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def connect_read_only(db_path, immutable=False):
+    """Open a read-only sqlite3 connection directly on the database file
+
+    Readers take no write locks and never create the file. immutable=True
+    is for archived snapshots that nothing writes any more: SQLite then
+    skips locking and change detection altogether.
+    """
+    uri = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    for pragma in READ_ONLY_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _open_mode(bulk_load=False, read_only=False, immutable=False):
+    """Registry name of a way of opening a database file"""
+    if immutable:
+        return 'immutable'
+    if read_only:
+        return 'read_only'
+    return 'bulk_load' if bulk_load else 'read_write'
+
+
+def get_engine(db_path='data.db', bulk_load=False, read_only=False, immutable=False):
+    """Return the shared (engine, scoped session factory) pair for a database file and open mode"""
+    mode = _open_mode(bulk_load, read_only, immutable)
+    key = (os.path.abspath(db_path), mode)
+    pool_args = {
+        'poolclass': QueuePool,
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+    }
+    with _engines_lock:
+        entry = _engines.get(key)
+        if entry is None:
+            if mode in ('read_only', 'immutable'):
+                engine = create_engine(
+                    'sqlite://',
+                    echo=False,
+                    creator=lambda: connect_read_only(key[0], immutable=(mode == 'immutable')),
+                    **pool_args
+                )
+            else:
+                engine = create_engine(
+                    f'sqlite:///{key[0]}',
+                    echo=False,
+                    connect_args={'timeout': BUSY_TIMEOUT, 'check_same_thread': False},
+                    **pool_args
+                )
+                event.listen(engine, 'connect',
+                             _configure_bulk_load_connection if bulk_load else _configure_connection)
+            entry = (engine, scoped_session(sessionmaker(bind=engine)))
+            _engines[key] = entry
+        return entry
+
+
+def dispose_engine(db_path, bulk_load=False, read_only=False, immutable=False):
+    """Close the pooled connections of a database file and forget its engine"""
+    key = (os.path.abspath(db_path), _open_mode(bulk_load, read_only, immutable))
+    with _engines_lock:
+        entry = _engines.pop(key, None)
+    if entry is not None:
+        engine, Session = entry
+        Session.remove()
+        engine.dispose()
+
+
 class Database:
     """Database manager class"""
 
-    def __init__(self, db_path='data.db'):
+    def __init__(self, db_path='data.db', bulk_load=False, read_only=False, immutable=False):
         self.db_path = db_path
-        self.engine = create_engine(f'sqlite:///{db_path}', echo=False)
-        self.Session = sessionmaker(bind=self.engine)
+        self.read_only = read_only or immutable
+        self.engine, self.Session = get_engine(db_path, bulk_load, read_only, immutable)
 
     def create_tables(self):
-        """Create all tables"""
-        Base.metadata.create_all(self.engine)
+        """Create missing tables, columns and indexes and record the schema version"""
+        with self.engine.begin() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            Base.metadata.create_all(conn)
+
+            # create_all skips tables that already exist, so bring older layouts up to date
+            inspector = inspect(conn)
+            added = set()
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_type = column.type.compile(dialect=conn.dialect)
+                        conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                        added.add(column)
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+            if added & set(User.__table__.columns):
+                self._backfill_user_identifiers(conn)
+
+            if RowDigest.__table__.c.group_key in added:
+                # Keys start with their group: 'code' for users, 'group|...' otherwise
+                conn.exec_driver_sql(
+                    "UPDATE row_digests SET group_key = CASE WHEN table_name = 'users' THEN row_key "
+                    "ELSE nullif(substr(row_key, 1, instr(row_key, '|') - 1), '') END"
+                )
+
+            if version < 5:
+                # Before version 5 numeric code cells were read as floats ('161262864.0');
+                # store the cell text so natural keys match rows imported since
+                for column in ('invoice_id', 'product_code'):
+                    conn.exec_driver_sql(
+                        f"UPDATE OR IGNORE orders SET {column} = substr({column}, 1, length({column}) - 2) "
+                        f"WHERE {column} GLOB '*[0-9].0'"
+                    )
+
+            if version < 11:
+                # Missing invoice ids and product codes are stored as '' since version 11, so the
+                # natural key matches them; leftover NULL keys are appended copies of those rows
+                for column in ('invoice_id', 'product_code'):
+                    conn.exec_driver_sql(f"UPDATE OR IGNORE orders SET {column} = '' WHERE {column} IS NULL")
+                conn.exec_driver_sql("DELETE FROM orders WHERE invoice_id IS NULL OR product_code IS NULL")
+                conn.exec_driver_sql(
+                    "UPDATE row_digests SET group_key = '' WHERE table_name = 'orders' AND group_key IS NULL"
+                )
+
+            if version < 12:
+                # Financial records got a natural key in version 12; its columns are never NULL
+                conn.exec_driver_sql("UPDATE financials SET amount = 0 WHERE amount IS NULL")
+                for column in ('loan_code', 'description'):
+                    conn.exec_driver_sql(f"UPDATE financials SET {column} = '' WHERE {column} IS NULL")
+
+            if Financial.__table__.c.entry_number in added:
+                # Number identical stored records in import order, as the importer numbers them within a file
+                conn.exec_driver_sql(
+                    "UPDATE financials SET entry_number = (SELECT rn FROM (SELECT id, ROW_NUMBER() OVER "
+                    "(PARTITION BY subscription_code, loan_code, amount, description ORDER BY id) rn "
+                    "FROM financials) t WHERE t.id = financials.id) WHERE entry_number IS NULL"
+                )
+
+            if Order.__table__.c.line_number in added:
+                # Number the stored lines of each invoice in import order, as the importer
+                # does, so their natural keys match when the same files are appended again
+                conn.exec_driver_sql(
+                    "UPDATE orders SET line_number = (SELECT rn FROM (SELECT id, ROW_NUMBER() OVER "
+                    "(PARTITION BY invoice_id ORDER BY id) rn FROM orders) t WHERE t.id = orders.id) "
+                    "WHERE line_number IS NULL"
+                )
+
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _backfill_user_identifiers(self, conn):
+        """Fill the normalized identifier columns of users imported before they existed"""
+        import pandas as pd
+        from normalize import USER_IDENTIFIERS, normalized_identifiers
+
+        stmt = select(User.subscription_code, *[User.__table__.c[name] for name in USER_IDENTIFIERS])
+        frame = pd.read_sql(stmt, conn)
+        values = pd.DataFrame(normalized_identifiers(frame))
+        values['code'] = frame['subscription_code']
+        rows = values.astype(object).where(values.notna(), None).to_dict('records')
+        if rows:
+            conn.execute(update(User).where(User.subscription_code == bindparam('code')), rows)
+
+    def ensure_schema(self):
+        """Create or upgrade the schema only when the stored version is not current"""
+        with self.engine.connect() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        if version != SCHEMA_VERSION:
+            if self.read_only:
+                raise RuntimeError(
+                    f"{self.db_path} has schema version {version}, expected {SCHEMA_VERSION}; "
+                    "open it read-write once to upgrade it"
+                )
+            self.create_tables()
 
     def drop_tables(self):
-        """Drop all tables"""
-        Base.metadata.drop_all(self.engine)
+        """Drop the data tables (bookkeeping tables are kept)"""
+        Base.metadata.drop_all(self.engine, tables=DATA_TABLES)
 
     def get_session(self):
-        """Get a new session"""
+        """Get the session bound to the current thread"""
         return self.Session()
 
     def recreate_database(self):
-        """Drop and recreate all tables"""
+        """Drop and recreate the data tables"""
         self.drop_tables()
         self.create_tables()
+
+    def get_meta(self, key, default=0):
+        """Read a bookkeeping value"""
+        session = self.get_session()
+        try:
+            meta = session.get(Meta, key)
+            return meta.value if meta else default
+        finally:
+            session.close()
+
+    def get_generation(self):
+        """Import generation: bumped whenever imported data changes"""
+        return self.get_meta('import_generation')
+
+    def bump_generation(self):
+        """Mark the data as changed and return the new generation"""
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO app_meta (key, value) VALUES ('import_generation', 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+            return conn.exec_driver_sql(
+                "SELECT value FROM app_meta WHERE key = 'import_generation'"
+            ).scalar()
+
+    def copy_bookkeeping_from(self, source_path):
+        """Copy the bookkeeping tables of another database file into this one"""
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql("ATTACH DATABASE ? AS source", (os.path.abspath(source_path),))
+            try:
+                for table in BOOKKEEPING_TABLES:
+                    exists = conn.exec_driver_sql(
+                        "SELECT 1 FROM source.sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+                    ).first()
+                    if exists:
+                        columns = ', '.join(column.name for column in table.columns)
+                        conn.exec_driver_sql(f"DELETE FROM main.{table.name}")
+                        conn.exec_driver_sql(
+                            f"INSERT INTO main.{table.name} ({columns}) SELECT {columns} FROM source.{table.name}"
+                        )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                # DETACH is not allowed inside an open transaction
+                conn.exec_driver_sql("DETACH DATABASE source")
+
+    def integrity_check(self):
+        """Run SQLite's integrity check and return its first message ('ok' when healthy)"""
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA integrity_check").scalar()
+
+    def page_size(self):
+        """Page size of the database file"""
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA page_size").scalar()
+
+    def replace_with(self, source_path):
+        """Atomically replace the contents of this database with another database file
+
+        Uses SQLite's online backup, which commits the copy as one transaction:
+        readers keep seeing the old data until it finishes and the new data
+        on their next transaction, without reopening the file.
+        """
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(os.path.abspath(self.db_path), timeout=BUSY_TIMEOUT)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,104 @@
+"""
+Vectorized normalization of names, phone numbers and identifiers
+
+Every function takes a pandas Series of raw spreadsheet values and returns a
+string Series with missing values as <NA>; the *_query helpers apply the same
+rules to a typed search term.
+"""
+import re
+
+# Persian and Arabic-Indic digits -> ASCII
+_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+# Arabic letter variants -> Persian, zero-width characters removed
+_LETTERS = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
+    'ؤ': 'و',
+    '\u200c': ' ', '\u200d': '', '\u200e': '', '\u200f': '',
+})
+
+# Country prefix of a phone number that has 10 digits after it
+_PHONE_PREFIX = r'^(?:00)?98(?=\d{10}$)'
+
+
+def digits_only(series):
+    """ASCII digits of each value, dropping a trailing '.0' and every non-digit"""
+    text = series.astype('string').str.strip().str.translate(_DIGITS)
+    text = text.str.replace(r'\.0+$', '', regex=True).str.replace(r'\D', '', regex=True)
+    return text.mask(text == '')
+
+
+def normalize_phone(series):
+    """Phone numbers without the +98/0098/0 prefix, e.g. 09121234567 -> 9121234567"""
+    text = digits_only(series)
+    text = text.str.replace(_PHONE_PREFIX, '', regex=True).str.lstrip('0')
+    return text.mask(text == '')
+
+
+def normalize_national_id(series):
+    """National IDs as 10 digits, restoring leading zeros lost to numeric cells
+
+    11-digit legal-entity IDs are kept as they are.
+    """
+    text = digits_only(series)
+    return text.where(text.str.len() > 10, text.str.zfill(10))
+
+
+def normalize_postal_code(series):
+    """Postal codes as plain ASCII digits"""
+    return digits_only(series)
+
+
+def normalize_name(series):
+    """Names in one spelling: Persian letters, no diacritics or spaces"""
+    text = series.astype('string').str.translate(_LETTERS)
+    text = text.str.replace(r'[\u064B-\u0652\u0670\u0640]', '', regex=True)  # harakat and tatweel
+    text = text.str.replace(r'\s+', '', regex=True)
+    return text.mask(text == '')
+
+
+# Identifier column -> normalizer; the canonical form is stored in <column>_norm
+USER_IDENTIFIERS = {
+    'national_id': normalize_national_id,
+    'mobile': normalize_phone,
+    'phone1': normalize_phone,
+    'phone2': normalize_phone,
+    'phone3': normalize_phone,
+    'postal_code': normalize_postal_code,
+}
+
+
+def normalized_identifiers(frame):
+    """Return {<column>_norm: Series} for the identifier columns of a users frame"""
+    return {f"{column}_norm": normalize(frame[column]) for column, normalize in USER_IDENTIFIERS.items()}
+
+
+def ascii_digits(text):
+    """Text with Persian and Arabic-Indic digits replaced by ASCII ones"""
+    return text.translate(_DIGITS)
+
+
+def digits_query(term):
+    """ASCII digits of a search term made of digits and separators, otherwise None"""
+    text = re.sub(r'[\s\-+().]', '', term.translate(_DIGITS))
+    return text if re.fullmatch(r'[0-9]+', text) else None
+
+
+def phone_query(digits):
+    """Apply the phone-number rules to the digits of a search term"""
+    return re.sub(_PHONE_PREFIX, '', digits).lstrip('0')
+
+
+def date_query(text):
+    """A typed date in the stored YYYY/MM/DD form, e.g. 1404/8/1 -> 1404/08/01"""
+    text = ascii_digits(text.strip())
+    parts = re.fullmatch(r'(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})', text)
+    return '/'.join(part.zfill(2) for part in parts.groups()) if parts else text
+
+
+def national_id_query(digits):
+    """Apply the national-ID rules to the digits of a search term (leading zeros restored)"""
+    return digits if len(digits) > 10 else digits.zfill(10)
@@ -0,0 +1,140 @@
+"""
+Import progress events and cooperative cancellation
+
+Importers report rows as they stream through; ProgressReporter turns the
+counts into at most a few events per second with throughput and an ETA.
+A CancelToken is checked between batches, so a cancelled import stops at
+a batch boundary with every committed batch intact.
+"""
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress events
+
+
+class ImportCancelled(Exception):
+    """Raised at a batch boundary when the import's CancelToken was cancelled"""
+
+
+class CancelToken:
+    """Cancellation flag shared between the importing thread and whoever may stop it"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Ask the import to stop at the next batch boundary"""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """True once cancel() was called"""
+        return self._event.is_set()
+
+
+class ProgressReporter:
+    """Turns row counts into throttled progress events
+
+    Events are dicts: stage (the dataset or file being read), rows, total
+    (None until the reader knows it), rate (rows per second), eta (seconds,
+    None without a total), elapsed and done. The first and last event of a
+    stage are always sent; the rest at most every `interval` seconds.
+    """
+
+    def __init__(self, callback=None, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.stage = None
+        self.rows = 0
+        self.total = None
+        self._started = self._last = 0.0
+
+    def start(self, stage, total=None):
+        """Begin counting the rows of a new stage"""
+        self.stage = stage
+        self.rows = 0
+        self.total = total
+        self._started = time.monotonic()
+        self._last = 0.0
+        self._emit()
+
+    def expect(self, total):
+        """Set the number of rows the stage will read, once the reader knows it"""
+        self.total = total
+
+    def advance(self, rows):
+        """Count rows done and send an event if the last one is old enough"""
+        self.rows += rows
+        if time.monotonic() - self._last >= self.interval:
+            self._emit()
+
+    def finish(self):
+        """Send the final event of the stage"""
+        self._emit(done=True)
+
+    def _emit(self, done=False):
+        """Send the current counts to the callback"""
+        now = time.monotonic()
+        self._last = now
+        if not self.callback:
+            return
+        elapsed = now - self._started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if done:
+            eta = 0.0
+        elif self.total is not None and rate > 0:
+            eta = max(0.0, (self.total - self.rows) / rate)
+        self.callback({
+            'stage': self.stage,
+            'rows': self.rows,
+            'total': self.total,
+            'rate': rate,
+            'eta': eta,
+            'elapsed': elapsed,
+            'done': done,
+        })
+
+
+def format_duration(seconds):
+    """Seconds as m:ss (or h:mm:ss)"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def format_progress(event):
+    """One-line description of a progress event"""
+    rows = f"{event['rows']:,}"
+    if event['total']:
+        rows += f" / {event['total']:,} rows ({min(100, 100 * event['rows'] // event['total'])}%)"
+    else:
+        rows += " rows"
+    text = f"{event['stage']}: {rows} · {event['rate']:,.0f} rows/s"
+    if event['done']:
+        return text + f" · done in {format_duration(event['elapsed'])}"
+    if event['eta'] is not None:
+        text += f" · ETA {format_duration(event['eta'])}"
+    return text
+
+
+@contextmanager
+def cancel_on_interrupt(token):
+    """Turn the first Ctrl+C into token.cancel(); a second one interrupts as usual"""
+    if threading.current_thread() is not threading.main_thread():
+        yield token
+        return
+
+    previous = signal.getsignal(signal.SIGINT)
+
+    def handler(signum, frame):
+        token.cancel()
+        signal.signal(signal.SIGINT, previous)
+
+    signal.signal(signal.SIGINT, handler)
+    try:
+        yield token
+    finally:
+        signal.signal(signal.SIGINT, previous)
@@ -0,0 +1,85 @@
+"""
+Set-based deletion of customers with their orders and financial records
+
+Rows are removed with DELETE ... WHERE subscription_code IN (...) in
+chunks (or one range condition), child tables first so every statement
+reports its own count. Nothing is loaded into Python.
+
+Only this connection runs with PRAGMA foreign_keys = ON; imports store
+rows of unknown customers (see integrity.py), so every other connection
+leaves the constraints off and the ON DELETE CASCADE foreign keys never
+fire there. A user deleted through the ORM takes its children with it
+through the relationship cascade, one loaded row at a time; use
+purge_customers for more than a handful.
+"""
+import changelog
+import analytics
+
+PURGE_CHUNK = 500  # subscription codes per DELETE ... IN (...)
+
+# Deleted in this order; users last so no child row is left pointing at a deleted customer
+PURGE_TABLES = ('orders', 'financials', 'users')
+
+
+def _conditions(codes=None, code_range=None):
+    """Yield (WHERE clause, params) pairs covering the customers to purge"""
+    if code_range is not None:
+        yield "subscription_code BETWEEN ? AND ?", tuple(code_range)
+    codes = sorted(set(int(code) for code in codes or ()))
+    for start in range(0, len(codes), PURGE_CHUNK):
+        chunk = codes[start:start + PURGE_CHUNK]
+        yield f"subscription_code IN ({', '.join('?' * len(chunk))})", tuple(chunk)
+
+
+def purge_customers(db, codes=None, code_range=None, log_callback=None):
+    """Delete customers with their orders and financial records and return the rows deleted per table
+
+    codes is an iterable of subscription codes and code_range an inclusive
+    (lo, hi) pair; a range also removes orders and financial records of
+    codes without a user row. Everything is deleted in one transaction,
+    recorded as a 'purge' import run and published as a new generation.
+    """
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    counts = dict.fromkeys(PURGE_TABLES, 0)
+    conditions = list(_conditions(codes, code_range))
+    if not conditions:
+        return counts
+
+    label = f"codes {code_range[0]}-{code_range[1]}" if code_range is not None else f"{len(set(codes))} codes"
+    run_id = changelog.start_run(db, 'purge', [label])
+    # Groups whose change-log digests the deletes touch (see changelog.TRACKED_TABLES)
+    scope = {'users': set(), 'orders': set(), 'financials': set()}
+
+    with db.engine.connect() as conn:
+        # Must be set outside a transaction; it only applies to this connection
+        conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+        try:
+            for where, params in conditions:
+                for table, group in (('orders', 'invoice_id'), ('financials', 'subscription_code'),
+                                     ('users', 'subscription_code')):
+                    scope[table].update(
+                        row[0] for row in conn.exec_driver_sql(f"SELECT DISTINCT {group} FROM {table} WHERE {where}",
+                                                               params)
+                    )
+                for table in PURGE_TABLES:
+                    counts[table] += conn.exec_driver_sql(f"DELETE FROM {table} WHERE {where}", params).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            changelog.fail_run(db, run_id)
+            raise
+        finally:
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.commit()
+
+    log(f"🗑️ Deleted {counts['users']:,} customers, {counts['orders']:,} order lines "
+        f"and {counts['financials']:,} financial records")
+
+    changelog.finish_run(db, run_id, scope=scope)
+    analytics.refresh_mirror(db.db_path, log_callback, generation=db.get_generation() + 1)
+    db.bump_generation()
+    counts['run_id'] = run_id
+    return counts
@@ -0,0 +1,190 @@
+"""
+Shared queries used by the GUI, the CLI and the exporter
+"""
+from sqlalchemy import select, func, or_, true
+from sqlalchemy.orm import selectinload
+from models import User, Order, Financial
+from normalize import date_query, digits_query, national_id_query, phone_query
+from reconciliation import TOLERANCE
+
+CUSTOMER_PAGE_SIZE = 100  # order lines per page of the customer view
+ORDER_PAGE_SIZE = 500     # order lines per page of the orders tab
+
+# Columns shown in order listings, by name; every one can be sorted on
+ORDER_LIST_COLUMNS = {
+    'id': Order.id,
+    'invoice_id': Order.invoice_id,
+    'subscription_code': Order.subscription_code,
+    'product_code': Order.product_code,
+    'quantity': Order.quantity,
+    'price': Order.price,
+    'total': Order.total_value,
+    'sending_date': Order.sending_date,
+}
+
+
+def _prefix_filter(column, prefix):
+    """Range condition matching values that start with `prefix`, answerable from an index"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (column >= prefix) & (column < upper)
+
+
+def user_search_filter(term):
+    """Filter matching users by name, surname, phone numbers, national ID or postal code
+
+    Numeric terms (Persian digits, spaces and dashes allowed) become prefix
+    lookups on the normalized identifier columns; other terms match names.
+    A national ID typed without its leading zeros is found too.
+    """
+    digits = digits_query(term)
+    if digits is None:
+        return (
+            (User.name.like(f"%{term}%")) |
+            (User.surname.like(f"%{term}%"))
+        )
+
+    conditions = [
+        _prefix_filter(User.national_id_norm, digits),
+        _prefix_filter(User.postal_code_norm, digits),
+    ]
+    national_id = national_id_query(digits)
+    if national_id != digits:
+        conditions.append(_prefix_filter(User.national_id_norm, national_id))
+    if len(digits) <= 18:  # fits a 64-bit subscription code
+        conditions.append(User.subscription_code == int(digits))
+    phone = phone_query(digits)
+    if phone:
+        conditions += [
+            _prefix_filter(column, phone)
+            for column in (User.mobile_norm, User.phone1_norm, User.phone2_norm, User.phone3_norm)
+        ]
+    return or_(*conditions)
+
+
+def search_users(session, term):
+    """Query users matching a search term"""
+    return session.query(User).filter(user_search_filter(term))
+
+
+def top_users_statement(limit=10):
+    """SELECT (code, name, surname, total) of the customers with the highest order value"""
+    return select(
+        User.subscription_code,
+        User.name,
+        User.surname,
+        func.sum(Order.total_value).label('total')
+    ).join(Order).group_by(
+        User.subscription_code
+    ).order_by(
+        func.sum(Order.total_value).desc()
+    ).limit(limit)
+
+
+def top_users(session, limit=10):
+    """Return (code, name, surname, total) rows of the top customers"""
+    return session.execute(top_users_statement(limit)).all()
+
+
+def customer_statement(code):
+    """SELECT a customer with its order and financial totals; financials are loaded in one IN query"""
+    orders = select(
+        func.count().label('lines'),
+        func.coalesce(func.sum(Order.total_value), 0).label('total')
+    ).where(Order.subscription_code == code).subquery()
+    financials = select(
+        func.count().label('rows'),
+        func.coalesce(func.sum(Financial.amount), 0).label('total')
+    ).where(Financial.subscription_code == code).subquery()
+
+    return select(
+        User, orders.c.lines, orders.c.total, financials.c.rows, financials.c.total
+    ).select_from(User).join(orders, true()).join(financials, true()).where(
+        User.subscription_code == code
+    ).options(selectinload(User.financials))
+
+
+def customer_detail(session, code):
+    """Return the customer view of one subscription code, or None when there is no such user
+
+    {'user', 'financials', 'order_lines', 'orders_total', 'financial_rows',
+    'financials_total', 'difference', 'matched', 'pages'}; order lines are
+    fetched a page at a time with customer_orders().
+    """
+    row = session.execute(customer_statement(code)).first()
+    if row is None:
+        return None
+
+    user, order_lines, orders_total, financial_rows, financials_total = row
+    difference = orders_total - financials_total
+    return {
+        'user': user,
+        'financials': user.financials,
+        'order_lines': order_lines,
+        'orders_total': orders_total,
+        'financial_rows': financial_rows,
+        'financials_total': financials_total,
+        'difference': difference,
+        'matched': abs(difference) < TOLERANCE,
+        'pages': max(1, -(-order_lines // CUSTOMER_PAGE_SIZE)),
+    }
+
+
+def customer_orders(session, code, page=0, page_size=CUSTOMER_PAGE_SIZE):
+    """One page of a customer's order lines in import order (read straight from the subscription_code index)"""
+    return (
+        session.query(Order)
+        .filter(Order.subscription_code == code)
+        .order_by(Order.id)
+        .offset(page * page_size)
+        .limit(page_size)
+        .all()
+    )
+
+
+def order_filters(product=None, warehouse=None, customer=None, min_total=None, max_total=None,
+                  date_from=None, date_to=None):
+    """Conditions selecting order lines; empty criteria are skipped
+
+    Numeric product and warehouse terms match codes (products by prefix),
+    other terms match names. Dates are compared in the stored YYYY/MM/DD
+    form; 1404/8/1 is read as 1404/08/01.
+    """
+    conditions = []
+    if product:
+        digits = digits_query(product)
+        conditions.append(_prefix_filter(Order.product_code, digits) if digits
+                          else Order.product_name.like(f"%{product}%"))
+    if warehouse:
+        digits = digits_query(warehouse)
+        conditions.append(Order.warehouse_code == digits if digits
+                          else Order.warehouse_name.like(f"%{warehouse}%"))
+    if customer is not None:
+        conditions.append(Order.subscription_code == customer)
+    if min_total is not None:
+        conditions.append(Order.total_value >= min_total)
+    if max_total is not None:
+        conditions.append(Order.total_value <= max_total)
+    if date_from:
+        conditions.append(Order.sending_date >= date_query(date_from))
+    if date_to:
+        conditions.append(Order.sending_date <= date_query(date_to))
+    return conditions
+
+
+def orders_page(session, conditions=(), sort='id', descending=False, page=0, page_size=ORDER_PAGE_SIZE):
+    """One page of order lines matching the conditions, as rows of ORDER_LIST_COLUMNS, sorted in SQL"""
+    column = ORDER_LIST_COLUMNS[sort]
+    direction = (lambda c: c.desc()) if descending else (lambda c: c.asc())
+    stmt = (
+        select(*ORDER_LIST_COLUMNS.values())
+        .where(*conditions)
+        .order_by(direction(column), direction(Order.id))
+        .offset(page * page_size)
+        .limit(page_size)
+    )
+    return session.execute(stmt).all()
+
+
+def count_orders(session, conditions=()):
+    """Number of order lines matching the conditions"""
+    return session.execute(select(func.count()).select_from(Order).where(*conditions)).scalar()
@@ -0,0 +1,206 @@
+"""
+Streaming readers for .xls, .xlsx and CSV exports
+
+The format is detected from the file's first bytes, not its extension.
+Every reader yields DataFrames of at most `chunk_size` rows with the
+sheet's headers (repeated headers renamed 'name.1', 'name.2' as pandas
+does), text columns as text and 'category' columns as categoricals, so
+the importer converts every format with the same code.
+"""
+
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'   # OLE2 compound document (BIFF .xls)
+XLSX_MAGIC = b'PK\x03\x04'        # zip container (.xlsx)
+CSV_ENCODING = 'utf-8-sig'
+CHUNK_SIZE = 5000
+
+# Column kinds read as cell text; numeric kinds are parsed by the importer
+TEXT_KINDS = ('str', 'category')
+
+
+def detect_format(file_path):
+    """Return 'xls', 'xlsx' or 'csv' from the first bytes of a file"""
+    with open(file_path, 'rb') as f:
+        head = f.read(4)
+    if head == XLS_MAGIC:
+        return 'xls'
+    if head == XLSX_MAGIC:
+        return 'xlsx'
+    return 'csv'
+
+
+def _mangle_headers(headers):
+    """Name blank headers 'Unnamed: i' and number repeats 'name.1', 'name.2' like pandas"""
+    seen = {}
+    result = []
+    for position, header in enumerate(headers):
+        name = f"Unnamed: {position}" if header is None or str(header).strip() == '' else str(header)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        result.append(name)
+    return result
+
+
+def _finish_chunk(df, columns):
+    """Apply the dtype plan to a raw chunk: text columns as text, repeated ones as categoricals"""
+    for _, header, kind in columns or ():
+        if kind == 'category' and header in df.columns:
+            df[header] = df[header].astype('category')
+    return df
+
+
+def _text_dtypes(columns):
+    """dtype argument reading the spec's text columns as str"""
+    return {header: str for _, header, kind in columns or () if kind in TEXT_KINDS}
+
+
+def _csv_dtypes(columns):
+    """dtype argument for the CSV parser: text columns as str, 'category' ones straight into categoricals"""
+    return {header: 'category' if kind == 'category' else str
+            for _, header, kind in columns or () if kind in TEXT_KINDS}
+
+
+def _wanted(columns):
+    """usecols callable keeping the spec's headers (every column when columns is None)"""
+    if columns is None:
+        return None
+    headers = {header for _, header, _ in columns}
+    return lambda header: header in headers
+
+
+def _cell_text(values):
+    """Cell values as text the way read_excel(dtype=str) renders them (12.0 -> '12')"""
+    def text(value):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    return values.map(text, na_action='ignore')
+
+
+def read_chunks(file_path, columns=None, chunk_size=CHUNK_SIZE, sheet_name=None, on_total=None):
+    """Yield the rows of a workbook or CSV file in DataFrames of up to chunk_size rows
+
+    columns is a (attribute, header, kind) spec limiting and typing the
+    columns read; sheet_name picks a sheet when it exists (first sheet otherwise).
+    on_total is called with the number of rows to expect as soon as the
+    reader knows it: after parsing a .xls, from the sheet dimensions of an
+    .xlsx (when recorded) and from a line count of a CSV.
+    """
+    fmt = detect_format(file_path)
+    if fmt == 'xls':
+        return _xls_chunks(file_path, columns, chunk_size, sheet_name, on_total)
+    if fmt == 'xlsx':
+        return _xlsx_chunks(file_path, columns, chunk_size, sheet_name, on_total)
+    return _csv_chunks(file_path, columns, chunk_size, on_total)
+
+
+def _xls_chunks(file_path, columns, chunk_size, sheet_name, on_total=None):
+    """Legacy .xls: xlrd loads only the sheet that is read (on_demand)"""
+    import pandas as pd
+    import xlrd
+
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        sheet = sheet_name if sheet_name in book.sheet_names() else 0
+        df = pd.read_excel(book, sheet_name=sheet, engine='xlrd',
+                           usecols=_wanted(columns), dtype=_text_dtypes(columns))
+    finally:
+        book.release_resources()
+    if on_total:
+        on_total(len(df))
+
+    # BIFF has no row streaming; the parsed sheet is typed once and handed out in slices
+    df = _finish_chunk(df, columns)
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size].copy()
+
+
+def _xlsx_chunks(file_path, columns, chunk_size, sheet_name, on_total=None):
+    """.xlsx: openpyxl read-only mode streams rows without building the whole sheet"""
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    book = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = book[sheet_name] if sheet_name in book.sheetnames else book.worksheets[0]
+        if on_total and sheet.max_row:
+            on_total(max(0, sheet.max_row - 1))  # from the stored dimensions; blank rows included
+        rows = sheet.iter_rows(values_only=True)
+        headers = _mangle_headers(next(rows, ()))
+        wanted = _wanted(columns)
+        keep = [position for position, header in enumerate(headers) if wanted is None or wanted(header)]
+        names = [headers[position] for position in keep]
+        text = _text_dtypes(columns)
+
+        start = 0
+        buffer = []
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                continue  # read_excel skips blank rows too
+            buffer.append([row[position] if position < len(row) else None for position in keep])
+            if len(buffer) == chunk_size:
+                yield _xlsx_frame(pd, buffer, names, text, start, columns)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _xlsx_frame(pd, buffer, names, text, start, columns)
+    finally:
+        book.close()
+
+
+def _xlsx_frame(pd, rows, names, text, start, columns):
+    """Build a chunk from buffered rows; numeric columns stay as cell values for the importer to parse"""
+    df = pd.DataFrame(rows, columns=names, index=range(start, start + len(rows)), dtype=object)
+    for header in names:
+        if header in text:
+            df[header] = _cell_text(df[header])
+    return _finish_chunk(df, columns)
+
+
+def _csv_chunks(file_path, columns, chunk_size, on_total=None):
+    """CSV: pandas' C parser in chunks"""
+    import pandas as pd
+
+    if on_total:
+        on_total(max(0, _count_lines(file_path) - 1))  # quoted line breaks make this an estimate
+
+    reader = pd.read_csv(file_path, encoding=CSV_ENCODING, usecols=_wanted(columns),
+                         dtype=_csv_dtypes(columns), chunksize=chunk_size)
+    with reader:
+        yield from reader
+
+
+def _count_lines(file_path):
+    """Number of lines in a text file, counted in binary blocks"""
+    lines = 0
+    last = b'\n'
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n')
+
+
+def sheet_headers(file_path):
+    """Headers of the first sheet (or of a CSV file) without reading its rows"""
+    fmt = detect_format(file_path)
+    if fmt == 'xls':
+        import xlrd
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            sheet = book.sheet_by_index(0)
+            return _mangle_headers(sheet.row_values(0) if sheet.nrows else [])
+        finally:
+            book.release_resources()
+    if fmt == 'xlsx':
+        from openpyxl import load_workbook
+        book = load_workbook(file_path, read_only=True)
+        try:
+            return _mangle_headers(next(book.worksheets[0].iter_rows(values_only=True), ()))
+        finally:
+            book.close()
+
+    import pandas as pd
+    return list(pd.read_csv(file_path, encoding=CSV_ENCODING, nrows=0).columns)
@@ -0,0 +1,168 @@
+"""
+Sharded reconciliation of customer orders against financial records
+"""
+import os
+from models import connect_read_only
+
+SHARDS_PER_WORKER = 4
+TOLERANCE = 0.5  # Rials; smaller differences count as a match
+
+SHARD_SQL = """
+    SELECT subscription_code,
+           SUM(order_total), SUM(order_lines),
+           SUM(financial_total), SUM(financial_rows)
+    FROM (
+        SELECT subscription_code, SUM(total_value) AS order_total, COUNT(*) AS order_lines,
+               0 AS financial_total, 0 AS financial_rows
+        FROM orders
+        WHERE subscription_code >= :lo{upper}
+        GROUP BY subscription_code
+        UNION ALL
+        SELECT subscription_code, 0, 0, SUM(amount), COUNT(*)
+        FROM financials
+        WHERE subscription_code >= :lo{upper}
+        GROUP BY subscription_code
+    )
+    GROUP BY subscription_code
+"""
+
+
+def _reconcile_shard(db_path, lo, hi, immutable=False):
+    """Aggregate orders and financials for codes in [lo, hi) - runs in a worker process"""
+    result = {
+        'customers': 0,
+        'matched': 0,
+        'orders_total': 0.0,
+        'financials_total': 0.0,
+        'order_lines': 0,
+        'financial_rows': 0,
+        'mismatches': []
+    }
+
+    # The last shard is open-ended
+    sql = SHARD_SQL.format(upper='' if hi is None else ' AND subscription_code < :hi')
+
+    conn = connect_read_only(db_path, immutable)
+    try:
+        for code, order_total, order_lines, financial_total, financial_rows in conn.execute(
+                sql, {'lo': lo, 'hi': hi}):
+            order_total = order_total or 0.0
+            financial_total = financial_total or 0.0
+
+            result['customers'] += 1
+            result['orders_total'] += order_total
+            result['financials_total'] += financial_total
+            result['order_lines'] += order_lines
+            result['financial_rows'] += financial_rows
+
+            difference = order_total - financial_total
+            if abs(difference) < TOLERANCE:
+                result['matched'] += 1
+            else:
+                result['mismatches'].append((code, order_total, financial_total, difference))
+    finally:
+        conn.close()
+
+    return result
+
+
+class ReconciliationRunner:
+    """Reconciles order totals against financial amounts per customer across worker processes"""
+
+    def __init__(self, db_path='data.db', workers=None, immutable=False):
+        self.db_path = db_path
+        self.immutable = immutable  # archived snapshot: read without locking
+        self.workers = max(1, workers or os.cpu_count() or 1)
+
+    def plan_shards(self, shard_count=None):
+        """Split the subscription codes into contiguous [lo, hi) ranges of similar size"""
+        shard_count = shard_count or self.workers * SHARDS_PER_WORKER
+
+        conn = connect_read_only(self.db_path, self.immutable)
+        try:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT subscription_code FROM orders "
+                "UNION SELECT subscription_code FROM financials) WHERE subscription_code IS NOT NULL"
+            ).fetchone()[0]
+            if total == 0:
+                return []
+
+            # Walk the ordered codes once and cut a boundary every `step` codes
+            step = max(1, -(-total // shard_count))
+            bounds = []
+            cursor = conn.execute(
+                "SELECT subscription_code FROM orders WHERE subscription_code IS NOT NULL "
+                "UNION SELECT subscription_code FROM financials WHERE subscription_code IS NOT NULL "
+                "ORDER BY 1"
+            )
+            for position, (code,) in enumerate(cursor):
+                if position % step == 0:
+                    bounds.append(code)
+        finally:
+            conn.close()
+
+        if not bounds:
+            return []
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def run(self, shard_count=None, log_callback=None):
+        """Reconcile all shards and merge them into one report
+
+        An up-to-date analytics mirror reconciles every customer in one
+        query instead; its report has 'engine': 'duckdb'.
+        """
+        import analytics
+
+        mirror = analytics.current_mirror(self.db_path, self.immutable)
+        if mirror is not None:
+            if log_callback:
+                log_callback("Reconciling in the analytics mirror (DuckDB)...")
+            return mirror.reconcile()
+
+        shards = self.plan_shards(shard_count)
+        if log_callback:
+            log_callback(f"Reconciling {len(shards)} shards with {self.workers} worker(s)...")
+
+        report = {
+            'engine': 'sqlite',
+            'shards': len(shards),
+            'workers': self.workers,
+            'customers': 0,
+            'matched': 0,
+            'orders_total': 0.0,
+            'financials_total': 0.0,
+            'order_lines': 0,
+            'financial_rows': 0,
+            'mismatches': []
+        }
+
+        if self.workers == 1:
+            results = (_reconcile_shard(self.db_path, lo, hi, self.immutable) for lo, hi in shards)
+            self._merge(report, results, log_callback)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = pool.map(
+                    _reconcile_shard,
+                    [self.db_path] * len(shards),
+                    [lo for lo, _ in shards],
+                    [hi for _, hi in shards],
+                    [self.immutable] * len(shards)
+                )
+                self._merge(report, results, log_callback)
+
+        report['mismatches'].sort(key=lambda item: abs(item[3]), reverse=True)
+        report['difference'] = report['orders_total'] - report['financials_total']
+        return report
+
+    def _merge(self, report, results, log_callback=None):
+        """Fold per-shard results into the report"""
+        for done, shard in enumerate(results, 1):
+            for key in ('customers', 'matched', 'orders_total', 'financials_total',
+                        'order_lines', 'financial_rows'):
+                report[key] += shard[key]
+            report['mismatches'].extend(shard['mismatches'])
+
+            if log_callback:
+                log_callback(f"  Shard {done}/{report['shards']} done")
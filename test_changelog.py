@@ -0,0 +1,150 @@
+"""
+Change capture of import runs
+"""
+import pytest
+from sqlalchemy import delete, insert, select, update
+import changelog
+import purge
+from models import Database, User, Order, Financial, ChangeLog, dispose_engine
+
+USERS = [
+    {'subscription_code': 1001, 'name': 'Ali', 'surname': 'Ahmadi'},
+    {'subscription_code': 1002, 'name': 'Sara', 'surname': 'Karimi'},
+]
+ORDERS = [
+    {'invoice_id': 'INV1', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1001, 'total_value': 10.0},
+    {'invoice_id': 'INV1', 'line_number': 2, 'product_code': 'P2', 'subscription_code': 1001, 'total_value': 20.0},
+    {'invoice_id': 'INV2', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1002, 'total_value': 30.0},
+]
+FINANCIALS = [
+    {'subscription_code': 1001, 'loan_code': 'L1', 'amount': 100.0},
+    {'subscription_code': 1002, 'loan_code': 'L1', 'amount': 200.0},
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'changes.db')
+    database = Database(path)
+    database.create_tables()
+    yield database
+    dispose_engine(path)
+
+
+def _load(db, orders=ORDERS):
+    """Store the sample rows as a full import would"""
+    with db.engine.begin() as conn:
+        for model in (Financial, Order, User):
+            conn.execute(delete(model))
+        conn.execute(insert(User), USERS)
+        conn.execute(insert(Order), orders)
+        conn.execute(insert(Financial), FINANCIALS)
+
+
+def _run(db, kind, write, **finish):
+    """Record a run around write(conn) and return (run id, totals)"""
+    run_id = changelog.start_run(db, kind, [])
+    with db.engine.begin() as conn:
+        write(conn)
+    return run_id, changelog.finish_run(db, run_id, **finish)
+
+
+def _logged(db, run_id):
+    """Return the (table, row key, operation) rows a run logged"""
+    with db.engine.connect() as conn:
+        return sorted(tuple(row) for row in conn.execute(
+            select(ChangeLog.table_name, ChangeLog.row_key, ChangeLog.operation).where(ChangeLog.run_id == run_id)
+        ))
+
+
+def test_full_reimport_logs_only_the_changed_row(db):
+    _load(db)
+    changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+
+    changed = [dict(row) for row in ORDERS]
+    changed[1]['total_value'] = 25.0
+    run_id = changelog.start_run(db, 'full', [])
+    _load(db, changed)  # renumbers the ids, as recreating the tables does
+    totals = changelog.finish_run(db, run_id, full=True)
+
+    assert totals == {'inserted': 0, 'updated': 1, 'deleted': 0}
+    assert _logged(db, run_id) == [('orders', 'INV1|P2|2', 'U')]
+
+
+def test_append_logs_only_inserts(db):
+    _load(db)
+    changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+
+    def write(conn):
+        conn.execute(insert(Order), [{'invoice_id': 'INV3', 'line_number': 1, 'product_code': 'P1',
+                                      'subscription_code': 1002}])
+        # Same natural key as a stored loan: numbered within its customer
+        conn.execute(insert(Financial), [{'subscription_code': 1001, 'loan_code': 'L1', 'amount': 50.0}])
+
+    run_id, totals = _run(db, 'append', write)
+
+    assert totals == {'inserted': 2, 'updated': 0, 'deleted': 0}
+    assert _logged(db, run_id) == [('financials', '1001|L1#1', 'I'), ('orders', 'INV3|P1|1', 'I')]
+
+
+def test_append_after_edits_outside_the_importer_compares_the_whole_table(db):
+    _load(db)
+    changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+
+    def write(conn):
+        # A line deleted by hand: the digests no longer match the old rows
+        conn.execute(delete(Order).where(Order.invoice_id == 'INV1', Order.line_number == 1))
+        conn.execute(insert(Order), [{'invoice_id': 'INV3', 'line_number': 1, 'product_code': 'P1'}])
+
+    run_id, totals = _run(db, 'append', write)
+
+    assert totals == {'inserted': 1, 'updated': 0, 'deleted': 1}
+    assert _logged(db, run_id) == [('orders', 'INV1|P1|1', 'D'), ('orders', 'INV3|P1|1', 'I')]
+
+
+def test_append_compares_only_the_tables_it_wrote(db):
+    _load(db)
+    changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+    # Edited outside the importer; an orders-only run does not look at users
+    with db.engine.begin() as conn:
+        conn.execute(update(User).where(User.subscription_code == 1002).values(name='Zahra'))
+
+    row = {'invoice_id': 'INV3', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1002}
+    run_id, totals = _run(db, 'file', lambda conn: conn.execute(insert(Order), [row]), scope={'orders': None})
+
+    assert totals == {'inserted': 1, 'updated': 0, 'deleted': 0}
+    assert _logged(db, run_id) == [('orders', 'INV3|P1|1', 'I')]
+
+
+def test_purge_logs_deletes_of_the_purged_groups_only(db):
+    _load(db)
+    changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+    # An edit outside the purged groups is not picked up by the purge run
+    with db.engine.begin() as conn:
+        conn.execute(update(Financial).where(Financial.subscription_code == 1002).values(amount=250.0))
+
+    counts = purge.purge_customers(db, codes=[1001])
+
+    assert _logged(db, counts['run_id']) == [
+        ('financials', '1001|L1', 'D'),
+        ('orders', 'INV1|P1|1', 'D'),
+        ('orders', 'INV1|P2|2', 'D'),
+        ('users', '1001', 'D'),
+    ]
+
+
+def test_changes_since_drops_rows_inserted_then_deleted(db):
+    _load(db)
+    first = changelog.finish_run(db, changelog.start_run(db, 'full', []), full=True)
+    assert first['inserted'] == len(USERS) + len(ORDERS) + len(FINANCIALS)
+    since = changelog.last_run_id(db)
+
+    row = {'invoice_id': 'INV3', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1002}
+    _run(db, 'append', lambda conn: conn.execute(insert(Order), [row]))
+    _run(db, 'full', lambda conn: conn.execute(delete(Order).where(Order.invoice_id == 'INV3')), full=True)
+
+    changes = changelog.changes_since(db, since)
+    assert changes['orders'] == {'inserted': [], 'updated': [], 'deleted': []}
+    assert changelog.changes_since(db, since - 1)['orders']['inserted'] == [
+        'INV1|P1|1', 'INV1|P2|2', 'INV2|P1|1'
+    ]
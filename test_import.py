@@ -55,10 +55,14 @@ try:
     print("\nThe application is ready to use.")
     print("Run the GUI with: python app.py")
 
-    # Clean up test database
+    # Clean up test database (closing its connections first, then the WAL files)
     import os
+    db.Session.remove()
+    db.engine.dispose()
     if os.path.exists('test.db'):
-        os.remove('test.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists('test.db' + suffix):
+                os.remove('test.db' + suffix)
         print("\n(Test database cleaned up)")
 
 except ImportError as e:
@@ -0,0 +1,92 @@
+"""
+Validation rules and how their severities route failing rows
+"""
+import pandas as pd
+import pytest
+from sqlalchemy import insert
+from models import Database, User, dispose_engine
+from normalize import normalized_identifiers
+from validation import Validator, national_id_checksum_invalid
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'validation.db')
+    database = Database(path)
+    database.create_tables()
+    with database.engine.begin() as conn:
+        conn.execute(insert(User), [{'subscription_code': 1001, 'name': 'Ali'}])
+    yield database
+    dispose_engine(path)
+
+
+def _users(national_ids):
+    frame = pd.DataFrame({
+        'subscription_code': range(2001, 2001 + len(national_ids)),
+        'national_id': national_ids,
+        'mobile': '09121234567',
+        'phone1': None, 'phone2': None, 'phone3': None,
+        'postal_code': '1234567890',
+    })
+    return frame.assign(**normalized_identifiers(frame))
+
+
+def test_national_id_checksum():
+    ids = pd.Series(['0499370899', '4608968882', '1234567890', '4608968883', '1111111111',
+                     '10101010101', '123', None], dtype='string')
+
+    assert national_id_checksum_invalid(ids).tolist() == [
+        False, False, True, True, True,
+        False,  # 11-digit legal-entity IDs have no checksum here
+        False,  # wrong length: the format rule's concern
+        False,
+    ]
+
+
+def test_national_id_that_lost_its_leading_zero_is_valid():
+    # Numeric cells drop the leading zeros of 0499370899 and 0084575948
+    frame = _users([499370899, 84575948.0, '۰۴۹۹۳۷۰۸۹۹'])
+
+    assert frame['national_id_norm'].tolist() == ['0499370899', '0084575948', '0499370899']
+    assert not national_id_checksum_invalid(frame['national_id_norm']).any()
+
+
+def test_warning_rows_are_counted_and_kept(db):
+    validator = Validator(db)
+    frame = _users(['0499370899', '1234567890', '10101010101', '123456789012'])
+
+    checked = validator.apply('users', frame)
+
+    assert len(checked) == len(frame)
+    assert validator.counts == {'users.national_id_checksum': 1, 'users.national_id_format': 1}
+
+
+def test_error_rows_are_counted_and_dropped(db):
+    validator = Validator(db)
+    orders = pd.DataFrame({
+        'subscription_code': [1001, 1001, 1001, 9999],
+        'quantity': [1, -2, 3, 1],
+        'price': [10.0, 10.0, -1.0, 10.0],
+    })
+
+    checked = validator.apply('orders', orders)
+
+    # The unknown customer is a warning by default: counted, kept
+    assert checked['quantity'].tolist() == [1, 1]
+    assert validator.counts == {
+        'orders.negative_quantity': 1, 'orders.negative_price': 1, 'orders.unknown_customer': 1
+    }
+
+
+def test_severity_override_turns_a_warning_into_an_error(db):
+    validator = Validator(db, severities={'unknown_customer': 'error'})
+    financials = pd.DataFrame({'subscription_code': [1001, 9999], 'amount': [5.0, -5.0]})
+
+    checked = validator.apply('financials', financials)
+
+    assert checked['subscription_code'].tolist() == [1001]
+    assert validator.counts == {'financials.negative_amount': 1, 'financials.unknown_customer': 1}
+    assert [row[:3] for row in validator.summary()] == [
+        ('financials', 'negative_amount', 'warning'),
+        ('financials', 'unknown_customer', 'error'),
+    ]
@@ -0,0 +1,48 @@
+"""
+Duplicate-customer scoring
+"""
+import os
+import tempfile
+from sqlalchemy import insert
+from duplicates import DuplicateFinder
+from models import Database, User, dispose_engine
+
+
+def _find(users):
+    """Store the users in a new database and return the duplicate report"""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        db = Database(path)
+        try:
+            db.create_tables()
+            with db.engine.begin() as conn:
+                conn.execute(insert(User), users)
+            return DuplicateFinder(db).run()
+        finally:
+            dispose_engine(path)
+
+
+def test_misspelled_name_with_the_same_national_id_is_reported():
+    report = _find([
+        {'subscription_code': 1, 'name': 'Ali', 'surname': 'Ahmadi', 'national_id': '0072545402',
+         'mobile': '09121111111'},
+        {'subscription_code': 2, 'name': 'Aly', 'surname': 'Ahmady', 'national_id': '0072545402',
+         'mobile': '09352222222'},
+    ])
+
+    cluster, = report['clusters']
+    assert cluster['codes'] == [1, 2]
+    assert cluster['matches'] == ['national_id', 'similar name']
+    assert cluster['score'] > 0.6
+
+
+def test_shared_mobile_with_a_different_name_is_not_reported():
+    report = _find([
+        {'subscription_code': 1, 'name': 'Ali', 'surname': 'Ahmadi', 'national_id': '0072545402',
+         'mobile': '09121111111'},
+        {'subscription_code': 2, 'name': 'Sara', 'surname': 'Karimi', 'national_id': '0012345678',
+         'mobile': '09121111111'},
+    ])
+
+    assert report['candidate_pairs'] == 1
+    assert report['clusters'] == []
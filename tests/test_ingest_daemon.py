@@ -0,0 +1,79 @@
+"""
+The ingestion daemon: what it records, retries and forgets
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+from data_processor import DataProcessor
+from ingest_daemon import IngestDaemon
+from models import dispose_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _poll(daemon):
+    """Scan once and wait for the imports it queued"""
+    return [future.result() for future in daemon.poll_once()]
+
+
+def _processed(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT file_name, status FROM processed_files ORDER BY file_name").fetchall()
+    finally:
+        conn.close()
+
+
+def test_failed_import_is_retried_after_the_backoff_and_then_recorded():
+    with tempfile.TemporaryDirectory() as folder:
+        drop = os.path.join(folder, 'incoming')
+        os.mkdir(drop)
+        path = os.path.join(folder, 'data.db')
+        daemon = IngestDaemon(drop, path, settle_seconds=0, retry_delay=60)
+        shutil.copy(os.path.join(ROOT, 'excel1.xls'), drop)
+        try:
+            assert _poll(daemon) == []  # first sighting: not settled yet
+
+            with mock.patch.object(DataProcessor, 'import_file', side_effect=RuntimeError("database is locked")):
+                (dataset, rows, error), = _poll(daemon)
+            assert (dataset, rows, error) == ('users', 0, "database is locked")
+            assert _processed(path) == []
+
+            # Not retried before the delay is up
+            assert _poll(daemon) == []
+
+            daemon._retries = {key: (attempts, 0.0) for key, (attempts, _) in daemon._retries.items()}
+            (dataset, rows, error), = _poll(daemon)
+            assert dataset == 'users' and rows > 0 and error is None
+            assert _processed(path) == [('excel1.xls', 'imported')]
+            assert daemon._retries == {}
+            assert _poll(daemon) == []
+        finally:
+            daemon.executor.shutdown(wait=True)
+            dispose_engine(path)
+
+
+def test_unknown_headers_are_recorded_at_once_and_removed_files_forgotten():
+    with tempfile.TemporaryDirectory() as folder:
+        drop = os.path.join(folder, 'incoming')
+        os.mkdir(drop)
+        path = os.path.join(folder, 'data.db')
+        daemon = IngestDaemon(drop, path, settle_seconds=0, retry_delay=0)
+        with open(os.path.join(drop, 'notes.csv'), 'w', encoding='utf-8') as f:
+            f.write("colour,size\nred,1\n")
+        try:
+            _poll(daemon)
+            (dataset, rows, error), = _poll(daemon)
+            assert (dataset, error) == (None, "headers match no known dataset")
+            assert _processed(path) == [('notes.csv', 'failed')]
+            assert daemon._retries == {}
+            assert _poll(daemon) == []
+
+            os.remove(os.path.join(drop, 'notes.csv'))
+            _poll(daemon)
+            assert daemon._hashes == {}
+        finally:
+            daemon.executor.shutdown(wait=True)
+            dispose_engine(path)
@@ -0,0 +1,109 @@
+"""
+The producer/consumer import pipeline: write errors and cancellation
+"""
+import os
+import sqlite3
+import tempfile
+from sqlalchemy import insert
+from data_processor import DataProcessor, ImportPipeline
+from models import Database, User, dispose_engine
+from progress import CancelToken, ImportCancelled
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = tuple(os.path.join(ROOT, name) for name in ('excel1.xls', 'excel2.xls', 'excel3 .xls'))
+
+
+def _write_users(session, rows):
+    session.execute(insert(User), rows)
+
+
+def _fail(session, rows):
+    raise RuntimeError("disk full")
+
+
+def _batches(count, produced, write_batch=_write_users, failing=None):
+    """Yield `count` batches of one user each, recording how many were produced"""
+    for number in range(count):
+        produced.append(number)
+        yield 'users', (write_batch if number != failing else _fail), [{'subscription_code': number + 1}]
+
+
+def _users(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_writer_error_is_raised_and_stops_the_producer():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        db = Database(path)
+        db.create_tables()
+        produced = []
+        pipeline = ImportPipeline(db, queue_size=1)
+        try:
+            pipeline.run(_batches(1000, produced, failing=2))
+            raise AssertionError("the write error was swallowed")
+        except RuntimeError as e:
+            assert str(e) == "disk full"
+        finally:
+            dispose_engine(path)
+
+        # Batches before the failing one are committed; the producer stopped soon after it
+        assert pipeline.rows_written == {'users': 2}
+        assert _users(path) == 2
+        assert len(produced) < 10
+
+
+def test_cancel_stops_before_the_next_batch_and_keeps_committed_ones():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        db = Database(path)
+        db.create_tables()
+        token = CancelToken()
+
+        def write_then_cancel(session, rows):
+            _write_users(session, rows)
+            token.cancel()
+
+        produced = []
+        pipeline = ImportPipeline(db, queue_size=1, cancel_token=token)
+        try:
+            pipeline.run(_batches(1000, produced, write_then_cancel))
+            raise AssertionError("the cancel was ignored")
+        except ImportCancelled:
+            pass
+        finally:
+            dispose_engine(path)
+
+        assert 1 <= pipeline.rows_written['users'] < 10
+        assert _users(path) == pipeline.rows_written['users']
+        assert len(produced) < 10
+
+
+def test_cancelled_append_keeps_its_batches_and_is_logged_as_cancelled():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        token = CancelToken()
+
+        def cancel_after_users(event):
+            if event['stage'] == 'users' and event['done']:
+                token.cancel()
+
+        try:
+            stats = DataProcessor(path).import_all_data(*SAMPLE_FILES, replace=False,
+                                                        progress_callback=cancel_after_users, cancel_token=token)
+            assert stats['cancelled']
+            assert stats['orders_imported'] == stats['financials_imported'] == 0
+
+            conn = sqlite3.connect(path)
+            status, = conn.execute("SELECT status FROM import_runs ORDER BY id DESC LIMIT 1").fetchone()
+            orders, = conn.execute("SELECT COUNT(*) FROM orders").fetchone()
+            conn.close()
+            assert status == 'cancelled'
+            assert orders == 0
+            assert _users(path) == stats['users_imported']
+        finally:
+            dispose_engine(path)
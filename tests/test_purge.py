@@ -0,0 +1,61 @@
+"""
+Deleting customers with their order lines and financial records
+"""
+import os
+import sqlite3
+import tempfile
+from sqlalchemy import insert
+import purge
+from models import Database, User, Order, Financial, dispose_engine
+
+
+def _database(folder):
+    """A new database with two customers, their orders and financials, and one orphan order line"""
+    db = Database(os.path.join(folder, 'data.db'))
+    db.create_tables()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'subscription_code': 1001}, {'subscription_code': 1002}])
+        conn.execute(insert(Order), [
+            {'invoice_id': 'INV1', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1001},
+            {'invoice_id': 'INV2', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 1002},
+            {'invoice_id': 'INV3', 'line_number': 1, 'product_code': 'P1', 'subscription_code': 9999},
+        ])
+        conn.execute(insert(Financial), [{'subscription_code': 1001}, {'subscription_code': 1002}])
+    return db
+
+
+def _codes(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(row[0] for row in conn.execute(f"SELECT subscription_code FROM {table}"))
+    finally:
+        conn.close()
+
+
+def test_orm_delete_removes_the_children_without_foreign_keys():
+    with tempfile.TemporaryDirectory() as folder:
+        db = _database(folder)
+        session = db.get_session()
+        try:
+            session.delete(session.get(User, 1001))
+            session.commit()
+        finally:
+            session.close()
+            dispose_engine(db.db_path)
+
+        assert _codes(db.db_path, 'users') == [1002]
+        assert _codes(db.db_path, 'orders') == [1002, 9999]
+        assert _codes(db.db_path, 'financials') == [1002]
+
+
+def test_purge_keeps_other_customers_and_orphans():
+    with tempfile.TemporaryDirectory() as folder:
+        db = _database(folder)
+        try:
+            counts = purge.purge_customers(db, codes=[1001])
+        finally:
+            dispose_engine(db.db_path)
+
+        assert (counts['users'], counts['orders'], counts['financials']) == (1, 1, 1)
+        assert _codes(db.db_path, 'orders') == [1002, 9999]
+        assert _codes(db.db_path, 'financials') == [1002]
@@ -0,0 +1,57 @@
+"""
+Search and filter conditions of the shared queries
+"""
+import os
+import tempfile
+import pandas as pd
+from sqlalchemy import insert
+from models import Database, Order, User, dispose_engine
+from normalize import normalized_identifiers
+import queries
+
+
+def _database(folder, users=()):
+    """A new database holding the given users, with their normalized identifiers"""
+    db = Database(os.path.join(folder, 'data.db'))
+    db.create_tables()
+    if users:
+        frame = pd.DataFrame(users, columns=['subscription_code', 'national_id', 'mobile', 'phone1', 'phone2',
+                                             'phone3', 'postal_code'])
+        frame = frame.assign(**normalized_identifiers(frame))
+        with db.engine.begin() as conn:
+            conn.execute(insert(User), frame.astype(object).where(frame.notna(), None).to_dict('records'))
+    return db
+
+
+def test_national_id_without_leading_zeros_is_found():
+    with tempfile.TemporaryDirectory() as folder:
+        db = _database(folder, [(1, '0072545402', None, None, None, None, None),
+                                (2, '7254000000', None, None, None, None, None)])
+        session = db.get_session()
+        try:
+            codes = lambda term: sorted(user.subscription_code for user in queries.search_users(session, term))
+
+            assert codes('72545402') == [1]
+            assert codes('۰۰۷۲۵۴۵۴۰۲') == [1]
+            assert codes('7254') == [2]  # still a prefix search
+        finally:
+            session.close()
+            dispose_engine(db.db_path)
+
+
+def test_date_bounds_are_zero_padded_like_stored_dates():
+    with tempfile.TemporaryDirectory() as folder:
+        db = _database(folder)
+        with db.engine.begin() as conn:
+            conn.execute(insert(Order), [
+                {'invoice_id': str(number), 'product_code': 'P', 'sending_date': date}
+                for number, date in enumerate(('1404/07/30', '1404/08/01', '1404/08/15', '1404/09/01'))
+            ])
+        session = db.get_session()
+        try:
+            conditions = queries.order_filters(date_from='1404/8/1', date_to='۱۴۰۴/۸/۱۵')
+            rows = queries.orders_page(session, conditions, sort='sending_date')
+            assert [row.sending_date for row in rows] == ['1404/08/01', '1404/08/15']
+        finally:
+            session.close()
+            dispose_engine(db.db_path)
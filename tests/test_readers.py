@@ -0,0 +1,75 @@
+"""
+The .xls, .xlsx and CSV readers produce the same imports
+"""
+import os
+import sqlite3
+import tempfile
+import pandas as pd
+from data_processor import DATASET_COLUMNS, DataProcessor, _convert_frame
+from models import dispose_engine
+from readers import read_chunks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = tuple(os.path.join(ROOT, name) for name in ('excel1.xls', 'excel2.xls', 'excel3 .xls'))
+
+
+def _convert_to(folder, extension):
+    """Write the sample sheets as .csv or .xlsx files and return their paths"""
+    paths = []
+    for number, source in enumerate(SAMPLE_FILES, 1):
+        sheet = pd.read_excel(source, dtype=object)
+        path = os.path.join(folder, f"excel{number}.{extension}")
+        if extension == 'csv':
+            sheet.to_csv(path, index=False)
+        else:
+            sheet.to_excel(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def _tables(path):
+    """Every stored row of the data tables, without row ids"""
+    conn = sqlite3.connect(path)
+    try:
+        tables = {}
+        for table in ('users', 'orders', 'financials'):
+            cursor = conn.execute(f"SELECT * FROM {table}")
+            names = [column[0] for column in cursor.description]
+            tables[table] = sorted(
+                repr(tuple(value for name, value in zip(names, row) if name != 'id')) for row in cursor
+            )
+        return tables
+    finally:
+        conn.close()
+
+
+def test_csv_xls_and_xlsx_imports_store_the_same_rows():
+    with tempfile.TemporaryDirectory() as folder:
+        stored = {}
+        for fmt, files in (('xls', SAMPLE_FILES), ('csv', _convert_to(folder, 'csv')),
+                           ('xlsx', _convert_to(folder, 'xlsx'))):
+            path = os.path.join(folder, f"{fmt}.db")
+            try:
+                stats = DataProcessor(path).import_all_data(*files)
+            finally:
+                dispose_engine(path)
+            assert not stats['errors'], fmt
+            stored[fmt] = _tables(path)
+
+        assert stored['csv'] == stored['xls']
+        assert stored['xlsx'] == stored['xls']
+
+
+def test_low_cardinality_columns_stay_categorical_through_conversion():
+    with tempfile.TemporaryDirectory() as folder:
+        columns = DATASET_COLUMNS['orders']
+        headers = {attribute: header for attribute, header, _ in columns}
+        for path in (SAMPLE_FILES[1], _convert_to(folder, 'csv')[1], _convert_to(folder, 'xlsx')[1]):
+            chunk = next(read_chunks(path, columns))
+            frame = _convert_frame(chunk, columns, 'order', [])
+
+            assert chunk[headers['product_code']].dtype == 'category', path
+            assert frame['product_code'].dtype == 'category', path
+            assert frame['warehouse_code'].dtype == 'category', path
+            assert frame['invoice_id'].dtype != 'category', path
+            assert frame['person_name'].dtype != 'category', path
@@ -0,0 +1,204 @@
+"""
+Upgrading older databases and appending to them without duplicating rows
+"""
+import os
+import sqlite3
+import tempfile
+from data_processor import DataProcessor, ORDER_COLUMNS
+from models import Database, dispose_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = tuple(os.path.join(ROOT, name) for name in ('excel1.xls', 'excel2.xls', 'excel3 .xls'))
+
+# The layout of data.db as the first release created it: no line numbers,
+# normalized identifiers, bookkeeping tables or schema version
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    subscription_code BIGINT NOT NULL, name VARCHAR(100), surname VARCHAR(100),
+    father_name VARCHAR(100), certificate_number VARCHAR(50), national_id VARCHAR(10),
+    second_name VARCHAR(100), phone1 VARCHAR(20), phone2 VARCHAR(20), phone3 VARCHAR(20),
+    mobile VARCHAR(20), fax VARCHAR(20), economic_code VARCHAR(50), address VARCHAR(500),
+    postal_code VARCHAR(10), email VARCHAR(100), province VARCHAR(100), city VARCHAR(100),
+    PRIMARY KEY (subscription_code)
+);
+CREATE TABLE orders (
+    id INTEGER NOT NULL, invoice_id VARCHAR(50), invoice_date VARCHAR(20), subscription_code BIGINT,
+    person_name VARCHAR(200), description VARCHAR(500), settlement_type VARCHAR(50),
+    settlement_date VARCHAR(20), expiry_date VARCHAR(20), person_subject_code VARCHAR(50),
+    operation_subject_code VARCHAR(50), invoice_nature_code VARCHAR(50), marketer_code VARCHAR(50),
+    amount_discount FLOAT, total_tax_percent FLOAT, total_toll_percent FLOAT, warehouse_code VARCHAR(50),
+    warehouse_name VARCHAR(200), product_code VARCHAR(50), product_name VARCHAR(300),
+    item_description VARCHAR(500), special_coef1 FLOAT, special_coef2 FLOAT, special_coef3 FLOAT,
+    quantity INTEGER, secondary_quantity FLOAT, price FLOAT, price_foreign FLOAT, discount_percent FLOAT,
+    tax_percent FLOAT, toll_percent FLOAT, sending_nature_code VARCHAR(50), sending_date VARCHAR(20),
+    total_value FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(subscription_code) REFERENCES users (subscription_code)
+);
+CREATE TABLE financials (
+    id INTEGER NOT NULL, subscription_code BIGINT, amount FLOAT, loan_code VARCHAR(50),
+    description VARCHAR(500),
+    PRIMARY KEY (id),
+    FOREIGN KEY(subscription_code) REFERENCES users (subscription_code)
+);
+"""
+
+
+def _create_baseline(path, source):
+    """Create a first-release database holding the rows of an imported one"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute("ATTACH ? AS source", (source,))
+        for table in ('users', 'orders', 'financials'):
+            columns = ', '.join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+            conn.execute(f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} ORDER BY rowid")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _query(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def _count(path, table):
+    return _query(path, f"SELECT COUNT(*) FROM {table}")[0][0]
+
+
+def test_append_to_baseline_database_skips_stored_order_lines():
+    with tempfile.TemporaryDirectory() as folder:
+        imported = os.path.join(folder, 'imported.db')
+        baseline = os.path.join(folder, 'baseline.db')
+        try:
+            DataProcessor(imported).import_all_data(*SAMPLE_FILES)
+            _create_baseline(baseline, imported)
+            orders = _count(baseline, 'orders')
+            assert orders > 0
+
+            stats = DataProcessor(baseline).import_all_data(*SAMPLE_FILES, replace=False)
+
+            assert stats['orders_imported'] == 0
+            assert stats['orders_duplicates'] == orders
+            assert _count(baseline, 'orders') == orders
+            assert _count(baseline, 'orders WHERE line_number IS NULL') == 0
+            assert stats['financials_imported'] == 0
+            assert _count(baseline, 'financials') == _count(imported, 'financials')
+        finally:
+            dispose_engine(imported)
+            dispose_engine(baseline)
+
+
+def test_upgrade_numbers_lines_within_each_invoice():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'baseline.db')
+        conn = sqlite3.connect(path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany("INSERT INTO orders (id, invoice_id, product_code) VALUES (?, ?, ?)",
+                         [(1, 'A', 'p1'), (2, 'B', 'p1'), (3, 'A', 'p2'), (4, 'A', 'p1')])
+        conn.commit()
+        conn.close()
+        try:
+            Database(path).create_tables()
+            assert _query(path, "SELECT id, line_number FROM orders ORDER BY id") == [(1, 1), (2, 1), (3, 2), (4, 3)]
+        finally:
+            dispose_engine(path)
+
+
+def test_upgrade_stores_missing_order_keys_as_empty_and_drops_their_copies():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'v10.db')
+        conn = sqlite3.connect(path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute("ALTER TABLE orders ADD COLUMN line_number INTEGER")
+        # Version 10 stored missing keys as NULL and appended such lines again on every run
+        conn.executemany("INSERT INTO orders (id, invoice_id, product_code, line_number) VALUES (?, ?, ?, ?)",
+                         [(1, 'A', None, 1), (2, 'A', 'p1', 2), (3, None, 'p1', 1), (4, 'A', None, 1)])
+        conn.execute("PRAGMA user_version = 10")
+        conn.commit()
+        conn.close()
+        try:
+            Database(path).create_tables()
+            assert _query(path, "SELECT id, invoice_id, product_code, line_number FROM orders ORDER BY id") == [
+                (1, 'A', '', 1), (2, 'A', 'p1', 2), (3, '', 'p1', 1)
+            ]
+        finally:
+            dispose_engine(path)
+
+
+def test_append_skips_order_lines_with_missing_keys():
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        orders = os.path.join(folder, 'orders.csv')
+        headers = {attribute: header for attribute, header, _ in ORDER_COLUMNS}
+        sheet = pd.read_excel(SAMPLE_FILES[1], dtype=object)
+        sheet.loc[sheet.index[:6], headers['product_code']] = None
+        sheet.loc[sheet.index[6:8], headers['invoice_id']] = None
+        sheet.to_csv(orders, index=False)
+        files = (SAMPLE_FILES[0], orders, SAMPLE_FILES[2])
+        try:
+            processor = DataProcessor(path)
+            processor.import_all_data(*files)
+            stored = _count(path, 'orders')
+            assert _count(path, "orders WHERE product_code = '' OR invoice_id = ''") > 0
+
+            stats = processor.import_all_data(*files, replace=False)
+            assert stats['orders_imported'] == 0
+            processor.import_batch(orders=[orders])
+
+            assert _count(path, 'orders') == stored
+            assert _count(path, 'orders WHERE product_code IS NULL OR invoice_id IS NULL') == 0
+        finally:
+            dispose_engine(path)
+
+
+def test_upgrade_numbers_identical_financial_records():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'baseline.db')
+        conn = sqlite3.connect(path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany("INSERT INTO financials (id, subscription_code, amount, loan_code, description) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [(1, 7, 100.0, 'L1', None), (2, 7, 100.0, 'L1', None), (3, 7, 100.0, 'L2', None),
+                          (4, 8, None, None, 'x')])
+        conn.commit()
+        conn.close()
+        try:
+            Database(path).create_tables()
+            assert _query(path, "SELECT id, loan_code, amount, description, entry_number FROM financials "
+                                "ORDER BY id") == [
+                (1, 'L1', 100.0, '', 1), (2, 'L1', 100.0, '', 2), (3, 'L2', 100.0, '', 1), (4, '', 0.0, 'x', 1)
+            ]
+        finally:
+            dispose_engine(path)
+
+
+def test_append_skips_stored_financial_records_but_keeps_repeats_within_a_file():
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        financials = os.path.join(folder, 'financials.csv')
+        sheet = pd.read_excel(SAMPLE_FILES[2], dtype=object)
+        # The same installment twice in one export is two records
+        pd.concat([sheet, sheet.iloc[:1]]).to_csv(financials, index=False)
+        try:
+            processor = DataProcessor(path)
+            processor.import_all_data(SAMPLE_FILES[0], SAMPLE_FILES[1], financials)
+            stored = _query(path, "SELECT COUNT(*), SUM(amount) FROM financials")
+            assert stored[0][0] == len(sheet) + 1
+
+            stats = processor.import_all_data(SAMPLE_FILES[0], SAMPLE_FILES[1], financials, replace=False)
+            assert (stats['financials_imported'], stats['financials_duplicates']) == (0, len(sheet) + 1)
+            stats = processor.import_batch(financials=[SAMPLE_FILES[2]])
+            assert (stats['financials_imported'], stats['financials_duplicates']) == (0, len(sheet))
+
+            assert _query(path, "SELECT COUNT(*), SUM(amount) FROM financials") == stored
+        finally:
+            dispose_engine(path)
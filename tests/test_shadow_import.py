@@ -0,0 +1,103 @@
+"""
+Shadow imports: the new database is swapped in only when it is complete
+"""
+import os
+import sqlite3
+import tempfile
+from cube import SalesCube
+from data_processor import DataProcessor
+from integrity import IntegrityAudit
+from models import dispose_engine
+from progress import CancelToken
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = tuple(os.path.join(ROOT, name) for name in ('excel1.xls', 'excel2.xls', 'excel3 .xls'))
+
+
+def _state(path):
+    """Row counts, import generation and journal mode of a database file"""
+    conn = sqlite3.connect(path)
+    try:
+        counts = tuple(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                       for table in ('users', 'orders', 'financials'))
+        generation = conn.execute("SELECT value FROM app_meta WHERE key = 'import_generation'").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        return counts, generation, journal_mode
+    finally:
+        conn.close()
+
+
+def _leftovers(folder):
+    """Shadow files left next to the live database"""
+    return [name for name in os.listdir(folder) if '.importing' in name]
+
+
+def test_shadow_import_swaps_in_a_complete_wal_database():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        try:
+            processor = DataProcessor(path)
+            processor.import_all_data(*SAMPLE_FILES)
+            counts, generation, _ = _state(path)
+            # Derived data is stored before the generation is published
+            assert SalesCube(processor.db).is_current() and IntegrityAudit(processor.db).is_current()
+
+            stats = processor.import_all_data(*SAMPLE_FILES, shadow=True)
+
+            assert not stats['errors']
+            assert _state(path) == (counts, generation + 1, 'wal')
+            # Readers on the pooled engine see the new file
+            assert processor.get_statistics()['orders_count'] == counts[1]
+            assert processor.db.integrity_check() == 'ok'
+            assert SalesCube(processor.db).is_current() and IntegrityAudit(processor.db).is_current()
+            assert _leftovers(folder) == []
+        finally:
+            dispose_engine(path)
+
+
+def test_failed_shadow_import_leaves_the_live_database_untouched():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        try:
+            processor = DataProcessor(path)
+            processor.import_all_data(*SAMPLE_FILES)
+            before = _state(path)
+
+            missing = os.path.join(folder, 'missing.xls')
+            stats = processor.import_all_data(SAMPLE_FILES[0], missing, SAMPLE_FILES[2], shadow=True)
+
+            assert any('New database rejected' in error for error in stats['errors'])
+            assert stats['users_imported'] == stats['orders_imported'] == 0
+            assert _state(path) == before
+            assert _leftovers(folder) == []
+
+            conn = sqlite3.connect(path)
+            status, = conn.execute("SELECT status FROM import_runs ORDER BY id DESC LIMIT 1").fetchone()
+            conn.close()
+            assert status == 'failed'
+        finally:
+            dispose_engine(path)
+
+
+def test_cancelled_shadow_import_is_discarded():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.db')
+        token = CancelToken()
+
+        def cancel_after_users(event):
+            if event['stage'] == 'users' and event['done']:
+                token.cancel()
+
+        try:
+            processor = DataProcessor(path)
+            processor.import_all_data(*SAMPLE_FILES)
+            before = _state(path)
+
+            stats = processor.import_all_data(*SAMPLE_FILES, shadow=True, progress_callback=cancel_after_users,
+                                              cancel_token=token)
+
+            assert stats['cancelled']
+            assert _state(path) == before
+            assert _leftovers(folder) == []
+        finally:
+            dispose_engine(path)
@@ -0,0 +1,148 @@
+"""
+Vectorized validation rules for imported batches
+
+Each rule turns a converted batch into a boolean mask of invalid rows.
+Rows failing an 'error' rule are dropped before they are written; rows
+failing a 'warning' rule are kept. Both are counted per rule.
+"""
+from sqlalchemy import select
+from models import User
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Dataset -> [(rule, default severity, description)]; rule names map to Validator._<rule>
+RULES = {
+    'users': [
+        ('national_id_format', WARNING, "national ID is not 10 or 11 digits"),
+        ('national_id_checksum', WARNING, "national ID fails the checksum"),
+        ('postal_code_format', WARNING, "postal code is not 10 digits"),
+        ('mobile_format', WARNING, "mobile is not a 09xxxxxxxxx number"),
+    ],
+    'orders': [
+        ('negative_quantity', ERROR, "quantity is negative"),
+        ('negative_price', ERROR, "price is negative"),
+        ('unknown_customer', WARNING, "subscription code is not a known user"),
+    ],
+    'financials': [
+        ('negative_amount', WARNING, "amount is negative"),
+        ('unknown_customer', WARNING, "subscription code is not a known user"),
+    ],
+}
+
+
+def national_id_checksum_invalid(ids):
+    """Mask of 10-digit national IDs whose check digit is wrong
+
+    The check digit is derived from sum(digit[i] * (10 - i)) % 11 over the
+    first nine digits; IDs of one repeated digit are invalid too. Missing
+    and non-10-digit values are not flagged here.
+    """
+    import numpy as np
+
+    valid_shape = ids.str.fullmatch(r'[0-9]{10}').fillna(False).to_numpy(dtype=bool)
+    invalid = np.zeros(len(ids), dtype=bool)
+    if not valid_shape.any():
+        return invalid
+
+    text = ''.join(ids[valid_shape].tolist()).encode('ascii')
+    digits = (np.frombuffer(text, dtype=np.uint8) - ord('0')).reshape(-1, 10).astype(np.int64)
+
+    remainder = (digits[:, :9] * np.arange(10, 1, -1)).sum(axis=1) % 11
+    expected = np.where(remainder < 2, remainder, 11 - remainder)
+    repeated = (digits == digits[:, :1]).all(axis=1)
+
+    invalid[valid_shape] = (digits[:, 9] != expected) | repeated
+    return invalid
+
+
+class Validator:
+    """Applies the rules of a dataset to each batch and counts failures"""
+
+    def __init__(self, db, counts=None, severities=None):
+        self.db = db
+        self.counts = counts if counts is not None else {}
+        self.severities = severities or {}
+        self._known_codes = None
+        self._new_codes = []
+
+    def severity(self, rule, default):
+        """Severity of a rule, honouring overrides passed to the validator"""
+        return self.severities.get(rule, default)
+
+    def apply(self, dataset, frame):
+        """Count rule failures in a batch and return it without the rows failing an error rule"""
+        import numpy as np
+
+        rejected = np.zeros(len(frame), dtype=bool)
+        for rule, default, _ in RULES.get(dataset, []):
+            invalid = np.asarray(getattr(self, f'_{rule}')(frame), dtype=bool)
+            failures = int(invalid.sum())
+            if not failures:
+                continue
+            key = f"{dataset}.{rule}"
+            self.counts[key] = self.counts.get(key, 0) + failures
+            if self.severity(rule, default) == ERROR:
+                rejected |= invalid
+
+        if rejected.any():
+            frame = frame[~rejected]
+        if dataset == 'users':
+            self._new_codes.append(frame['subscription_code'].dropna().to_numpy(dtype=np.int64))
+        return frame
+
+    def summary(self):
+        """Return [(dataset, rule, severity, description, count)] for the rules that failed"""
+        rows = []
+        for dataset, rules in RULES.items():
+            for rule, default, description in rules:
+                count = self.counts.get(f"{dataset}.{rule}", 0)
+                if count:
+                    rows.append((dataset, rule, self.severity(rule, default), description, count))
+        return rows
+
+    # Rules: each returns a boolean mask of invalid rows
+
+    def _national_id_format(self, frame):
+        ids = frame['national_id_norm']
+        return (ids.notna() & ~ids.str.fullmatch(r'[0-9]{10,11}').fillna(False)).to_numpy(dtype=bool)
+
+    def _national_id_checksum(self, frame):
+        return national_id_checksum_invalid(frame['national_id_norm'])
+
+    def _postal_code_format(self, frame):
+        codes = frame['postal_code_norm']
+        return (codes.notna() & ~codes.str.fullmatch(r'[0-9]{10}').fillna(False)).to_numpy(dtype=bool)
+
+    def _mobile_format(self, frame):
+        mobiles = frame['mobile_norm']
+        return (mobiles.notna() & ~mobiles.str.fullmatch(r'9[0-9]{9}').fillna(False)).to_numpy(dtype=bool)
+
+    def _negative_quantity(self, frame):
+        return (frame['quantity'].fillna(0) < 0).to_numpy(dtype=bool)
+
+    def _negative_price(self, frame):
+        return (frame['price'].fillna(0) < 0).to_numpy(dtype=bool)
+
+    def _negative_amount(self, frame):
+        return (frame['amount'].fillna(0) < 0).to_numpy(dtype=bool)
+
+    def _unknown_customer(self, frame):
+        import numpy as np
+
+        known = self.known_codes()
+        codes = frame['subscription_code'].to_numpy(dtype=np.int64, na_value=0)
+        return ~np.isin(codes, known)
+
+    def known_codes(self):
+        """Sorted array of user codes in the database plus those seen in this run"""
+        import numpy as np
+
+        if self._known_codes is None:
+            with self.db.engine.connect() as conn:
+                stored = conn.execute(select(User.subscription_code)).scalars().all()
+            self._known_codes = np.array(stored, dtype=np.int64)
+        if self._new_codes:
+            self._known_codes = np.union1d(self._known_codes, np.concatenate(self._new_codes))
+            self._new_codes = []
+        return self._known_codes